@@ -0,0 +1,90 @@
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+
+import numpy as np
+
+import environment_utils
+import weather_store
+
+'''
+Offline import of the DWD archive of daily climate observations ("kl daily") into the weather store.
+The archive is a folder of zip files as offered by DWD, e.g. tageswerte_KL_01420_19490101_20221231_hist.zip (historical)
+or tageswerte_KL_01420_akt.zip (recent). Each zip contains the observations as produkt_klima_tag_*.txt, a csv file
+separated by ';' with one row per day and -999 for missing values.
+The files are parsed in parallel, every parsed station is written into the weather store right away, so only a few
+stations are held in memory at once.
+'''
+
+archive_pattern = re.compile(r"tageswerte_KL_(\d+)_.*\.zip$", re.IGNORECASE)
+
+# Columns of the product file for each of the weather_store.weather_variables
+# TXK: Maximum temperature in 2m, RSK: Precipitation height, UPM: Mean relative humidity
+archive_columns = {"temperature": "TXK", "rain": "RSK", "humidity": "UPM"}
+
+
+def archive_files(directory, station_ids):
+    # All archive files of the given stations in directory
+    # Historical files are sorted before the recent file of the same station, so the newer values are written last
+    files = []
+    for name in os.listdir(directory):
+        match = archive_pattern.match(name)
+        if match is not None and int(match.group(1)) in station_ids:
+            files.append([int(match.group(1)), name.lower().endswith("_akt.zip"), os.path.join(directory, name)])
+    return [[station_id, filename] for station_id, recent, filename in sorted(files)]
+
+
+def parse_product(lines):
+    # Parse the lines of a product file into the days as numbers and a [days x weather_variables] array
+    header = [column.strip().upper() for column in next(lines).split(";")]
+    positions = [header.index("MESS_DATUM")] + [header.index(archive_columns[v])
+                                                for v in weather_store.weather_variables]
+    rows = []
+    for line in lines:
+        parts = line.split(";")
+        if len(parts) < len(header) - 1:
+            continue
+        rows.append([float(parts[p]) for p in positions])
+    rows = np.array(rows, dtype=np.float64).reshape(-1, len(positions))
+    values = rows[:, 1:]
+    values[values == -999] = np.nan
+    return rows[:, 0].astype(np.int64), values
+
+
+def read_archive(filename):
+    # Read the observations of one zip file of the archive
+    with zipfile.ZipFile(filename) as archive:
+        products = [name for name in archive.namelist() if os.path.basename(name).startswith("produkt_klima_tag")]
+        if len(products) == 0:
+            print("No observations found in " + filename)
+            return np.empty(0, dtype=np.int64), np.empty((0, len(weather_store.weather_variables)))
+        with archive.open(products[0]) as fp:
+            return parse_product(iter(io.TextIOWrapper(fp, encoding="latin-1")))
+
+
+def read_archive_worker(task):
+    station_id, filename = task
+    numbers, values = read_archive(filename)
+    return station_id, numbers, values
+
+
+def ingest_archives(directory, workers=os.cpu_count(), con=None):
+    # Import all archive files in directory that belong to the stations of ha_messnetz.csv into the weather store
+    station_ids = set(station['station_id'] for station in environment_utils.get_stations())
+    files = archive_files(directory, station_ids)
+    print("Importing " + str(len(files)) + " archive files")
+
+    own_connection = con is None
+    if own_connection:
+        con = weather_store.connect()
+    days = 0
+    with multiprocessing.Pool(max(1, workers)) as pool:
+        # imap keeps the order of the files, so recent values replace historical ones
+        for station_id, numbers, values in pool.imap(read_archive_worker, files):
+            weather_store.insert_series(con, station_id, numbers, values)
+            days += len(numbers)
+    if own_connection:
+        con.close()
+    print("Imported " + str(days) + " days of " + str(len(set(f[0] for f in files))) + " stations")
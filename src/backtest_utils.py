@@ -0,0 +1,145 @@
+import datetime
+import itertools
+
+import numpy as np
+
+import constants
+import environment_utils
+import factor_calculations
+import interpolation_utils
+import sql_utils
+import utils
+import weather_store
+
+'''
+Backtesting of the parameters of the dynamic factor (see factor_calculations.dynamic_parameters) against the recorded
+findings of location_engine.
+For every parameter set, the dynamic factor of every station and day of a weather history is calculated in batches
+directly on the [stations x days] matrices, without creating any patches. A parameter set is scored by how high the
+factor of its station on the day of each finding ranks among all days of that station: the skill score is the mean of
+these ranks, 0.5 means the factor is no better than chance and 1.0 means every finding was on the best day.
+'''
+
+findings_file = constants.pwd + "/data/locations.db"
+
+
+def parameter_sets(grid):
+    # All combinations of a parameter grid, e.g. {"optimal_temp": [12, 15, 18], "mix": [(2, 1, 0.7), (1, 1, 1)]}
+    # Parameters that are not in the grid keep their value of factor_calculations.dynamic_parameters
+    names = sorted(grid.keys())
+    return [dict(factor_calculations.dynamic_parameters, **dict(zip(names, values)))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def read_findings(filename=None):
+    # Coordinates ([lat, lon]) and days (as weather_store.day_number) of all findings with a known day
+    cursor, con = sql_utils.connect_database(findings_file if filename is None else filename)
+    # Databases created before the findings had a day do not have its column yet
+    sql_utils.add_missing_column(cursor, "findings", "day", "integer")
+    con.commit()
+    rows = cursor.execute("SELECT location_x, location_y, day FROM findings WHERE day IS NOT NULL").fetchall()
+    con.close()
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return rows[:, :2], rows[:, 2].astype(np.int64)
+
+
+def window_days(weather):
+    # Day (as number) that each window of factor_calculations.environment_factors belongs to:
+    # The window starting at weather.days[i] ends 3 days before its day, see utils.weather_days
+    return np.array([weather_store.day_number(day + datetime.timedelta(days=30))
+                     for day in weather.days[:len(weather.days) - 27]], dtype=np.int64)
+
+
+def map_findings(coords, days, weather):
+    # Station (closest station of the weather) and window of each finding
+    # Findings outside of the days of the weather are left out
+    stations = {station['station_id']: station for station in environment_utils.get_stations()}
+    station_coords = np.array([[stations[station_id]['geo_lat'], stations[station_id]['geo_lon']]
+                               for station_id in weather.station_ids], dtype=np.float64)
+    nearest, distances = interpolation_utils.nearest_stations(coords, station_coords, 1)
+
+    numbers = window_days(weather)
+    windows = np.searchsorted(numbers, days)
+    inside = (windows < len(numbers)) & (numbers[np.minimum(windows, len(numbers) - 1)] == days)
+    return nearest[inside, 0], windows[inside]
+
+
+def average_ranks(values):
+    # Rank of each value along the last axis from 0 (smallest) to n - 1 (largest)
+    # Equal values get the mean of their ranks, so the order of ties does not change the result
+    n = values.shape[-1]
+    positions = np.arange(n)
+    order = np.argsort(values, axis=-1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+    # First and last position of the group of equal values of each sorted value
+    new_group = np.ones(values.shape, dtype=bool)
+    new_group[..., 1:] = sorted_values[..., 1:] != sorted_values[..., :-1]
+    last_of_group = np.ones(values.shape, dtype=bool)
+    last_of_group[..., :-1] = new_group[..., 1:]
+    starts = np.maximum.accumulate(np.where(new_group, positions, 0), axis=-1)
+    ends = np.minimum.accumulate(np.where(last_of_group, positions, n - 1)[..., ::-1], axis=-1)[..., ::-1]
+    ranks = np.empty(values.shape, dtype=np.float64)
+    np.put_along_axis(ranks, order, (starts + ends) / 2, axis=-1)
+    return ranks
+
+
+def backtest(weather, finding_stations, finding_windows, sets):
+    # Skill score of each parameter set
+    # The parts of the factor that do not depend on the parameters are calculated once, the parameter sets are
+    # evaluated in chunks of [sets x stations x windows] arrays
+    rains, temperatures, humidities = factor_calculations.fill_missing(
+        weather.variable("rain").astype(np.float64), weather.variable("temperature").astype(np.float64),
+        weather.variable("humidity").astype(np.float64))
+    rain_means = factor_calculations.segment_means(np.minimum(rains, 25))
+    hum_val = factor_calculations.window_sums(np.where(np.isnan(humidities), 60, humidities), 1, 1, 1) / \
+              factor_calculations.optimal_humidty / factor_calculations.norm_hum
+
+    # The temperature part only depends on the optimal temperature, so it is calculated once per value
+    temp_vals = {}
+    for parameters in sets:
+        optimal_temp = parameters["optimal_temp"]
+        if optimal_temp not in temp_vals:
+            deviation = factor_calculations.temp_deviation(temperatures, optimal_temp)
+            temp_vals[optimal_temp] = np.minimum(
+                factor_calculations.window_sums(deviation, 0.3, 0.75, 2) / factor_calculations.norm_temp, 3)
+
+    windows = hum_val.shape[-1]
+    chunk = max(1, int(constants.backtest_chunk_values // hum_val.size))
+    scores = np.empty(len(sets), dtype=np.float64)
+    for start in range(0, len(sets), chunk):
+        chunk_sets = sets[start:start + chunk]
+        rain_weights = np.array([parameters["rain_weights"] for parameters in chunk_sets], dtype=np.float64)
+        mix = np.array([parameters["mix"] for parameters in chunk_sets], dtype=np.float64)
+
+        norm_rain = rain_weights @ np.array([14, 7, 7], dtype=np.float64)
+        rain_val = np.minimum(np.einsum('cj,jsw->csw', rain_weights, rain_means) / norm_rain[:, None, None] /
+                              factor_calculations.optimal_rain, 3)
+        temp_val = np.stack([temp_vals[parameters["optimal_temp"]] for parameters in chunk_sets])
+        factors = (mix[:, 0, None, None] * rain_val + mix[:, 1, None, None] * temp_val +
+                   mix[:, 2, None, None] * hum_val[None]) / np.sum(mix, axis=1)[:, None, None]
+
+        # Rank of each day among all days of its station, from 0 (worst) to 1 (best), days with equal factors (e.g.
+        # clamped in dry windows) share their rank
+        ranks = average_ranks(factors) / max(windows - 1, 1)
+        scores[start:start + chunk] = np.mean(ranks[:, finding_stations, finding_windows], axis=1)
+    return scores
+
+
+def run_backtest(first_day, last_day, grid, findings=None):
+    # Evaluate the parameter grid on all days from first_day to last_day with the weather of all stations in the
+    # weather store (e.g. imported with archive_utils) and print the best parameter sets
+    station_ids = sorted(station['station_id'] for station in environment_utils.get_stations())
+    con = weather_store.connect()
+    weather = weather_store.load(con, station_ids, utils.weather_days(first_day, last_day))
+    con.close()
+
+    finding_stations, finding_windows = map_findings(*read_findings(findings), weather)
+    sets = parameter_sets(grid)
+    print("Evaluating " + str(len(sets)) + " parameter sets on " + str(len(finding_stations)) + " findings")
+    scores = backtest(weather, finding_stations, finding_windows, sets)
+
+    baseline = backtest(weather, finding_stations, finding_windows, [factor_calculations.dynamic_parameters])[0]
+    print("Score of the current parameters: " + str(baseline))
+    for i in np.argsort(-scores)[:10]:
+        print(str(scores[i]) + ": " + str(sets[i]))
+    return sets, scores
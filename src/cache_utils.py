@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+
+import constants
+
+'''
+Cache for artifacts derived from the source data, e.g. the polygon stores, spatial indices and rasters of the shape
+files. Every artifact is stored together with a key: a hash of the files it was created from and of all parameters
+(region, point distance, ...) used to create it. An artifact is only rebuilt if its key changed, so changed source data
+is never ignored and unchanged artifacts are never rebuilt.
+The keys are stored in a manifest next to the dumps.
+'''
+
+manifest_file = constants.pwd + "/data/dumps/cache_manifest.json"
+
+# Increase this when the format of the artifacts changes, so all of them are rebuilt
+cache_version = 1
+
+
+def read_manifest():
+    if not os.path.exists(manifest_file):
+        return {"files": {}, "artifacts": {}}
+    with open(manifest_file) as fp:
+        return json.load(fp)
+
+
+def write_manifest(manifest):
+    with open(manifest_file + ".tmp", "w") as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+
+def file_digest(filename, manifest):
+    # Hash of the content of a file
+    # Hashing large shape files takes a while, so the hash is reused as long as size and modification time are equal
+    stat = os.stat(filename)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    known = manifest["files"].get(filename)
+    if known is not None and known["stamp"] == stamp:
+        return known["digest"]
+
+    sha = hashlib.sha256()
+    with open(filename, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            sha.update(block)
+    manifest["files"][filename] = {"stamp": stamp, "digest": sha.hexdigest()}
+    return sha.hexdigest()
+
+
+def artifact_key(source_files, **params):
+    # Key of an artifact created from source_files with the given parameters
+    # Missing source files are part of the key as well, so adding one later also changes the key
+    manifest = read_manifest()
+    digests = [file_digest(f, manifest) if os.path.exists(f) else None for f in source_files]
+    write_manifest(manifest)
+    description = {"version": cache_version, "files": [[os.path.basename(f), d] for f, d in zip(source_files, digests)],
+                   "params": params}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def shape_files(shape_folder):
+    # All files that belong to a shape file
+    return [shape_folder + ending for ending in [".shp", ".shx", ".dbf", ".prj", ".cpg"]]
+
+
+def cached(name, path, key, build, write, read):
+    # Return the artifact stored at path, rebuild and store it first if it was created with a different key
+    manifest = read_manifest()
+    if manifest["artifacts"].get(name) != key or not os.path.exists(path):
+        print("Rebuilding " + name)
+        write(build(), path)
+        manifest = read_manifest()
+        manifest["artifacts"][name] = key
+        write_manifest(manifest)
+    else:
+        print("Using cached " + name)
+    return read(path)
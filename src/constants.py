@@ -38,3 +38,54 @@ points_per_patch_sqrt = 10
 
 cwd = os.getcwd()
 pwd = str(Path(cwd).parent.absolute())
+
+# Value given to a point that does not lie in any tree- or soil-shape
+no_match = -1
+no_value = ""
+
+# Size of a cell of the spatial index for tree- and soil-shapes in degrees (Roughly 1km)
+index_cell_size = 0.01
+
+# Amount of DWD stations that are fetched at the same time and how often a failed fetch is repeated
+weather_workers = 8
+weather_retries = 3
+# Seconds to wait before the first repetition, doubled for each further one
+weather_retry_delay = 1.0
+# DWD may still correct the observation of a day during this amount of days, until then it is fetched again each run
+weather_final_days = 7
+
+# Interpolation of the weather between stations: amount of closest stations blended for each patch, power of the
+# inverse distance weighting and distance in km below which all stations count as equally close
+interpolation_stations = 4
+interpolation_power = 2
+min_station_dist = 0.1
+# Size of a cell of the spatial index for the stations in degrees
+station_cell_size = 0.25
+# Kilometers per degree of latitude and per degree of longitude at the equator
+km_per_lat = 110.574
+km_per_lon = 111.32
+
+# Amount of values (parameter sets x stations x days) that are evaluated at once by the backtesting
+backtest_chunk_values = 20000000
+
+# Amount of classes the probabilities are quantized into for the map, touching points of the same class are joined
+# into one polygon
+probability_classes = 100
+
+# Vector tiles of the map: zoom levels that are written, units per tile side, overlap of neighbouring tiles in these
+# units and size of a tile on the screen in pixels (used to generalize the lower zoom levels)
+tile_min_zoom = 6
+tile_max_zoom = 12
+tile_extent = 4096
+tile_buffer = 64
+tile_size = 256
+
+# Image tiles for the zoomed out views of the map: zoom levels that are written and size of a tile in pixels
+# If they are written, the vector tiles start above raster_max_zoom
+raster_min_zoom = 5
+raster_max_zoom = 10
+raster_tile_size = 256
+
+# GEOJSON output: decimals of the coordinates (5 is about 1m) and quality of the brotli compressed copy (0 to 11)
+geojson_precision = 5
+brotli_quality = 9
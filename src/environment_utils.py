@@ -1,15 +1,24 @@
 import datetime
 from dwdweather import DwdWeather
 import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from numpy import genfromtxt
 import constants
 
 '''
 Utilities dealing with receiving and processing weather data from the Deutscher Wetterdienst.
+Weather is fetched in bulk: the whole series of days of each station is requested at once, every station only once,
+and the stations are fetched concurrently. The source of the data is a backend with a method
+fetch(station_id, days) -> one record (dict of DWD fields) or None per day, so it can be replaced, e.g. by a local fake.
 '''
 
 
+# All DWD stations with their id and position
+stations_file = constants.pwd + "/data/ha_messnetz.csv"
+
 dwd = DwdWeather(resolution="daily")
 querried = {};
 
@@ -17,7 +26,7 @@ querried = {};
 def get_stations():
     # Read in DWD stations
     stations = []
-    my_data = genfromtxt(constants.pwd + "/data/ha_messnetz.csv", delimiter=',')[1:]
+    my_data = genfromtxt(stations_file, delimiter=',')[1:]
     for data in my_data:
         dic = {'station_id': int(data[0]), 'geo_lat': data[9], 'geo_lon': data[10], 'name': data[1]}
         stations.append(dic)
@@ -65,3 +74,65 @@ def read_dwd_stations(filename):
         stations = np.array(stations)
         return np.array(stations)
 
+
+class DwdBackend:
+    # Backend that reads the daily observations through dwdweather2
+    # dwdweather2 keeps the data in a local sqlite cache, which can only be used by the thread that opened it,
+    # so each thread gets its own client
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def client(self):
+        if not hasattr(self.local, "dwd"):
+            self.local.dwd = DwdWeather(resolution="daily")
+        return self.local.dwd
+
+    def read_cache(self, station_id, days):
+        # All cached records of the station between the first and the last day in one query
+        client = self.client()
+        date_format = client.get_timestamp_format()
+        sql = "SELECT * FROM %s WHERE station_id=? AND datetime BETWEEN ? AND ?" % client.get_measurement_table()
+        cursor = client.db.cursor()
+        cursor.execute(sql, (station_id, int(days[0].strftime(date_format)), int(days[-1].strftime(date_format))))
+        records = {row["datetime"]: row for row in cursor.fetchall()}
+        cursor.close()
+        return [records.get(int(day.strftime(date_format))) for day in days]
+
+    def fetch(self, station_id, days):
+        records = self.read_cache(station_id, days)
+        if any(record is None for record in records):
+            # One download contains the recent observations of all days of the station
+            # Days that are still missing afterwards are not published yet and stay None
+            self.client().import_measures(station_id, latest=True)
+            records = self.read_cache(station_id, days)
+        return records
+
+
+def fetch_with_retries(backend, station_id, days, retries):
+    # Fetch the series of one station, failed requests are retried with increasing waiting time
+    # Returns None if all attempts failed
+    for attempt in range(retries + 1):
+        try:
+            return backend.fetch(station_id, days)
+        except Exception as e:
+            if attempt == retries:
+                print(f"Could not fetch weather of station {station_id}: {e}")
+                return None
+            time.sleep(constants.weather_retry_delay * 2 ** attempt)
+
+
+def fetch_weather(station_ids, days, backend=None, workers=constants.weather_workers,
+                  retries=constants.weather_retries):
+    # Fetch the weather of all days for all stations
+    # Returns a dictionary station_id -> list with one record (or None) per day and the list of stations that could not
+    # be fetched at all, these are not part of the dictionary
+    if backend is None:
+        backend = DwdBackend()
+    days = sorted(days)
+    stations = sorted(set(int(station_id) for station_id in station_ids))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        series = dict(zip(stations, executor.map(
+            lambda station_id: fetch_with_retries(backend, station_id, days, retries), stations)))
+    failed = [station_id for station_id in stations if series[station_id] is None]
+    return {station_id: records for station_id, records in series.items() if records is not None}, failed
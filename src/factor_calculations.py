@@ -1,8 +1,25 @@
 import mushroom
-import datetime
-import utils
 import soil
-from numba import jit
+import constants
+import cache_utils
+import weather_store
+import interpolation_utils
+import io_utils
+import functools
+import numpy as np
+
+mushroom_file = constants.pwd + "/data/mushrooms_databank.xml"
+soil_file = constants.pwd + "/data/soil_databank.xml"
+
+# Parameters of the dynamic factor that can be tuned with backtest_utils:
+# Weights of the rain in the three segments of the 28 days (see window_weights), optimal temperature and the weights
+# of rain, temperature and humidity in the final factor
+dynamic_parameters = {"rain_weights": (0.5, 3, 0.75), "optimal_temp": 15, "mix": (2, 1, 0.7)}
+# Fixed normalization of the dynamic factor
+optimal_rain = 0.3
+optimal_humidty = 90
+norm_temp = 3
+norm_hum = 2.0
 
 
 def tree_value(mushroom, tree_type: str):
@@ -43,116 +60,182 @@ def soil_value(mushroom, soil):
     soil_score = float(soil.attr["score"])
     return ph_val * soil_val #* soil_score
 
-def get_month_factors(month):
-    # Factor that indicates if mushroom is in season
-    ret = {}
-    mushroooms = mushroom.read_mushroom_XML('../data/mushrooms_databank.xml')
-    for s_name in mushroooms.keys():
-        ret[s_name] = int(
-            int(mushroooms[s_name].attr['seasonStart']) <= month <= int(mushroooms[s_name].attr['seasonEnd']))
-    return ret
 
+def tree_factors(mushrooms, tree_names):
+    # Tree factor of each tree-type (rows) for each mushroom type (columns)
+    # The last row belongs to points without a tree-type (constants.no_match)
+    return np.array([[tree_value(shroom, tree) for shroom in mushrooms.values()]
+                     for tree in tree_names + [constants.no_value]], dtype=np.float32)
 
-def calc_static_values(patches):
+
+def soil_factors(mushrooms, soils, soil_names):
+    # Soil factor of each soil-type (rows) for each mushroom type (columns)
+    # The last row belongs to points without a soil-type (constants.no_match)
+    # Soil-types that are not in the databank get a factor of 0
+    unknown = sorted(set(name.lower() for name in soil_names if name.lower() not in soils))
+    if len(unknown) > 0:
+        print("Warning: " + str(len(unknown)) + " soil-types are not in the soil databank: " + ", ".join(unknown))
+    return np.array([[soil_value(shroom, soils[soil_t.lower()]) if soil_t.lower() in soils else 0.0
+                      for shroom in mushrooms.values()]
+                     for soil_t in soil_names + [constants.no_value]], dtype=np.float32)
+
+
+def compile_static_table(tree_names, soil_names):
+    # Static factor of every combination of tree-type, soil-type and mushroom type: table[tree, soil, species]
+    # The last tree- and soil-row belong to constants.no_match, so the codes of the points can be used as indices
+    mushrooms = mushroom.read_mushroom_XML(mushroom_file)
+    soils = soil.read_soil_XML(soil_file)
+
+    tree_val = tree_factors(mushrooms, list(tree_names))[:, None, :]
+    soil_val = soil_factors(mushrooms, soils, list(soil_names))[None, :, :]
+    table = np.where((tree_val == 0) | (soil_val == 0), 0.0, (tree_val + soil_val) / 2).astype(np.float32)
+    return [table, [shroom.attr['name'] for shroom in mushrooms.values()]]
+
+
+@functools.lru_cache(maxsize=None)
+def get_static_table(tree_names, soil_names):
+    # The table only changes with the databanks and the category names, so it is compiled once and kept in the dumps
+    key = cache_utils.artifact_key([mushroom_file, soil_file], trees=list(tree_names), soils=list(soil_names))
+    return cache_utils.cached("static_table", constants.pwd + "/data/dumps/static_table.dump", key,
+                              lambda: compile_static_table(tree_names, soil_names),
+                              io_utils.dump_to_file, io_utils.read_dump_from_file)
+
+
+def calc_static_values(store):
     # Calculate weather-independent factor for each point
-    mushrooms = mushroom.read_mushroom_XML('../data/mushrooms_databank.xml')
-    soils = soil.read_soil_XML('../data/soil_databank.xml')
-    counter = 0
-    for patch in patches:
-        counter += 1
-        for date in patch.dates:
-            trees = date.trees
-            soiL_t = date.soil.lower()
-            for shroom in mushrooms.values():
-                #print("-->")
-                #print(date.soil)
-                #print(soil.soil_value(shroom, soils[soiL_t]))
-                tree_val = tree_value(shroom, trees)
-                if soiL_t not in soils:
-                    print(soiL_t)
-                    soil_val = 0.0
-                else:
-                    soil_val = soil_value(shroom, soils[soiL_t])
-                if tree_val == 0 or soil_val == 0:
-                    date.mushrooms[shroom.attr['name']] = 0.0
-                else:
-                    date.mushrooms[shroom.attr['name']] = (tree_val + soil_val) / 2
-
-
-def calc_dynamic_value(patches):
-    # Calculate the actual mushroom probabilities
-    month_factors = get_month_factors(datetime.datetime.today().month)
-
-    for patch in patches:
-        weather = patch.weather_data
-        temperatures = []
-        rains = []
-        humidities = []
-
-        # Look at weather of last 30 days
-        for i in range(30, 1, -1):
-            ts = utils.format_timestamp(datetime.datetime.today() - datetime.timedelta(days=i))
-            if weather[ts] is None or weather[ts]['temperature'] is None or weather[ts]['rain'] is None:
-                temperatures.append(0)
-                rains.append(0)
-                humidities.append(50)
-                continue
-            temperatures.append(weather[ts]['temperature'])
-            rains.append(weather[ts]['rain'])
-            humidities.append(weather[ts]['humidity'])
-
-        rain_val, temp_val, hum_val = environment_factor(rains, temperatures, humidities)
-
-        # Factors may have to be tweaked
-        dynamic_factor = (2 * rain_val + 1 * temp_val + 0.7 * hum_val) / 3.7
-
-        for date in patch.dates:
-            for shroom in date.mushrooms.keys():
-                # Base-Factor, Seasonality, Environment-Factor
-                # min(date.mushrooms[shroom] * month_factors[shroom] * dynamic_factor, 1)
-                date.probabilities[shroom] = min(date.mushrooms[shroom] * dynamic_factor, 1)
-                #date.probabilities[shroom] = min(date.mushrooms[shroom] * dynamic_factor * 100, 1)
+    # The factors only depend on the tree- and soil-type, so they are looked up in the compiled table
+    table, species = get_static_table(tuple(store.tree_names), tuple(store.soil_names))
+
+    store.species = list(species)
+    store.static = table[store.trees, store.soils]
+    return store
+
+
+def fill_missing(rains, temperatures, humidities):
+    # Missing days are filled as before (no rain, 0 degrees, 50% humidity)
+    # Unknown humidity of a known day stays NaN, environment_factor replaces it
+    missing = np.isnan(temperatures) | np.isnan(rains)
+    rains[missing] = 0
+    temperatures[missing] = 0
+    humidities[missing] = 50
+    return rains, temperatures, humidities
+
+
+def station_weather(patches, weather):
+    # Patches with the same station have the same weather, so everything is calculated once per station
+    # Returns the station index of each patch and [stations x days] matrices of rain, temperature and humidity
+    # Stations without weather data get missing values, see weather_store.StationWeather.station_values
+    stations, station_index = np.unique(np.asarray([patch.station for patch in patches], dtype=np.int64),
+                                        return_inverse=True)
+    values = weather.station_values(stations).astype(np.float64)
+    rains, temperatures, humidities = fill_missing(values[:, :, weather_store.weather_variables.index("rain")],
+                                                   values[:, :, weather_store.weather_variables.index("temperature")],
+                                                   values[:, :, weather_store.weather_variables.index("humidity")])
+    return station_index, rains, temperatures, humidities
+
+
+def interpolated_weather(weights, weather):
+    # Weather of each patch blended from its closest stations
+    # Returns [patches x days] matrices of rain, temperature and humidity
+    values = interpolation_utils.interpolate(weights, weather).astype(np.float64)
+    return fill_missing(values[:, :, weather_store.weather_variables.index("rain")],
+                        values[:, :, weather_store.weather_variables.index("temperature")],
+                        values[:, :, weather_store.weather_variables.index("humidity")])
+
+
+def dynamic_factors(rain, temperature, humidity, parameters=dynamic_parameters):
+    # Weather-dependent factor of each station (or patch) for every window of 28 days
+    rain_val, temp_val, hum_val = environment_factors(rain, temperature, humidity, parameters)
+
+    # Factors may have to be tweaked, see backtest_utils
+    mix = parameters["mix"]
+    return (mix[0] * rain_val + mix[1] * temp_val + mix[2] * hum_val) / sum(mix)
+
+
+def calc_dynamic_range(patches, weather, weights=None):
+    # Dynamic factors of each patch for a whole range of days in one pass
+    # weather has to contain the days from 30 days before the first until 2 days before the last day of the range
+    # (see utils.weather_days), the result is [patches x days of the range]
+    if weights is None:
+        # The dynamic factors are calculated once per station and then handed to all patches of that station
+        station_index, rains, temperatures, humidities = station_weather(patches, weather)
+        return dynamic_factors(rains, temperatures, humidities)[:, :len(weather.days) - 28].astype(np.float32)[
+            station_index]
+    return dynamic_factors(*interpolated_weather(weights, weather))[:, :len(weather.days) - 28].astype(np.float32)
+
+
+def day_probabilities(store, patch_factors):
+    # Mushroom probabilities of all points for one day of calc_dynamic_range
+    # min(static * dynamic_factor, 1)
+    point_factors = np.repeat(patch_factors, store.points_per_patch)
+    return np.minimum(store.static * point_factors[:, None], 1).astype(np.float32)
+
+
+def calc_dynamic_value(patches, store, weather, weights=None, dynamic_range=None):
+    # Calculate the actual mushroom probabilities of the last day of the weather
+    # With interpolation weights (interpolation_utils.StationWeights) the weather of each patch is blended from
+    # multiple stations, otherwise each patch uses the weather of its closest station
+    # An already calculated calc_dynamic_range of the same weather is reused instead of calculating it again
+    # Base-Factor, Environment-Factor
+    if dynamic_range is None:
+        dynamic_range = calc_dynamic_range(patches, weather, weights)
+    store.probabilities = day_probabilities(store, dynamic_range[:, -1])
+    return store
 
 
 def temp_deviation(temp, opt_val):
-    if temp < opt_val:
-        return temp / opt_val
-    elif temp > opt_val + 5:
-        return opt_val / temp
-    else:
-        return 1.0
+    # Works on single values as well as on whole arrays
+    temp = np.asarray(temp, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        return np.where(temp < opt_val, temp / opt_val, np.where(temp > opt_val + 5, opt_val / temp, 1.0))
+
+
+def window_weights(first, second, third):
+    # Weights of the 28 days (oldest first): days 28 to 14 ago, 2 to 1 week ago and the last week
+    return np.concatenate((np.full(14, first / 14), np.full(7, second / 7), np.full(7, third / 7)))
+
+
+def segment_means(values):
+    # Means of the three segments (see window_weights) of all 28 day windows along the last axis
+    # Every window is the difference of two cumulative sums, so each further window only costs a few subtractions
+    # Returns [3 x ... x windows]
+    cumulative = np.concatenate((np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)), axis=-1)
+    windows = values.shape[-1] - 27
+
+    def segment(start, length):
+        return (cumulative[..., start + length:start + length + windows] - cumulative[..., start:start + windows]) / \
+               length
+    return np.stack((segment(0, 14), segment(14, 7), segment(21, 7)))
+
+
+def window_sums(values, first, second, third):
+    # Weighted sums of all 28 day windows along the last axis, with the same weights as window_weights
+    means = segment_means(values)
+    return first * means[0] + second * means[1] + third * means[2]
+
+
+def environment_factors(rain, temperature, humidity, parameters=dynamic_parameters):
+    # Same as environment_factor, but for every window of 28 consecutive days
+    # With n days in the last axis, the result has n - 27 values: the factor of window i uses the days i to i + 27
+    rain = np.asarray(rain, dtype=np.float64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    humidity = np.asarray(humidity, dtype=np.float64)
+    optimal_temp = parameters["optimal_temp"]
+    rain_weights = parameters["rain_weights"]
+    # Emphasize 2-1 week ago for the rain and the last week for the temperature
+    # If 10mm is perfect amount, this measures the normalized contribution
+    ra = window_sums(np.minimum(rain, 25), *rain_weights)
+    temp = window_sums(temp_deviation(temperature, optimal_temp), 0.3, 0.75, 2)
+    hum = window_sums(np.where(np.isnan(humidity), 60, humidity), 1, 1, 1) / optimal_humidty
+    norm_rain = 14 * rain_weights[0] + 7 * rain_weights[1] + 7 * rain_weights[2]
+    return np.minimum(ra / norm_rain / optimal_rain, 3), np.minimum(temp / norm_temp, 3), hum / norm_hum
 
 
 def environment_factor(rain, temperature, humidity):
     # The factorization of the values can be tweeked, it's just a gross estimation
-    # First look at 28 days ago to 14 days ago
-    ra = 0
-    temp = 0
-    hum = 0
-    optimal_temp = 15
-    optimal_rain = 0.3
-    optimal_humidty = 90
-    for j in range(0, 14):
-        # If 10mm is perfect amount, this measures the normalized contribution
-        ra += 0.5 * min(rain[j], 25) / 14
-        temp += 0.3 * temp_deviation(temperature[j], optimal_temp) / 14
-        if humidity[j] is None:
-            humidity[j] = 60
-        hum += humidity[j] / optimal_humidty / 14
-    # Emphasize 2-1 week ago
-    for j in range(14, 21):
-        ra += 3 * min(rain[j], 25) / 7
-        temp += 0.75 * temp_deviation(temperature[j], optimal_temp) / 7
-        if humidity[j] is None:
-            humidity[j] = 60
-        hum += humidity[j] / optimal_humidty / 7
-    for j in range(21, 28):
-        ra += 0.75 * min(rain[j], 25) / 7
-        temp += 2 * temp_deviation(temperature[j], optimal_temp) / 7
-        if humidity[j] is None:
-            humidity[j] = 60
-        hum += humidity[j] / optimal_humidty / 7
-    norm_rain = 0.5 * 14 + 3 * 7 + 7 * 0.75
-    norm_temp = 3
-    norm_hum = 2.0
-    return min(ra / norm_rain / optimal_rain, 3), min(temp / norm_temp, 3), hum / norm_hum
\ No newline at end of file
+    # Each argument holds the values of the days (oldest first) in its last axis, so the factors of many stations
+    # are calculated at once, only the first 28 days are used
+    factors = environment_factors(np.asarray(rain, dtype=np.float64)[..., :28],
+                                  np.asarray(temperature, dtype=np.float64)[..., :28],
+                                  np.asarray(humidity, dtype=np.float64)[..., :28])
+    return tuple(factor[..., 0] for factor in factors)
@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+
+import numpy as np
+
+import constants
+
+try:
+    import brotli
+except ImportError:
+    # Without the brotli package only the .gz files are written
+    brotli = None
+
+'''
+Streaming writer for the GEOJSON files of the map.
+The features are written as soon as they are created instead of collecting the whole FeatureCollection in memory.
+Coordinates are rounded to constants.geojson_precision decimals (about 1m) and every feature only stores the class of
+its probability (property "class", the probability is class / constants.probability_classes) instead of a color.
+Besides the plain file, a gzip (.gz) and, if the brotli package is installed, a brotli (.br) compressed copy are
+written in the same pass, so a web server can hand them out directly.
+With colors, the features store the fill color of the polygon (property "color") instead, like the map bundled in
+web/dist/main.js expects it.
+'''
+
+
+class FeatureWriter:
+
+    def __init__(self, filename, precision=constants.geojson_precision, colors=False):
+        self.filename = filename
+        self.precision = precision
+        self.colors = colors
+        self.features = 0
+        self.outputs = [open(filename, 'wb'), gzip.open(filename + ".gz", 'wb', compresslevel=9)]
+        self.compressor = None
+        if brotli is not None:
+            self.compressor = brotli.Compressor(quality=constants.brotli_quality)
+            self.brotli_file = open(filename + ".br", 'wb')
+        crs = {'type': 'name', 'properties': {'name': 'EPSG:4326'}}
+        self.write('{"type":"FeatureCollection","crs":' + json.dumps(crs, separators=(',', ':')) + ',"features":[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A file that was not completely written is removed, so it is never mistaken for the whole area
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        for output in self.outputs:
+            output.write(data)
+        if self.compressor is not None:
+            self.brotli_file.write(self.compressor.process(data))
+
+    def write_polygons(self, coords, ring_offsets, polygon_offsets, values, classes=constants.probability_classes,
+                       batch=1000):
+        # Write polygons in the format of polygonize_utils.polygonize_arrays, every polygon is one feature
+        # The polygons are written in batches, only the coordinates of a batch are converted to python lists
+        class_ids = np.rint(np.asarray(values) * classes).astype(np.int64).tolist()
+        for first in range(0, len(class_ids), batch):
+            last = min(first + batch, len(class_ids))
+            offset = ring_offsets[polygon_offsets[first]]
+            batch_coords = np.round(coords[offset:ring_offsets[polygon_offsets[last]]], self.precision).tolist()
+            parts = []
+            for p in range(first, last):
+                rings = []
+                for r in range(polygon_offsets[p], polygon_offsets[p + 1]):
+                    ring = batch_coords[ring_offsets[r] - offset:ring_offsets[r + 1] - offset]
+                    ring.append(ring[0])
+                    rings.append(ring)
+                parts.append(('' if self.features == 0 else ',') +
+                             '{"type":"Feature","geometry":{"type":"Polygon","coordinates":' +
+                             json.dumps(rings, separators=(',', ':')) + '},"properties":' +
+                             self.properties(class_ids[p], classes) + '}')
+                self.features += 1
+            self.write(''.join(parts))
+
+    def properties(self, class_id, classes):
+        if self.colors:
+            return '{"color":"rgba(0, 255, 0, ' + str(min(0.5 * class_id / classes, 0.5)) + ')"}'
+        return '{"class":' + str(class_id) + '}'
+
+    def close(self):
+        self.write(']}')
+        for output in self.outputs:
+            output.close()
+        if self.compressor is not None:
+            self.brotli_file.write(self.compressor.finish())
+            self.brotli_file.close()
+
+    def discard(self):
+        # Close and remove all files without finishing them
+        for output in self.outputs:
+            output.close()
+        filenames = [self.filename, self.filename + ".gz"]
+        if self.compressor is not None:
+            self.brotli_file.close()
+            filenames.append(self.filename + ".br")
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+import constants
+
+"""
+Geometry of the grid of points, the single source of all point and patch coordinates.
+The grid is a rectangular raster: cell [row, col] is the point origin + [row * lat_step, col * lon_step] ([lat, lon]).
+It is divided into patches of patch_size x patch_size points. The points are numbered patch after patch (like the
+rows of a point_store.PointStore): patch j lies in row j % patch_rows and column j // patch_rows of the patches, and
+its point i * patch_size + k lies in row k and column i of the patch.
+All conversions between indices and coordinates are calculated directly, no coordinate is stored or searched per point.
+"""
+class GridSpec:
+
+    def __init__(self, origin, lat_step, lon_step, patch_rows, patch_cols, patch_size):
+        self.origin = [float(origin[0]), float(origin[1])]
+        self.steps = [float(lat_step), float(lon_step)]
+        # Amount of patches in each column of patches (same longitude) and amount of columns
+        self.patch_rows = int(patch_rows)
+        self.patch_cols = int(patch_cols)
+        self.patch_size = int(patch_size)
+        self.points_per_patch = self.patch_size ** 2
+        self.rows = self.patch_rows * self.patch_size
+        self.cols = self.patch_cols * self.patch_size
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def patch_amount(self):
+        return self.patch_rows * self.patch_cols
+
+    def point_cells(self, indices):
+        # Row and column of each point
+        indices = np.asarray(indices, dtype=np.int64)
+        patches, inner = np.divmod(indices, self.points_per_patch)
+        i, k = np.divmod(inner, self.patch_size)
+        return (patches % self.patch_rows) * self.patch_size + k, (patches // self.patch_rows) * self.patch_size + i
+
+    def cell_coords(self, rows, cols):
+        # Coordinates ([lat, lon]) of cells, also for cells outside of the grid (e.g. the corners of patches)
+        return np.stack((self.origin[0] + np.asarray(rows, dtype=np.float64) * self.steps[0],
+                         self.origin[1] + np.asarray(cols, dtype=np.float64) * self.steps[1]), axis=-1)
+
+    def point_coords(self, indices):
+        # Coordinates ([lat, lon]) of each point
+        return self.cell_coords(*self.point_cells(indices))
+
+    def layout(self):
+        # Index of the point of each cell as [rows x cols] raster, e.g. probabilities[layout] is the probability raster
+        return np.arange(len(self)).reshape(self.patch_cols, self.patch_rows, self.patch_size, self.patch_size) \
+            .transpose(1, 3, 0, 2).reshape(self.rows, self.cols)
+
+    def patch_cells(self, patch_indices):
+        # Row and column of the first point (the south west corner) of each patch
+        patch_indices = np.asarray(patch_indices, dtype=np.int64)
+        return (patch_indices % self.patch_rows) * self.patch_size, (patch_indices // self.patch_rows) * self.patch_size
+
+    def patch_corners(self, patch_indices):
+        # Corners of each patch in the order origin, north, east, north east
+        # The north and east corners are the first points of the neighbouring patches
+        rows, cols = self.patch_cells(patch_indices)
+        return np.stack([self.cell_coords(rows, cols), self.cell_coords(rows + self.patch_size, cols),
+                         self.cell_coords(rows, cols + self.patch_size),
+                         self.cell_coords(rows + self.patch_size, cols + self.patch_size)], axis=-2)
+
+    def patch_middles(self, patch_indices):
+        rows, cols = self.patch_cells(patch_indices)
+        return self.cell_coords(rows + self.patch_size / 2.0, cols + self.patch_size / 2.0)
+
+    def patch_bboxes(self, patch_indices):
+        # Bounding box ([min_lat, min_lon, max_lat, max_lon]) of each patch, as queried by index_utils.query_bboxes
+        corners = self.patch_corners(patch_indices)
+        return np.hstack((corners[..., 0, :], corners[..., 3, :]))
+
+
+def from_corners(corners, dist=constants.point_dist, patch_size=constants.points_per_patch_sqrt):
+    # The grid that covers the rectangle between the corners [lat_1, lon_1, lat_2, lon_2] with points in distance dist
+    # (km), only whole patches that end before the rectangle ends are part of the grid
+    x_start = min(corners[0], corners[2])
+    y_start = min(corners[1], corners[3])
+    # Same factors as reparse_utils.get_lat_fac and reparse_utils.get_long_fac (which takes the latitude as radians)
+    x_add = dist / constants.km_per_lat
+    y_add = dist / np.abs(constants.km_per_lon * np.cos(x_start))
+    patch_rows = max(0, math.ceil(abs(corners[2] - corners[0]) / (patch_size * x_add)) - 1)
+    patch_cols = max(0, math.ceil(abs(corners[3] - corners[1]) / (patch_size * y_add)) - 1)
+    return GridSpec([x_start, y_start], x_add, y_add, patch_rows, patch_cols, patch_size)
@@ -0,0 +1,125 @@
+import numpy as np
+from numba import jit
+
+import constants
+
+'''
+Spatial index for the tree and soil shapes.
+The bounding box of every shape is sorted into a uniform grid of cells. This allows to find all shapes that may
+contain a point (or overlap a patch) by only looking at the cells around it, instead of iterating every shape.
+The index only has to be built once for a shape file and can then be stored in a dump.
+'''
+
+
+class GridIndex:
+
+    def __init__(self, origin, cell_size, cells, cell_offsets, cell_items, bboxes):
+        # Lower left corner of the grid and size of a single (square) cell in degrees
+        self.origin = origin
+        self.cell_size = cell_size
+        # Amount of cells in both directions
+        self.cells = cells
+        # The shapes of cell i are stored in cell_items[cell_offsets[i]:cell_offsets[i + 1]]
+        self.cell_offsets = cell_offsets
+        self.cell_items = cell_items
+        # Bounding box of each shape: [min_0, min_1, max_0, max_1]
+        self.bboxes = bboxes
+
+
+@jit(nopython=True)
+def cell_range(bbox, origin, cell_size, cells):
+    # Range of cells covered by a bounding box, clipped to the grid
+    start_0 = min(max(int(np.floor((bbox[0] - origin[0]) / cell_size)), 0), cells[0] - 1)
+    start_1 = min(max(int(np.floor((bbox[1] - origin[1]) / cell_size)), 0), cells[1] - 1)
+    end_0 = min(max(int(np.floor((bbox[2] - origin[0]) / cell_size)), 0), cells[0] - 1)
+    end_1 = min(max(int(np.floor((bbox[3] - origin[1]) / cell_size)), 0), cells[1] - 1)
+    return start_0, start_1, end_0, end_1
+
+
+@jit(nopython=True)
+def fill_cells(bboxes, origin, cell_size, cells):
+    # Two passes: First count the shapes of each cell, then write them into one flat array
+    counts = np.zeros(cells[0] * cells[1] + 1, dtype=np.int64)
+    for i in range(len(bboxes)):
+        s_0, s_1, e_0, e_1 = cell_range(bboxes[i], origin, cell_size, cells)
+        for c_0 in range(s_0, e_0 + 1):
+            for c_1 in range(s_1, e_1 + 1):
+                counts[c_0 * cells[1] + c_1 + 1] += 1
+
+    cell_offsets = np.cumsum(counts)
+    cell_items = np.empty(cell_offsets[-1], dtype=np.int64)
+    filled = cell_offsets[:-1].copy()
+    # Shapes are added in ascending order, so every cell is sorted
+    for i in range(len(bboxes)):
+        s_0, s_1, e_0, e_1 = cell_range(bboxes[i], origin, cell_size, cells)
+        for c_0 in range(s_0, e_0 + 1):
+            for c_1 in range(s_1, e_1 + 1):
+                cell = c_0 * cells[1] + c_1
+                cell_items[filled[cell]] = i
+                filled[cell] += 1
+    return cell_offsets, cell_items
+
+
+def build_index(bboxes, cell_size=constants.index_cell_size):
+    # Build the grid index from the bounding boxes of the shapes
+    bboxes = np.ascontiguousarray(bboxes, dtype=np.float64)
+    origin = np.array([np.min(bboxes[:, 0]), np.min(bboxes[:, 1])], dtype=np.float64)
+    extent = np.array([np.max(bboxes[:, 2]), np.max(bboxes[:, 3])], dtype=np.float64) - origin
+    cells = (np.floor(extent / cell_size) + 1).astype(np.int64)
+
+    cell_offsets, cell_items = fill_cells(bboxes, origin, np.float64(cell_size), cells)
+    print("Created spatial index with " + str(cells[0] * cells[1]) + " cells for " + str(len(bboxes)) + " shapes")
+    return GridIndex(origin, float(cell_size), cells, cell_offsets, cell_items, bboxes)
+
+
+@jit(nopython=True)
+def bboxes_overlap(bbox_1, bbox_2):
+    return bbox_1[0] <= bbox_2[2] and bbox_2[0] <= bbox_1[2] and bbox_1[1] <= bbox_2[3] and bbox_2[1] <= bbox_1[3]
+
+
+@jit(nopython=True)
+def collect_candidates(query, origin, cell_size, cells, cell_offsets, cell_items, bboxes, marker, mark, out):
+    # Write every shape whose bounding box overlaps the query into out (if given) and return the amount
+    # marker stores for each shape the last query it was found in, so shapes spanning multiple cells are only added once
+    found = 0
+    s_0, s_1, e_0, e_1 = cell_range(query, origin, cell_size, cells)
+    for c_0 in range(s_0, e_0 + 1):
+        for c_1 in range(s_1, e_1 + 1):
+            cell = c_0 * cells[1] + c_1
+            for j in range(cell_offsets[cell], cell_offsets[cell + 1]):
+                item = cell_items[j]
+                if marker[item] != mark and bboxes_overlap(bboxes[item], query):
+                    marker[item] = mark
+                    if len(out) > 0:
+                        out[found] = item
+                    found += 1
+    return found
+
+
+@jit(nopython=True)
+def query_bboxes_inner(queries, origin, cell_size, cells, cell_offsets, cell_items, bboxes):
+    marker = np.full(len(bboxes), -1, dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+
+    offsets = np.zeros(len(queries) + 1, dtype=np.int64)
+    for i in range(len(queries)):
+        offsets[i + 1] = offsets[i] + collect_candidates(queries[i], origin, cell_size, cells, cell_offsets,
+                                                         cell_items, bboxes, marker, i, empty)
+
+    items = np.empty(offsets[-1], dtype=np.int64)
+    marker[:] = -1
+    for i in range(len(queries)):
+        collect_candidates(queries[i], origin, cell_size, cells, cell_offsets, cell_items, bboxes, marker, i,
+                           items[offsets[i]:offsets[i + 1]])
+        # Keep the candidates in ascending order of the shapes
+        items[offsets[i]:offsets[i + 1]] = np.sort(items[offsets[i]:offsets[i + 1]])
+    return offsets, items
+
+
+def query_bboxes(index, queries):
+    # Find all shapes that may overlap each of the query boxes ([min_0, min_1, max_0, max_1]) in one batched query
+    # The candidates of query i are items[offsets[i]:offsets[i + 1]]
+    queries = np.ascontiguousarray(np.reshape(queries, (-1, 4)), dtype=np.float64)
+    return query_bboxes_inner(queries, index.origin, np.float64(index.cell_size), index.cells, index.cell_offsets,
+                              index.cell_items, index.bboxes)
+
@@ -0,0 +1,130 @@
+import numpy as np
+
+import cache_utils
+import constants
+import environment_utils
+import index_utils
+import io_utils
+
+'''
+Interpolation of the weather between DWD stations.
+Instead of only using the closest station, the weather of a patch is blended from its k closest stations, weighted by
+the inverse of their distance. The weights are a sparse [patches x stations] matrix in CSR format:
+the stations of patch p are stations[offsets[p]:offsets[p + 1]] with the weights weights[offsets[p]:offsets[p + 1]].
+They are calculated once together with the grid and stored in a dump, so the weather of one day is a single sparse
+matrix-vector product.
+'''
+
+weights_file = constants.pwd + "/data/dumps/station_weights.dump"
+
+
+class StationWeights:
+
+    def __init__(self, offsets, stations, weights, station_ids):
+        self.offsets = offsets
+        # Column of each entry as index into station_ids
+        self.stations = stations
+        self.weights = weights
+        # DWD id of each column
+        self.station_ids = station_ids
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def used_stations(self):
+        # DWD ids of all stations that are used by any patch
+        return self.station_ids[np.unique(self.stations)]
+
+
+def station_distances(points, stations):
+    # Distance in km between each point and station (both [lat, lon]), using the latitude of the station
+    d_lat = (points[:, 0] - stations[:, 0]) * constants.km_per_lat
+    d_lon = (points[:, 1] - stations[:, 1]) * constants.km_per_lon * np.cos(np.radians(stations[:, 0]))
+    return np.sqrt(d_lat ** 2 + d_lon ** 2)
+
+
+def nearest_stations(points, station_coords, k):
+    # Find the k closest stations of every point with the spatial index
+    # A box with half width r around a point contains all stations closer than r * min_fac km, so a point is done as
+    # soon as its k-th closest station in the box is closer than that. The other points are repeated with a larger box.
+    points = np.reshape(np.asarray(points, dtype=np.float64), (-1, 2))
+    station_coords = np.reshape(np.asarray(station_coords, dtype=np.float64), (-1, 2))
+    if len(station_coords) == 0:
+        raise ValueError("There are no weather stations to interpolate the weather from")
+    k = min(k, len(station_coords))
+    index = index_utils.build_index(np.hstack((station_coords, station_coords)), constants.station_cell_size)
+    min_fac = min(constants.km_per_lat, constants.km_per_lon * np.min(np.cos(np.radians(station_coords[:, 0]))))
+
+    nearest = np.empty((len(points), k), dtype=np.int64)
+    distances = np.empty((len(points), k), dtype=np.float64)
+    todo = np.arange(len(points))
+    radius = constants.station_cell_size
+    while len(todo) > 0:
+        offsets, items = index_utils.query_bboxes(index, np.hstack((points[todo] - radius, points[todo] + radius)))
+        counts = np.diff(offsets)
+        rows = np.repeat(np.arange(len(todo)), counts)
+        dist = station_distances(points[todo][rows], station_coords[items])
+
+        # Sort the candidates of each point by distance, the candidates of a point stay together
+        order = np.lexsort((dist, rows))
+        rows, items, dist = rows[order], items[order], dist[order]
+        rank = np.arange(len(rows)) - offsets[rows]
+
+        kth = np.full(len(todo), np.inf)
+        kth[counts >= k] = dist[offsets[:-1][counts >= k] + k - 1]
+        done = kth <= radius * min_fac
+        selected = (rank < k) & done[rows]
+        nearest[todo[rows[selected]], rank[selected]] = items[selected]
+        distances[todo[rows[selected]], rank[selected]] = dist[selected]
+
+        todo = todo[~done]
+        radius *= 2
+    return nearest, distances
+
+
+def build_weights(points, stations, k=constants.interpolation_stations, power=constants.interpolation_power):
+    # Inverse distance weights of the k closest stations of every point (e.g. the middles of the patches)
+    # stations are the dictionaries of environment_utils.get_stations
+    station_coords = np.array([[station['geo_lat'], station['geo_lon']] for station in stations], dtype=np.float64)
+    station_ids = np.array([station['station_id'] for station in stations], dtype=np.int64)
+    nearest, distances = nearest_stations(points, station_coords, k)
+
+    # Stations closer than min_station_dist all get the same (large) weight
+    weights = 1.0 / np.maximum(distances, constants.min_station_dist) ** power
+    weights /= np.sum(weights, axis=1)[:, None]
+
+    offsets = np.arange(len(nearest) + 1, dtype=np.int64) * nearest.shape[1]
+    return StationWeights(offsets, nearest.ravel(), weights.ravel(), station_ids)
+
+
+def patch_weights(patches, grid):
+    # Weights of the patches of grid, only rebuilt if the grid, the stations or the interpolation parameters changed
+    key = cache_utils.artifact_key([environment_utils.stations_file], origin=grid.origin, steps=grid.steps,
+                                   patch_rows=grid.patch_rows, patch_cols=grid.patch_cols,
+                                   patch_size=grid.patch_size, patches=len(patches),
+                                   k=constants.interpolation_stations, power=constants.interpolation_power,
+                                   min_dist=constants.min_station_dist)
+    return cache_utils.cached("station_weights", weights_file, key,
+                              lambda: build_weights([patch.middle for patch in patches],
+                                                    environment_utils.get_stations()),
+                              io_utils.dump_to_file, io_utils.read_dump_from_file)
+
+
+def interpolate(weights, weather):
+    # Interpolated weather of every patch as [patches x days x variables], each day and variable is one sparse
+    # matrix-vector product. Stations without value are left out and the weights of the others are scaled up,
+    # so a value is only NaN if all stations of a patch miss it. Stations without any weather data miss every value.
+    columns = weather.station_index(weights.station_ids[weights.stations])
+    unknown = columns == constants.no_match
+    starts = weights.offsets[:-1]
+    result = np.empty((len(weights), len(weather.days), weather.values.shape[2]), dtype=np.float32)
+    for d in range(len(weather.days)):
+        for v in range(weather.values.shape[2]):
+            values = weather.values[columns, d, v].astype(np.float64)
+            values[unknown] = np.nan
+            known = ~np.isnan(values)
+            summed = np.add.reduceat(np.where(known, values, 0) * weights.weights, starts)
+            norm = np.add.reduceat(known * weights.weights, starts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[:, d, v] = summed / norm
+    return result
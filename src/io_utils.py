@@ -1,19 +1,31 @@
 import pickle
 import json
-import reparse_utils
+import parallel_utils
+import point_store
+import polygonize_utils
+import geojson_utils
+import tile_utils
+import raster_tile_utils
 from utils import *
 import os
 import math
+import shutil
 
 '''
-Utilities to deal with IO-Operations. This includes writing the final data to a GEOJSON file.
+Utilities to deal with IO-Operations. This includes writing the final map of all species to GEOJSON files and tiles.
 '''
 
+geojson_directory = constants.pwd + "/web/geojson"
+# Single GEOJSON file that the map bundled in web/dist/main.js loads
+legacy_file = constants.pwd + "/web/data.txt"
+
 
 def dump_to_file(arr, filename):
-    with open(filename, 'wb') as fp:
+    # Write into a temporary file first, so an interrupted run never leaves a half written dump behind
+    with open(filename + ".tmp", 'wb') as fp:
         pickle.dump(arr, fp)
         fp.close()
+    os.replace(filename + ".tmp", filename)
 
 
 def read_dump_from_file(filename):
@@ -29,138 +41,170 @@ def clear_directory(directory):
         os.remove(os.path.join(directory, f))
 
 
-def get_dumpamount_in_folder(directory):
-    return len([f for f in os.listdir(directory) if f.endswith(".dump")])
+def generate_file_names(len_patches):
+    return ["/data/dumps/patches/patches_weather" + str(i) + ".dump" for i in range(len_patches)]
 
 
-def patches_to_folder(patches):
-    clear_directory(constants.pwd + "/data/dumps/patches/")
-    for i in range(len(patches)):
-        patches_t = patches[i]
-        io_utils.dump_to_file(patches_t, constants.pwd + "/data/dumps/patches/patches_weather" + str(i) + ".dump")
+def get_missing_dumps(file_names):
+    # Indices of all dumps that were not yet written (e.g. by an interrupted run)
+    return [i for i in range(len(file_names)) if not os.path.exists(constants.pwd + file_names[i])]
 
 
-def generate_file_names(len_patches):
-    return ["/data/dumps/patches/patches_weather" + str(i) + ".dump" for i in range(len_patches)]
+def dump_number(file_name):
+    # Number at the end of a dump name, e.g. 12 for patches_weather12.dump
+    digits = file_name[:-len(".dump")]
+    return int(digits[len(digits.rstrip("0123456789")):] or 0)
 
 
 def read_patches_from_folder(directory):
-    filelist = [f for f in os.listdir(directory) if f.endswith(".dump")]
+    # Read the dumps in the order they were created in
+    filelist = sorted([f for f in os.listdir(directory) if f.endswith(".dump")], key=dump_number)
     patches = []
     for f in filelist:
-        patches.append(io_utils.read_dump_from_file(os.path.join(directory, f)))
+        patches.append(read_dump_from_file(os.path.join(directory, f)))
     return patches
 
 
-def flatten_patches(patches):
-    return [item for sublist in patches for item in sublist]
-
-
-def make_shapes_grainy(shapes):
-    max_sizes = reparse_utils.find_max_size_shapes(np.array(shapes))
-    ret = []
-    for i in range(len(shapes)):
-        shape = shapes[i][0]
-        size = max_sizes[i]
-        if size > 40:
+def flatten_patches(shards):
+    # Combine the [patches, store] dumps of all chunks
+    patches = [item for shard in shards for item in shard[0]]
+    return patches, point_store.concatenate([shard[1] for shard in shards])
 
-            ret.append(shapes[i])
-    print("Amount of Datapoints grainy: " + str(len(ret)))
-    return ret
 
+def area_bounds(amount, split):
+    # Borders of split areas of about the same size along an axis of amount patches
+    targets = (np.arange(amount) / (amount / split)).astype(np.int64)
+    return np.searchsorted(targets, np.arange(split + 1)) * constants.points_per_patch_sqrt
 
 
-def subdivide_patches(patches, shape_amount_sqrt):
-    patches_shape = get_patches_shape(patches)
-
+def raster_areas(raster, origin, steps, shape_amount_sqrt):
+    # Split a raster into areas of shape_amount_sqrt x shape_amount_sqrt patches: [index, area, origin of the area]
+    patches_shape = [raster.shape[0] // constants.points_per_patch_sqrt,
+                     raster.shape[1] // constants.points_per_patch_sqrt]
     x_split = math.ceil(patches_shape[0] / shape_amount_sqrt)
     y_split = math.ceil(patches_shape[1] / shape_amount_sqrt)
-
-    add_x = patches_shape[0] / x_split
-    add_y = patches_shape[1] / y_split
-
-    return_arr = [[] for i in range(x_split * y_split)]
-    for y in range(patches_shape[1]):
-        for x in range(patches_shape[0]):
-            index = x + y * patches_shape[0]
-
-            x_target = int(x / add_x)
-            y_target = int(y / add_y)
-
-            target = x_target + y_target * x_split
-
-            #print(f"Target: {target} index {index}")
-            return_arr[target].append(patches[index])
-    print(get_patches_shape(return_arr[0]))
-    print(get_patches_shape(return_arr[1]))
-    return return_arr
-
-def write_to_GEOJSON(patches_a):
-    print(f"Patcheese length: {len(patches_a)}")
-    patches_shape = get_patches_shape(patches_a)
-    patches_d = subdivide_patches(patches_a, 100)
-    print(patches_shape)
-    for i in range(len(patches_d)):
-        patches = patches_d[i]
-        #patches = patches_a[i:min(i + 5000, len(patches_a))]
-
-        data = {}
-        crs = {'type': 'name', 'properties': {'name': 'EPSG:4326'}}
-        data['type'] = 'FeatureCollection'
-        data['crs'] = crs
-        data['features'] = []
-
-        data_grainy = {}
-        crs2 = {'type': 'name', 'properties': {'name': 'EPSG:4326'}}
-        data_grainy['type'] = 'FeatureCollection'
-        data_grainy['crs'] = crs2
-        data_grainy['features'] = []
-
-        patches_shape = get_patches_shape(patches)
-        super_patch = create_super_patch(patches, patches_shape)
-
-        dist_x = constants.point_dist / get_lat_fac() / 2.0
-
-        print("Reducing Amount of Shapes")
-        final_shapes = shape_reduction(super_patch, dist_x, -1, patches_shape[0] * 10, patches_shape[1] * 10)
-
-        print("Removing Shapes with Probability 0")
-        final_shapes = remove_zero_shapes(final_shapes)
-
-        print("Amount of Datapoints before: " + str(len(patches) * len(patches[0].dates)))
-        print("Amount of Datapoints after: " + str(len(final_shapes)))
-        grainy_shapes = make_shapes_grainy(final_shapes)
-        for j in range(len(final_shapes)):
-            new_cords = final_shapes[j][0]
-            new_cords.append(new_cords[0])
-            geom = {}
-            #props = {'color': 'rgba(0, ' + str(random.randint(0, 255)) + ', ' + str(random.randint(0, 255)) + ', ' + str(random.randint(0, 255)) + ')'}
-            props = {'color': 'rgba(0, 255, 0 , ' + str(min(0.5 * final_shapes[j][1], 0.5)) + ')'}
-            geom['type'] = 'Polygon'
-            # geom['coordinates'] = [coordinates]
-            geom['coordinates'] = [new_cords]
-            data['features'].append({
-                'type': 'Feature',
-                'geometry': geom,
-                'properties': props
-            })
-
-        for j in range(len(grainy_shapes)):
-            new_cords = grainy_shapes[j][0]
-            new_cords.append(new_cords[0])
-            geom = {}
-            #props = {'color': 'rgba(0, 255, ' + str(random.randint(0, 255)) + ', ' + str(random.randint(0, 255)) + ')'}
-            props = {'color': 'rgba(0, 255, 0, ' + str(min(0.5 * grainy_shapes[j][1], 0.5)) + ')'}
-            geom['type'] = 'Polygon'
-            # geom['coordinates'] = [coordinates]
-            geom['coordinates'] = [new_cords]
-            data_grainy['features'].append({
-                'type': 'Feature',
-                'geometry': geom,
-                'properties': props
-            })
-
-        with open(constants.pwd + f'/web/data{i}.json', 'w') as outfile:
-            json.dump(data, outfile)
-        with open(constants.pwd + f'/web/data_grainy{i}.json', 'w') as outfile:
-            json.dump(data_grainy, outfile)
+    x_bounds = area_bounds(patches_shape[0], x_split)
+    y_bounds = area_bounds(patches_shape[1], y_split)
+
+    for y_target in range(y_split):
+        for x_target in range(x_split):
+            area = raster[x_bounds[x_target]:x_bounds[x_target + 1], y_bounds[y_target]:y_bounds[y_target + 1]]
+            area_origin = np.asarray(origin) + np.array([x_bounds[x_target], y_bounds[y_target]]) * np.asarray(steps)
+            yield x_target + y_target * x_split, area, area_origin
+
+
+def write_to_GEOJSON(raster, origin, steps, directory, shape_amount_sqrt=100):
+    # Write the polygons of a probability raster into GEOJSON files, one for each area of
+    # shape_amount_sqrt x shape_amount_sqrt patches
+    os.makedirs(directory, exist_ok=True)
+    for i, area, area_origin in raster_areas(raster, origin, steps, shape_amount_sqrt):
+        # Shapes with probability 0 are left out by the polygonization
+        polygons = polygonize_utils.polygonize_arrays(area, area_origin, steps)
+        with geojson_utils.FeatureWriter(directory + f'/data{i}.json') as writer:
+            writer.write_polygons(*polygons)
+
+
+def write_legacy_map(raster, origin, steps, filename=legacy_file, shape_amount_sqrt=100):
+    # Write the polygons of a probability raster with their fill colors into a single GEOJSON file, as read by the map
+    # bundled in web/dist/main.js. The areas are polygonized one after another like in write_to_GEOJSON.
+    with geojson_utils.FeatureWriter(filename, colors=True) as writer:
+        for i, area, area_origin in raster_areas(raster, origin, steps, shape_amount_sqrt):
+            writer.write_polygons(*polygonize_utils.polygonize_arrays(area, area_origin, steps))
+
+
+def empty_directory(directory):
+    # Temporary directory next to directory that the files of a run are written into, see replace_directory
+    if os.path.exists(directory + ".tmp"):
+        shutil.rmtree(directory + ".tmp")
+    os.makedirs(directory + ".tmp")
+    return directory + ".tmp"
+
+
+def replace_directory(directory):
+    # Swap the directory written by this run in place of the one of the last run. Files that are not written again
+    # (e.g. tiles that became empty) are removed with the old directory instead of being served further
+    if os.path.exists(directory + ".old"):
+        shutil.rmtree(directory + ".old")
+    if os.path.exists(directory):
+        os.replace(directory, directory + ".old")
+    os.replace(directory + ".tmp", directory)
+    if os.path.exists(directory + ".old"):
+        shutil.rmtree(directory + ".old")
+
+
+def vector_min_zoom(images):
+    # With image tiles, the vector tiles only start above the image tiles
+    return max(constants.tile_min_zoom, constants.raster_max_zoom + 1) if images else constants.tile_min_zoom
+
+
+def zoom_levels(images, vectors):
+    # Zoom levels of the image and vector tiles, the map reads them from tiles/tiles.json
+    levels = {}
+    if images:
+        levels["images"] = {"min_zoom": constants.raster_min_zoom, "max_zoom": constants.raster_max_zoom}
+    if vectors:
+        levels["vectors"] = {"min_zoom": vector_min_zoom(images), "max_zoom": constants.tile_max_zoom}
+    return levels
+
+
+def export_species(task):
+    # Write all outputs of one species, the tiles are written in this process if the species run in parallel
+    name, column, geojson, images, vectors, workers = task
+    # The probabilities and the raster layout are the data of the pool, see parallel_utils.worker_arrays
+    probabilities, layout, origin, steps = parallel_utils.worker_arrays()
+    raster = probabilities[layout, column].astype(np.float64)
+    if geojson:
+        write_to_GEOJSON(raster, origin, steps, empty_directory(geojson_directory + "/" + name))
+        replace_directory(geojson_directory + "/" + name)
+    if images or vectors:
+        directory = empty_directory(tile_utils.tiles_directory + "/" + name)
+        if images:
+            raster_tile_utils.write_raster_pyramid(raster, origin, steps, name, workers, directory=directory)
+        if vectors:
+            tile_utils.write_tile_pyramid(raster, origin, steps, name, workers, directory=directory,
+                                          min_zoom=vector_min_zoom(images))
+        replace_directory(tile_utils.tiles_directory + "/" + name)
+    print("Exported " + name)
+    return name
+
+
+def write_map(patches, store, species=None, workers=os.cpu_count(), geojson=False, images=True, vectors=True,
+              legacy=True):
+    # Write the map of all species (default: all species of the store) in one pass
+    # The raster layout of the points (see grid_spec.GridSpec.layout) is only created once and shared by all species.
+    # With several species, the species are exported in parallel, otherwise the tiles of the single species are.
+    # geojson writes web/geojson/<species>/data<i>.json, images and vectors the image and vector tiles of
+    # web/tiles/<species>, see raster_tile_utils and tile_utils
+    # legacy writes web/data.txt with one species (Steinpilz, if it is exported) for the map bundled in
+    # web/dist/main.js, as long as that bundle is not rebuilt from web/main.js
+    if species is None:
+        species = list(store.species)
+    # The index of a point in the grid is its row in the store, so the store has to hold all points of its grid
+    # (e.g. not only the chunks of an interrupted reparse)
+    grid = store.grid
+    if store.first != 0 or len(store) != len(grid):
+        raise ValueError("The store only holds the points " + str(store.first) + " to " +
+                         str(store.first + len(store)) + " of the " + str(len(grid)) + " points of its grid")
+    layout, origin, steps = grid.layout(), grid.origin, grid.steps
+    values = [store.probabilities, layout, origin, steps]
+
+    # The map reads the species and the zoom levels of the tiles from the lists next to the tiles
+    if images or vectors:
+        os.makedirs(tile_utils.tiles_directory, exist_ok=True)
+        with open(tile_utils.tiles_directory + "/species.json", 'w') as outfile:
+            json.dump(list(species), outfile)
+        with open(tile_utils.tiles_directory + "/tiles.json", 'w') as outfile:
+            json.dump(zoom_levels(images, vectors), outfile)
+
+    if workers > 1 and len(species) > 1:
+        tasks = [[name, store.species_column(name), geojson, images, vectors, 1] for name in species]
+        with parallel_utils.pool(values, min(workers, len(species))) as pool:
+            pool.map(export_species, tasks)
+    else:
+        with parallel_utils.local_worker(values):
+            for name in species:
+                export_species([name, store.species_column(name), geojson, images, vectors, workers])
+
+    if legacy and len(species) > 0:
+        name = "Steinpilz" if "Steinpilz" in species else species[0]
+        write_legacy_map(store.probabilities[layout, store.species_column(name)].astype(np.float64), origin, steps)
@@ -8,11 +8,13 @@ import constants
 def new_finding(id,location, mushroom, time, temperature_14, rain_14):
     # Add a new finding at specific location of mushroom
     # Also store data of find, temperature of last 14 days and rains of last 14 days
-    # May be interesting for later evaluation of data
+    # May be interesting for later evaluation of data, the day of the finding is used by backtest_utils
     cursor, con = sql_utils.connect_database("../data/locations.db")
-    rows = "id,location_x,location_y,mushroom,temperature,rain"
-    #values = ['1','50.0','10.0','Steinpilz','15.0','0.5']
-    values = [id, location,  mushroom, time, temperature_14, rain_14]
+    # Databases created before the findings had a day do not have its column yet
+    sql_utils.add_missing_column(cursor, "findings", "day", "integer")
+    rows = "id,location_x,location_y,mushroom,day,temperature,rain"
+    #values = ['1','50.0','10.0','Steinpilz','20230914','15.0','0.5']
+    values = [id, location[0], location[1], mushroom, time.strftime("%Y%m%d"), temperature_14, rain_14]
     sql_utils.insert_data_table(cursor, "findings", rows, values)
     con.commit()
     pass
@@ -38,7 +40,7 @@ def fit_findings_to_patches(patches):
 def create_table():
     cursor,con = sql_utils.connect_database("../data/locations.db")
     values = [["id", "integer"], ["location_x", "float"], ["location_y", "float"],
-              ["mushroom", "text"], ["temperature", "float"],
+              ["mushroom", "text"], ["day", "integer"], ["temperature", "float"],
               ["rain", "float"]]
     sql_utils.create_table(cursor, "findings", values)
     con.commit()
@@ -54,7 +56,7 @@ cursor, con = sql_utils.connect_database("../data/locations.db")
 
 patches_split = io_utils.read_patches_from_folder(constants.pwd + "/data/dumps/patches/")
 
-patches = io_utils.flatten_patches(patches_split)
+patches, store = io_utils.flatten_patches(patches_split)
 
 
 fit_findings_to_patches(patches)
@@ -3,10 +3,14 @@ import constants
 import utils
 import reparse_utils
 import factor_calculations
+import interpolation_utils
+import archive_utils
 import time
+import datetime
 from numba.core.errors import NumbaDeprecationWarning, NumbaPendingDeprecationWarning
 import warnings
 import numpy as np
+import os
 
 '''
 Main file of the mushroom app. Here is where all the magic happens.
@@ -18,6 +22,34 @@ Recover = False
 
 Recalc = True
 
+# Burn tree- and soil-shapes into a raster of the region instead of searching the shape of every point
+Rasterize = True
+
+# Amount of processes used for reparsing, 1 parses all chunks one after another in a single process that uses all
+# cores
+Workers = os.cpu_count()
+
+# Blend the weather of each patch from its closest stations instead of only using the closest one
+Interpolate = False
+
+# Folder with DWD archive files of daily observations ("kl daily" zips) that are imported into the weather store
+# before the run, e.g. constants.pwd + "/data/kl_daily". None skips the import
+Archive = None
+
+# Write the map as vector tiles (web/tiles) instead of GEOJSON files, the browser then only loads the visible tiles
+Tiles = True
+
+# Write the zoomed out views of the map as image tiles (web/tiles) instead of polygons
+Images = True
+
+# Also write web/data.txt for the map bundled in web/dist/main.js, which predates the tiles. Can be switched off once
+# the bundle is rebuilt from web/main.js (see INSTALLATION.md)
+Legacy = True
+
+# Amount of days (ending today) for which the dynamic factors are calculated, e.g. for a day slider on the map
+# The map itself shows today
+Days = 1
+
 def main():
     warnings.simplefilter('ignore', category=NumbaDeprecationWarning)
     warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
@@ -30,58 +62,79 @@ def main():
 
         patches_per_run = 1000
 
-        corners = [start_cord[0], start_cord[1], end_cord[0], end_cord[1]]
-
         print("Creating Points")
-        patches = reparse_utils.create_points(start_cord[0], start_cord[1], end_cord[0], end_cord[1],
-                                              constants.point_dist, constants.points_per_patch_sqrt)
+        grid, patches = reparse_utils.create_points(start_cord[0], start_cord[1], end_cord[0], end_cord[1],
+                                                    constants.point_dist, constants.points_per_patch_sqrt)
+
+        # The grid describes the position of all points, it is stored next to the parsed patches
+        io_utils.dump_to_file(grid, constants.pwd + "/data/dumps/grid.dump")
 
         print("Splitting Patches")
-        patches_split = utils.split_patches(patches, patches_per_run)
+        patches_split = utils.split_patches(patches, grid, patches_per_run)
 
         file_names = io_utils.generate_file_names(len(patches_split))
 
+        # The interpolation weights belong to the grid, so they are created together with it
+        if Interpolate:
+            interpolation_utils.patch_weights(patches, grid)
+
         if not Recover:
             io_utils.clear_directory(constants.pwd + "/data/dumps/patches/")
 
-        start_point = 0
+        # When recovering, only parse the chunks that have no dump yet
+        chunks = io_utils.get_missing_dumps(file_names)
 
-        if Recover:
-            start_point = io_utils.get_dumpamount_in_folder(constants.pwd + "/data/dumps/patches/")
-        first_reparse = True
-        print("Staring Parse of " + str(len(patches_split)) + " Iterations with " + str(patches_per_run) + " Patches each")
-        for i in range(start_point, len(patches_split)):
-            parsed = reparse_utils.reparse(patches_split[i], corners, first_reparse)
-            io_utils.dump_to_file(parsed, constants.pwd + file_names[i])
-            first_reparse = False
-            print(f"Finished parsing patch {i} of {len(patches_split)}")
+        # Load tree- and soil-data only once for all chunks
+        values = reparse_utils.prepare_reparse(grid, Rasterize)
+
+        print("Staring Parse of " + str(len(chunks)) + " Iterations with " + str(patches_per_run) + " Patches each")
+        reparse_utils.reparse_parallel(patches_split, chunks, [constants.pwd + f for f in file_names], values, Workers)
 
     patches_split = io_utils.read_patches_from_folder(constants.pwd + "/data/dumps/patches/")
 
     if Recalc:
         print("Calculating static Values")
-        for patch in patches_split:
-            factor_calculations.calc_static_values(patch)
+        for patches, store in patches_split:
+            factor_calculations.calc_static_values(store)
 
     print("Flattening Patches")
-    patches = io_utils.flatten_patches(patches_split)
+    patches, store = io_utils.flatten_patches(patches_split)
 
     # Read in pre-processed data points with tree-data
     # patches = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/patches_weather.dump")
 
+    if Archive is not None:
+        print("Importing DWD archive")
+        archive_utils.ingest_archives(Archive, Workers)
+
     # Query weather-data from DWD
     print("Adding Weather to Patches")
-    utils.add_weather(patches)
+    first_day = datetime.datetime.today() - datetime.timedelta(days=Days - 1)
+    if Interpolate:
+        weights = interpolation_utils.patch_weights(patches, store.grid)
+        weather = utils.add_weather(weights.used_stations(), first_day=first_day, last_day=datetime.datetime.today())
+    else:
+        weights = None
+        weather = utils.add_weather([patch.station for patch in patches], first_day=first_day,
+                                    last_day=datetime.datetime.today())
 
     # Dump file with current weather data
-    io_utils.dump_to_file(patches, constants.pwd + "/data/dumps/patches_weather.dump")
+    io_utils.dump_to_file(weather, constants.pwd + "/data/dumps/station_weather.dump")
 
     print("Calculating dynamic Values")
-    # Calculate the actual mushroom probabilities
-    factor_calculations.calc_dynamic_value(patches)
+    # Dynamic factors of all patches for each day, factor_calculations.day_probabilities turns them into the
+    # probabilities of a day
+    dynamic_range = factor_calculations.calc_dynamic_range(patches, weather, weights)
+    # Calculate the actual mushroom probabilities of today (the last day of the range)
+    factor_calculations.calc_dynamic_value(patches, store, weather, weights, dynamic_range)
+
+    if Days > 1:
+        io_utils.dump_to_file([utils.range_days(first_day, datetime.datetime.today()), dynamic_range],
+                              constants.pwd + "/data/dumps/dynamic_range.dump")
 
     # Dump final result to a file for usage in JS
-    io_utils.write_to_GEOJSON(patches)
+    io_utils.write_map(patches, store, workers=Workers, geojson=not Tiles, images=Images, vectors=Tiles,
+                       legacy=Legacy)
     end = time.time()
     print("Total Time for this run: " + str(end - start))
 
@@ -0,0 +1,135 @@
+import contextlib
+import copy
+import mmap
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numba
+import numpy as np
+
+'''
+Utilities to share large read-only data (e.g. the tree and soil shapes) between worker processes.
+All numpy arrays inside of a (nested) structure are moved into shared memory blocks. The structure itself then only
+contains small descriptors, so it can be handed to each worker cheaply. Each worker attaches the blocks once and reads
+the arrays without copying them.
+pool creates such a pool of worker processes, the worker functions read the shared data with worker_arrays.
+Arrays that are memory-mapped from a file (e.g. a polygon store) are not copied at all, the workers map the same file.
+'''
+
+
+class SharedArray:
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+class MappedArray:
+
+    def __init__(self, filename, offset, shape, dtype):
+        self.filename = filename
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+def share(obj, blocks):
+    # Replace every array in obj by a descriptor of a shared memory copy, the created blocks are added to blocks
+    if isinstance(obj, np.memmap) and isinstance(obj.base, mmap.mmap):
+        # Only a whole mapped file can be described by its file, views into it are copied
+        return MappedArray(obj.filename, obj.offset, obj.shape, obj.dtype.str)
+    if isinstance(obj, np.ndarray):
+        # Object arrays can not live in shared memory, they are pickled as usual
+        if obj.dtype == object or obj.nbytes == 0:
+            return obj
+        block = shared_memory.SharedMemory(create=True, size=obj.nbytes)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=block.buf)[...] = obj
+        blocks.append(block)
+        return SharedArray(block.name, obj.shape, obj.dtype.str)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(share(item, blocks) for item in obj)
+    if isinstance(obj, dict):
+        return {key: share(value, blocks) for key, value in obj.items()}
+    if hasattr(obj, "__dict__"):
+        shared = copy.copy(obj)
+        shared.__dict__ = share(vars(obj), blocks)
+        return shared
+    return obj
+
+
+def attach(obj, blocks):
+    # Inverse of share: Replace the descriptors by arrays that use the shared memory blocks
+    # The blocks have to be kept alive as long as the arrays are used
+    if isinstance(obj, SharedArray):
+        block = shared_memory.SharedMemory(name=obj.name)
+        blocks.append(block)
+        return np.ndarray(obj.shape, dtype=np.dtype(obj.dtype), buffer=block.buf)
+    if isinstance(obj, MappedArray):
+        return np.memmap(obj.filename, dtype=np.dtype(obj.dtype), mode="r", offset=obj.offset, shape=obj.shape)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(attach(item, blocks) for item in obj)
+    if isinstance(obj, dict):
+        return {key: attach(value, blocks) for key, value in obj.items()}
+    if hasattr(obj, "__dict__"):
+        attached = copy.copy(obj)
+        attached.__dict__ = attach(vars(obj), blocks)
+        return attached
+    return obj
+
+
+def release(blocks):
+    # Free the shared memory blocks created by share
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+# Data of the current process that was handed to pool or local_worker, see worker_arrays
+worker_data = None
+worker_blocks = []
+
+
+def worker_threads(workers):
+    # Threads of the parallel numba kernels in each worker of a pool with workers processes
+    # If the pool already keeps all cores busy, each worker uses a single core, otherwise the cores are shared out
+    cores = numba.config.NUMBA_NUM_THREADS
+    return 1 if workers >= cores else max(1, cores // workers)
+
+
+def init_worker(shared_data, threads):
+    global worker_data
+    numba.set_num_threads(threads)
+    worker_data = attach(shared_data, worker_blocks)
+
+
+def worker_arrays():
+    # Data of the pool (or local_worker) the current worker function runs in
+    return worker_data
+
+
+@contextlib.contextmanager
+def pool(data, workers):
+    # Pool of worker processes that all read data from shared memory (see worker_arrays)
+    # The shared memory is freed when the pool is closed
+    blocks = []
+    try:
+        shared_data = share(data, blocks)
+        with multiprocessing.Pool(workers, initializer=init_worker,
+                                  initargs=(shared_data, worker_threads(workers))) as worker_pool:
+            yield worker_pool
+    finally:
+        release(blocks)
+
+
+@contextlib.contextmanager
+def local_worker(data):
+    # Run worker functions in this process on data, e.g. with a single worker or inside of a worker process
+    # The data of an enclosing pool or local_worker is restored afterwards
+    global worker_data
+    previous = worker_data
+    worker_data = data
+    try:
+        yield
+    finally:
+        worker_data = previous
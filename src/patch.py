@@ -1,12 +1,12 @@
 """
 Collection of all points that belong to an area with same weather (1km x 1km) for easier processing
+The data calculated for each point is stored in a point_store.PointStore
+The position of the patch and its points is calculated from its index in the grid_spec.GridSpec
+The weather is not stored in the patch, it is looked up by the station in a weather_store.StationWeather
 """
 class Patch:
 
-    def __init__(self, points, middle, station, corners):
-        self.points = points
+    def __init__(self, index, middle, station):
+        self.index = index
         self.middle = middle
         self.station = station
-        self.corners = corners
-        self.dates = []
-        self.weather_data = {}
@@ -0,0 +1,87 @@
+import numpy as np
+
+import constants
+
+"""
+All data of the points of one or more patches, stored in columns instead of one object per point.
+The points are stored patch after patch, each patch has points_per_patch points. The store holds the consecutive
+points first to first + len(store) of a grid_spec.GridSpec, their coordinates are calculated from the grid.
+ - trees / soils: Category of each point as index into tree_names / soil_names (constants.no_match if in no shape)
+ - static / probabilities: One row per point and one column per mushroom type in species
+"""
+class PointStore:
+
+    def __init__(self, grid, first, amount):
+        self.grid = grid
+        # Index of the first point of the store in the grid
+        self.first = int(first)
+        self.amount = int(amount)
+        self.points_per_patch = grid.points_per_patch
+        self.trees = np.full(self.amount, constants.no_match, dtype=np.int16)
+        self.soils = np.full(self.amount, constants.no_match, dtype=np.int16)
+        self.tree_names = []
+        self.soil_names = []
+        self.species = []
+        self.static = np.zeros((self.amount, 0), dtype=np.float32)
+        self.probabilities = np.zeros((self.amount, 0), dtype=np.float32)
+
+    def __len__(self):
+        return self.amount
+
+    def patch_amount(self):
+        return self.amount // self.points_per_patch
+
+    def first_patch(self):
+        return self.first // self.points_per_patch
+
+    def point_indices(self):
+        # Index of each point in the grid
+        return np.arange(self.first, self.first + self.amount, dtype=np.int64)
+
+    def coords(self):
+        # Coordinates ([lat, lon]) of all points
+        return self.grid.point_coords(self.point_indices())
+
+    def cells(self):
+        # Row and column of all points in the raster of the grid
+        return self.grid.point_cells(self.point_indices())
+
+    def set_env(self, codes, names, trees_bool):
+        # Set the tree- or soil-category of all points
+        if trees_bool:
+            self.trees = np.asarray(codes, dtype=np.int16)
+            self.tree_names = list(names)
+        else:
+            self.soils = np.asarray(codes, dtype=np.int16)
+            self.soil_names = list(names)
+
+    def species_column(self, name):
+        return self.species.index(name)
+
+
+def merge_names(stores, trees_bool):
+    # Combine the category names of all stores and translate the codes of each store to the combined names
+    names = sorted(set(name for store in stores for name in (store.tree_names if trees_bool else store.soil_names)))
+    lookup = {name: i for i, name in enumerate(names)}
+    codes = []
+    for store in stores:
+        store_names = store.tree_names if trees_bool else store.soil_names
+        # Append constants.no_match to the translation, so code -1 stays -1
+        translation = np.array([lookup[name] for name in store_names] + [constants.no_match], dtype=np.int16)
+        codes.append(translation[store.trees if trees_bool else store.soils])
+    return np.concatenate(codes), names
+
+
+def concatenate(stores):
+    # Combine the stores of multiple shards into one, the shards have to follow each other in the grid
+    # The static and dynamic values are only combined column by column, so all shards need the same species
+    species = list(stores[0].species)
+    if any(s.species != species for s in stores):
+        raise ValueError("The shards have different species, their values can not be combined")
+    store = PointStore(stores[0].grid, stores[0].first, sum(len(s) for s in stores))
+    store.set_env(*merge_names(stores, True), True)
+    store.set_env(*merge_names(stores, False), False)
+    store.species = species
+    store.static = np.concatenate([s.static for s in stores])
+    store.probabilities = np.concatenate([s.probabilities for s in stores])
+    return store
@@ -0,0 +1,181 @@
+import os
+import shutil
+
+import numpy as np
+from numba import jit, prange
+
+import constants
+
+'''
+Flat representation of the tree and soil shapes and the kernels working on it.
+Instead of a list of arrays per shape, all points are stored in one coordinate array:
+ - coords[ring_offsets[r]:ring_offsets[r + 1]] are the points of ring r
+ - ring_offsets[shape_offsets[s]:shape_offsets[s + 1]] are the rings of shape s, the first one is the outer border,
+   all following ones are holes (excluded areas)
+This format can be handed to numba as a whole, so whole patches can be fitted in a single call.
+It is also stored on disk as a PolygonStore: a folder with one .npy file per array. Loading a store memory-maps the
+files, so nothing is copied until it is used and all processes reading the same store share the memory.
+'''
+
+
+class PolygonStore:
+
+    def __init__(self, coords, ring_offsets, shape_offsets, bboxes, codes, names):
+        self.coords = coords
+        self.ring_offsets = ring_offsets
+        self.shape_offsets = shape_offsets
+        # Bounding box of each shape: [min_0, min_1, max_0, max_1]
+        self.bboxes = bboxes
+        # Category of each shape (e.g. the tree-type) as index into names
+        self.codes = codes
+        self.names = names
+
+    def shapes(self):
+        # The shape arrays in the order the kernels expect them
+        return self.coords, self.ring_offsets, self.shape_offsets
+
+
+store_arrays = ["coords", "ring_offsets", "shape_offsets", "bboxes", "codes"]
+
+
+def flatten_shapes(shapes):
+    # Convert shapes from the list format (see reparse_utils.convert_shapes_to_format) to the flat format
+    ring_lengths = [len(ring) for shape in shapes for ring in shape]
+    rings_per_shape = [len(shape) for shape in shapes]
+
+    ring_offsets = np.zeros(len(ring_lengths) + 1, dtype=np.int64)
+    ring_offsets[1:] = np.cumsum(ring_lengths)
+    shape_offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+    shape_offsets[1:] = np.cumsum(rings_per_shape)
+
+    coords = np.empty((ring_offsets[-1], 2), dtype=np.float64)
+    r = 0
+    for shape in shapes:
+        for ring in shape:
+            coords[ring_offsets[r]:ring_offsets[r + 1]] = ring
+            r += 1
+    return coords, ring_offsets, shape_offsets
+
+
+def flatten_shapefile(shapes):
+    # Convert shapes as read by pyshp directly to the flat format
+    # Each part of a shape becomes a ring, the order of the coordinates is changed to latitude, longitude
+    # Unlike reparse_utils.convert_shapes_to_format, the last part of a shape with multiple parts is kept as well
+    ring_starts = [np.asarray(shape.parts, dtype=np.int64) for shape in shapes]
+    lengths = np.array([len(shape.points) for shape in shapes], dtype=np.int64)
+    point_offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    shape_offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+    shape_offsets[1:] = np.cumsum([len(starts) for starts in ring_starts])
+    ring_offsets = np.empty(shape_offsets[-1] + 1, dtype=np.int64)
+    ring_offsets[-1] = point_offsets[-1]
+
+    coords = np.empty((point_offsets[-1], 2), dtype=np.float64)
+    for i in range(len(shapes)):
+        coords[point_offsets[i]:point_offsets[i + 1]] = np.reshape(shapes[i].points, (-1, 2))[:, ::-1]
+        ring_offsets[shape_offsets[i]:shape_offsets[i + 1]] = ring_starts[i] + point_offsets[i]
+    return coords, ring_offsets, shape_offsets
+
+
+def create_store(shapes, values):
+    # Create a store from flat shapes and the category name (e.g. tree-type) of each shape
+    names, codes = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    coords, ring_offsets, shape_offsets = shapes
+    return PolygonStore(coords, ring_offsets, shape_offsets, flat_bboxes(coords, ring_offsets, shape_offsets),
+                        codes.astype(np.int16), list(names))
+
+
+def write_store(store, folder):
+    # Write all arrays of the store into folder, replacing an existing store only once everything is written
+    os.makedirs(folder + ".tmp", exist_ok=True)
+    for name in store_arrays:
+        np.save(os.path.join(folder + ".tmp", name + ".npy"), getattr(store, name))
+    np.save(os.path.join(folder + ".tmp", "names.npy"), np.array(store.names, dtype=str))
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.replace(folder + ".tmp", folder)
+
+
+def read_store(folder):
+    # Memory-map all arrays of a store
+    arrays = [np.load(os.path.join(folder, name + ".npy"), mmap_mode="r") for name in store_arrays]
+    names = list(np.load(os.path.join(folder, "names.npy")))
+    return PolygonStore(*arrays, [str(name) for name in names])
+
+
+@jit(nopython=True)
+def flat_bboxes(coords, ring_offsets, shape_offsets):
+    # Bounding box of the outer border of each shape: [min_0, min_1, max_0, max_1]
+    bboxes = np.empty((len(shape_offsets) - 1, 4), dtype=np.float64)
+    for s in range(len(shape_offsets) - 1):
+        outer = coords[ring_offsets[shape_offsets[s]]:ring_offsets[shape_offsets[s] + 1]]
+        bboxes[s, 0] = np.min(outer[:, 0])
+        bboxes[s, 1] = np.min(outer[:, 1])
+        bboxes[s, 2] = np.max(outer[:, 0])
+        bboxes[s, 3] = np.max(outer[:, 1])
+    return bboxes
+
+
+@jit(nopython=True)
+def ring_contains_point(coords, start, end, point_0, point_1):
+    # Same crossing test as reparse_utils.shape_contains_point, on a ring of the flat coordinate array
+    c = False
+    j = end - 1
+    for i in range(start, end):
+        if ((coords[i, 1] > point_1) != (coords[j, 1] > point_1)) and (
+                point_0 < ((coords[j, 0] - coords[i, 0]) * (point_1 - coords[i, 1])
+                           / (coords[j, 1] - coords[i, 1]) + coords[i, 0])):
+            c = not c
+        j = i
+    return c
+
+
+@jit(nopython=True)
+def flat_shape_contains_point(coords, ring_offsets, shape_offsets, s, point_0, point_1):
+    # The point has to lie inside of the outer border, but in none of the holes
+    first_ring = shape_offsets[s]
+    if not ring_contains_point(coords, ring_offsets[first_ring], ring_offsets[first_ring + 1], point_0, point_1):
+        return False
+    for r in range(first_ring + 1, shape_offsets[s + 1]):
+        if ring_contains_point(coords, ring_offsets[r], ring_offsets[r + 1], point_0, point_1):
+            return False
+    return True
+
+
+def points_in_shapes_inner(points, groups, candidate_offsets, candidates, coords, ring_offsets, shape_offsets, bboxes,
+                           result):
+    # Each point i belongs to group groups[i] (e.g. its patch) with the candidate shapes
+    # candidates[candidate_offsets[g]:candidate_offsets[g + 1]]
+    # The first candidate that contains the point is written to result, the others keep their value
+    for i in prange(len(points)):
+        point_0 = points[i, 0]
+        point_1 = points[i, 1]
+        g = groups[i]
+        for j in range(candidate_offsets[g], candidate_offsets[g + 1]):
+            s = candidates[j]
+            # Cheap check on the bounding box first
+            if point_0 < bboxes[s, 0] or point_0 > bboxes[s, 2] or point_1 < bboxes[s, 1] or point_1 > bboxes[s, 3]:
+                continue
+            if flat_shape_contains_point(coords, ring_offsets, shape_offsets, s, point_0, point_1):
+                result[i] = s
+                break
+    return result
+
+
+points_in_shapes_serial = jit(nopython=True)(points_in_shapes_inner)
+points_in_shapes_parallel = jit(nopython=True, parallel=True)(points_in_shapes_inner)
+
+
+def points_in_shapes(points, candidate_offsets, candidates, coords, ring_offsets, shape_offsets, bboxes, groups=None,
+                     parallel=False):
+    # Find the containing shape of every point in one call
+    # parallel uses the multi-core kernel. Only use it in processes that do not fork pools afterwards (e.g. pool
+    # workers): the TBB threads of a parallel kernel make the pools of the main process hang on exit
+    # Points that lie in none of the candidate shapes get the value constants.no_match
+    points = np.ascontiguousarray(np.reshape(points, (-1, 2)), dtype=np.float64)
+    if groups is None:
+        # All points share the same candidates
+        groups = np.zeros(len(points), dtype=np.int64)
+    result = np.full(len(points), constants.no_match, dtype=np.int64)
+    kernel = points_in_shapes_parallel if parallel else points_in_shapes_serial
+    return kernel(points, groups, candidate_offsets, candidates, coords, ring_offsets, shape_offsets, bboxes, result)
@@ -0,0 +1,234 @@
+import numpy as np
+from numba import jit
+
+import constants
+
+'''
+Conversion of a probability raster into as few polygons as possible for the map.
+The probabilities are quantized into constants.probability_classes classes. Cells of the same class that touch each
+other (horizontally or vertically) are joined into regions with a union-find. The border of each region is traced
+along the cell edges into rings: the outer border of a region and one ring for each hole inside of it.
+Every step touches each cell and edge a constant amount of times, so the whole conversion is linear in the amount of
+cells.
+Raster cell [i, j] belongs to the point origin + [i * steps[0], j * steps[1]] ([lat, lon]).
+'''
+
+
+def quantize(probabilities, classes=constants.probability_classes):
+    # Class of each probability: 0 for a probability of 0, otherwise 1 to classes
+    # Any probability above 0 gets at least class 1, so no area with a chance of finding mushrooms is lost
+    # The probabilities are float32, e.g. 0.3 is stored as 0.30000001, so they are rounded before taking the ceiling
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    return np.clip(np.ceil(np.round(probabilities * classes, 4)), 0, classes).astype(np.int16)
+
+
+def class_value(class_ids, classes=constants.probability_classes):
+    # Probability that represents a class
+    return np.asarray(class_ids, dtype=np.float64) / classes
+
+
+@jit(nopython=True)
+def find_root(parent, i):
+    # Root of the set of i, the path is shortened on the way
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+@jit(nopython=True)
+def label_regions(raster):
+    # Join all touching cells of the same class into regions
+    # Returns the region of each cell (-1 for class 0) and the class of each region
+    n_0, n_1 = raster.shape
+    parent = np.arange(n_0 * n_1)
+    for i in range(n_0):
+        for j in range(n_1):
+            if raster[i, j] == 0:
+                continue
+            cell = i * n_1 + j
+            if j + 1 < n_1 and raster[i, j + 1] == raster[i, j]:
+                root_1 = find_root(parent, cell)
+                root_2 = find_root(parent, cell + 1)
+                if root_1 != root_2:
+                    parent[max(root_1, root_2)] = min(root_1, root_2)
+            if i + 1 < n_0 and raster[i + 1, j] == raster[i, j]:
+                root_1 = find_root(parent, cell)
+                root_2 = find_root(parent, cell + n_1)
+                if root_1 != root_2:
+                    parent[max(root_1, root_2)] = min(root_1, root_2)
+
+    # Number the regions consecutively in order of their first cell
+    labels = np.full((n_0, n_1), -1, dtype=np.int64)
+    region_of_root = np.full(n_0 * n_1, -1, dtype=np.int64)
+    region_classes = np.empty(n_0 * n_1, dtype=np.int16)
+    regions = 0
+    for i in range(n_0):
+        for j in range(n_1):
+            if raster[i, j] == 0:
+                continue
+            root = find_root(parent, i * n_1 + j)
+            if region_of_root[root] == -1:
+                region_of_root[root] = regions
+                region_classes[regions] = raster[i, j]
+                regions += 1
+            labels[i, j] = region_of_root[root]
+    return labels, region_classes[:regions]
+
+
+@jit(nopython=True)
+def region_edges(labels):
+    # All cell edges on the border of a region, directed so that the region lies on their left
+    # Vertex [a, b] is the lower left corner of cell [a, b], directions are 0: +j, 1: +i, 2: -j, 3: -i
+    n_0, n_1 = labels.shape
+    count = 0
+    for i in range(n_0):
+        for j in range(n_1):
+            label = labels[i, j]
+            if label == -1:
+                continue
+            count += int(i == 0 or labels[i - 1, j] != label) + int(j == n_1 - 1 or labels[i, j + 1] != label) + \
+                int(i == n_0 - 1 or labels[i + 1, j] != label) + int(j == 0 or labels[i, j - 1] != label)
+
+    starts = np.empty((count, 2), dtype=np.int64)
+    directions = np.empty(count, dtype=np.int64)
+    edge_labels = np.empty(count, dtype=np.int64)
+    e = 0
+    for i in range(n_0):
+        for j in range(n_1):
+            label = labels[i, j]
+            if label == -1:
+                continue
+            if i == 0 or labels[i - 1, j] != label:
+                starts[e, 0], starts[e, 1], directions[e], edge_labels[e] = i, j, 0, label
+                e += 1
+            if j == n_1 - 1 or labels[i, j + 1] != label:
+                starts[e, 0], starts[e, 1], directions[e], edge_labels[e] = i, j + 1, 1, label
+                e += 1
+            if i == n_0 - 1 or labels[i + 1, j] != label:
+                starts[e, 0], starts[e, 1], directions[e], edge_labels[e] = i + 1, j + 1, 2, label
+                e += 1
+            if j == 0 or labels[i, j - 1] != label:
+                starts[e, 0], starts[e, 1], directions[e], edge_labels[e] = i + 1, j, 3, label
+                e += 1
+    return starts, directions, edge_labels
+
+
+@jit(nopython=True)
+def trace_rings(shape, starts, directions, edge_labels):
+    # Link the edges into closed rings, only the corners of the rings are kept
+    # Returns the corner vertices of all rings, the offsets of the rings and the region of each ring
+    n_0, n_1 = shape
+    step_0 = np.array([0, 1, 0, -1])
+    step_1 = np.array([1, 0, -1, 0])
+
+    # At most one edge leaves a vertex in each direction
+    outgoing = np.full((n_0 + 1) * (n_1 + 1) * 4, -1, dtype=np.int64)
+    for e in range(len(directions)):
+        outgoing[(starts[e, 0] * (n_1 + 1) + starts[e, 1]) * 4 + directions[e]] = e
+
+    used = np.zeros(len(directions), dtype=np.bool_)
+    vertices = np.empty((len(directions), 2), dtype=np.int64)
+    ring_offsets = np.zeros(len(directions) + 1, dtype=np.int64)
+    ring_labels = np.empty(len(directions), dtype=np.int64)
+    # Corners of the walk that is currently traced and the position of each vertex in it (-1 if it is not in it)
+    walk = np.empty((len(directions), 2), dtype=np.int64)
+    position = np.full((n_0 + 1) * (n_1 + 1), -1, dtype=np.int64)
+    v = 0
+    rings = 0
+    for first in range(len(directions)):
+        if used[first]:
+            continue
+        e = first
+        w = 0
+        while not used[e]:
+            used[e] = True
+            end_0 = starts[e, 0] + step_0[directions[e]]
+            end_1 = starts[e, 1] + step_1[directions[e]]
+            vertex = end_0 * (n_1 + 1) + end_1
+            # Two regions of the same class never touch, but one region may touch itself at a corner.
+            # Turning left first keeps the cells of the region that only touch at the corner apart, so the ring
+            # never crosses itself
+            following = -1
+            for turn in (1, 0, 3):
+                candidate = outgoing[vertex * 4 + (directions[e] + turn) % 4]
+                if candidate != -1 and edge_labels[candidate] == edge_labels[e]:
+                    following = candidate
+                    break
+            if directions[following] != directions[e]:
+                if position[vertex] != -1:
+                    # The walk returns to a corner it already passed (e.g. a hole that touches the outer border at
+                    # a corner). The loop since then becomes a ring of its own, so no ring touches itself
+                    k = position[vertex]
+                    for m in range(k, w):
+                        vertices[v] = walk[m]
+                        position[walk[m, 0] * (n_1 + 1) + walk[m, 1]] = -1
+                        v += 1
+                    ring_labels[rings] = edge_labels[first]
+                    rings += 1
+                    ring_offsets[rings] = v
+                    w = k
+                walk[w, 0] = end_0
+                walk[w, 1] = end_1
+                position[vertex] = w
+                w += 1
+            e = following
+        for m in range(w):
+            vertices[v] = walk[m]
+            position[walk[m, 0] * (n_1 + 1) + walk[m, 1]] = -1
+            v += 1
+        ring_labels[rings] = edge_labels[first]
+        rings += 1
+        ring_offsets[rings] = v
+    return vertices[:v], ring_offsets[:rings + 1], ring_labels[:rings]
+
+
+@jit(nopython=True)
+def ring_areas(vertices, ring_offsets):
+    # Signed area of each ring, outer borders are counter-clockwise (positive), holes clockwise (negative)
+    areas = np.zeros(len(ring_offsets) - 1, dtype=np.float64)
+    for r in range(len(ring_offsets) - 1):
+        start = ring_offsets[r]
+        end = ring_offsets[r + 1]
+        for k in range(start, end):
+            n = start + (k - start + 1) % (end - start)
+            areas[r] += vertices[k, 1] * vertices[n, 0] - vertices[n, 1] * vertices[k, 0]
+    return areas / 2
+
+
+def polygonize_arrays(raster, origin, steps, classes=constants.probability_classes):
+    # Convert a raster of probabilities into polygons with holes, as flat arrays
+    # Returns the corners of all rings as [lon, lat], the offsets of the rings into the corners, the offsets of the
+    # polygons into the rings and the value of each polygon. The first ring of each polygon is its outer border, the
+    # rings are not closed (the first corner is not repeated). Areas with a probability of 0 are left out.
+    class_raster = quantize(raster, classes)
+    labels, region_classes = label_regions(class_raster)
+    starts, directions, edge_labels = region_edges(labels)
+    vertices, ring_offsets, ring_labels = trace_rings(np.array(labels.shape, dtype=np.int64), starts, directions,
+                                                      edge_labels)
+    areas = ring_areas(vertices, ring_offsets)
+
+    # Sort the rings by polygon, the outer border (positive area) first
+    order = np.lexsort((areas <= 0, ring_labels))
+    lengths = np.diff(ring_offsets)[order]
+    new_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    vertices = vertices[np.repeat(ring_offsets[:-1][order] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])]
+    polygon_offsets = np.searchsorted(ring_labels[order], np.arange(len(region_classes) + 1))
+
+    # Vertex [a, b] is the corner between the cells [a - 1, b - 1] and [a, b]
+    coords = np.asarray(origin, dtype=np.float64) + (vertices - 0.5) * np.asarray(steps, dtype=np.float64)
+    return coords[:, ::-1].copy(), new_offsets, polygon_offsets, class_value(region_classes, classes)
+
+
+def polygonize(raster, origin, steps, classes=constants.probability_classes):
+    # Convert a raster of probabilities into polygons with holes
+    # Returns a list of [rings, value] with the rings as closed lists of [lon, lat] coordinates, the first ring is
+    # the outer border. Areas with a probability of 0 are left out.
+    coords, ring_offsets, polygon_offsets, values = polygonize_arrays(raster, origin, steps, classes)
+    rings = []
+    for r in range(len(ring_offsets) - 1):
+        ring = coords[ring_offsets[r]:ring_offsets[r + 1]].tolist()
+        ring.append(ring[0])
+        rings.append(ring)
+    return [[rings[polygon_offsets[p]:polygon_offsets[p + 1]], float(values[p])] for p in range(len(values))]
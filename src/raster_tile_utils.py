@@ -0,0 +1,141 @@
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import constants
+import parallel_utils
+import polygonize_utils
+import tile_utils
+
+'''
+Export of the probability map as a pyramid of PNG image tiles (web/tiles/<species>/{z}/{x}/{y}.png) for the zoomed out
+views of the map. At these zoom levels a point of the grid is smaller than a pixel, so polygons would be wasted work.
+The grid is resampled once into web mercator pixels of raster_max_zoom, every pixel stores the probability class of its
+point (see polygonize_utils.quantize). Each lower zoom level is created by combining 2 x 2 pixels into one.
+The tiles are 8 bit palette images: the palette maps each class to the color of the map, class 0 is transparent.
+They are encoded and written by a pool of worker processes that read the levels from shared memory.
+'''
+
+
+def level_tiles(zoom, lon_range, lat_range):
+    # First tile and amount of tiles (x, y) of zoom that cover the given area, the first tile is even so that
+    # 2 x 2 tiles of this level always form one tile of the next lower level
+    corners = tile_utils.world_pixels(np.array([[lon_range[0], lat_range[1]], [lon_range[1], lat_range[0]]]), zoom,
+                                      constants.raster_tile_size)
+    first = np.floor(corners[0] / constants.raster_tile_size).astype(np.int64) // 2 * 2
+    last = np.floor(corners[1] / constants.raster_tile_size).astype(np.int64)
+    amount = (last - first) // 2 * 2 + 2
+    return first, amount
+
+
+def resample(raster, origin, steps, zoom, first, amount, classes=constants.probability_classes):
+    # Class of the closest point of the grid for the middle of each pixel of the tiles from first to first + amount
+    # Pixels outside of the grid get class 0
+    size = constants.raster_tile_size * 2 ** zoom
+    x = (first[0] * constants.raster_tile_size + np.arange(amount[0] * constants.raster_tile_size) + 0.5) / size
+    y = (first[1] * constants.raster_tile_size + np.arange(amount[1] * constants.raster_tile_size) + 0.5) / size
+    lon = x * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1.0 - 2.0 * y))))
+
+    rows = np.round((lat - origin[0]) / steps[0]).astype(np.int64)
+    columns = np.round((lon - origin[1]) / steps[1]).astype(np.int64)
+    valid_rows = (rows >= 0) & (rows < raster.shape[0])
+    valid_columns = (columns >= 0) & (columns < raster.shape[1])
+
+    class_raster = polygonize_utils.quantize(raster, classes).astype(np.uint8)
+    image = np.zeros((len(rows), len(columns)), dtype=np.uint8)
+    image[np.ix_(valid_rows, valid_columns)] = class_raster[np.ix_(rows[valid_rows], columns[valid_columns])]
+    return image
+
+
+def downsample(image):
+    # Combine 2 x 2 pixels into one, the mean of the classes is rounded up so that no class above 0 vanishes
+    summed = image.reshape(image.shape[0] // 2, 2, image.shape[1] // 2, 2).sum(axis=(1, 3), dtype=np.int64)
+    return ((summed + 3) // 4).astype(np.uint8)
+
+
+def align(image, first, amount):
+    # Extend the image of a level so that its first tile and amount of tiles are even again
+    start = first % 2
+    end = (amount + start) % 2
+    padded = np.zeros((image.shape[0] + (start[1] + end[1]) * constants.raster_tile_size,
+                       image.shape[1] + (start[0] + end[0]) * constants.raster_tile_size), dtype=np.uint8)
+    padded[start[1] * constants.raster_tile_size:start[1] * constants.raster_tile_size + image.shape[0],
+           start[0] * constants.raster_tile_size:start[0] * constants.raster_tile_size + image.shape[1]] = image
+    return padded, first - start, amount + start + end
+
+
+def build_levels(raster, origin, steps):
+    # Images of all zoom levels from raster_min_zoom to raster_max_zoom
+    # Returns a dictionary zoom -> [image, first tile]
+    lat_range = [origin[0] - steps[0], origin[0] + raster.shape[0] * steps[0]]
+    lon_range = [origin[1] - steps[1], origin[1] + raster.shape[1] * steps[1]]
+    zoom = constants.raster_max_zoom
+    first, amount = level_tiles(zoom, lon_range, lat_range)
+    image = resample(raster, origin, steps, zoom, first, amount)
+
+    levels = {}
+    while True:
+        levels[zoom] = [image, first]
+        if zoom == constants.raster_min_zoom:
+            return levels
+        image, first, amount = align(downsample(image), first // 2, amount // 2)
+        zoom -= 1
+
+
+def palette(classes=constants.probability_classes):
+    # Color and transparency of each class, the same colors as the polygons of the map
+    alphas = np.minimum(0.5 * polygonize_utils.class_value(np.arange(classes + 1), classes), 0.5)
+    colors = np.tile(np.array([0, 255, 0], dtype=np.uint8), (classes + 1, 1))
+    return colors.tobytes(), np.round(alphas * 255).astype(np.uint8).tobytes()
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(image, colors, alphas):
+    # 8 bit palette image, every row starts with filter type 0
+    header = struct.pack(">IIBBBBB", image.shape[1], image.shape[0], 8, 3, 0, 0, 0)
+    rows = np.hstack((np.zeros((image.shape[0], 1), dtype=np.uint8), image))
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", header) + png_chunk(b"PLTE", colors) + \
+        png_chunk(b"tRNS", alphas) + png_chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)) + png_chunk(b"IEND", b"")
+
+
+def write_raster_tile(task):
+    directory, zoom, x, y = task
+    # The images of all levels are the data of the pool, see parallel_utils.worker_arrays
+    image, first = parallel_utils.worker_arrays()[zoom]
+    size = constants.raster_tile_size
+    tile = image[(y - first[1]) * size:(y - first[1] + 1) * size, (x - first[0]) * size:(x - first[0] + 1) * size]
+    if not np.any(tile):
+        return 0
+    os.makedirs(directory + f"/{zoom}/{x}", exist_ok=True)
+    with open(directory + f"/{zoom}/{x}/{y}.png", 'wb') as fp:
+        fp.write(encode_png(tile, *palette()))
+    return 1
+
+
+def write_raster_pyramid(raster, origin, steps, name, workers=os.cpu_count(), directory=None):
+    # Write the image tiles of all zoom levels of a probability raster (see grid_spec.GridSpec.layout), workers = 1
+    # writes all tiles in this process
+    if directory is None:
+        directory = tile_utils.tiles_directory + "/" + name
+    levels = build_levels(raster, origin, steps)
+    tasks = []
+    for zoom, (image, first) in levels.items():
+        tiles_y = image.shape[0] // constants.raster_tile_size
+        tiles_x = image.shape[1] // constants.raster_tile_size
+        tasks.extend([directory, zoom, int(first[0] + x), int(first[1] + y)]
+                     for x in range(tiles_x) for y in range(tiles_y))
+
+    if workers > 1:
+        with parallel_utils.pool(levels, workers) as pool:
+            written = sum(pool.imap_unordered(write_raster_tile, tasks, chunksize=16))
+    else:
+        with parallel_utils.local_worker(levels):
+            written = sum(map(write_raster_tile, tasks))
+    print("Written image tiles: " + str(written))
@@ -0,0 +1,94 @@
+import numpy as np
+from numba import jit
+
+import constants
+
+'''
+Scanline rasterization of the tree and soil shapes onto the point grid.
+Instead of searching the containing shape for every single point, each shape is burned into an integer raster that has
+exactly one cell per grid point. The shapes use the flat format of polygon_utils.
+Raster cell [i, j] belongs to the point origin + [i * steps[0], j * steps[1]].
+'''
+
+
+@jit(nopython=True)
+def ring_crossings(coords, start, end, point_1, crossings):
+    # Sorted crossings of a ring with the column at point_1
+    # This uses the same crossing rule as polygon_utils.ring_contains_point, so both give the same points
+    found = 0
+    k = end - 1
+    for i in range(start, end):
+        if (coords[i, 1] > point_1) != (coords[k, 1] > point_1):
+            crossings[found] = (coords[k, 0] - coords[i, 0]) * (point_1 - coords[i, 1]) / \
+                               (coords[k, 1] - coords[i, 1]) + coords[i, 0]
+            found += 1
+        k = i
+    return np.sort(crossings[:found])
+
+
+@jit(nopython=True)
+def fill_ring(coords, start, end, point_1, origin, steps, column, fill, crossings):
+    # Set all cells of the column that lie inside of the ring to fill
+    # A point lies inside if it is between crossing 2m (inclusive) and 2m+1 (exclusive)
+    # Both ends are clamped to the column, pairs completely before or after it fill nothing
+    crossing_sorted = ring_crossings(coords, start, end, point_1, crossings)
+    for m in range(0, len(crossing_sorted) - 1, 2):
+        i_start = min(max(int(np.ceil((crossing_sorted[m] - origin[0]) / steps[0])), 0), len(column))
+        i_end = min(max(int(np.ceil((crossing_sorted[m + 1] - origin[0]) / steps[0])), 0), len(column))
+        if i_start < i_end:
+            column[i_start:i_end] = fill
+
+
+@jit(nopython=True)
+def burn_shape(coords, ring_offsets, shape_offsets, bbox, s, value, origin, steps, raster, column, crossings):
+    # Walk over each grid column (fixed second coordinate) covered by the shape
+    # and fill all cells that are inside of the outer border, but in none of the holes (like
+    # polygon_utils.flat_shape_contains_point, also for holes that reach outside of the border)
+    n_0, n_1 = raster.shape
+    j_start = max(int(np.ceil((bbox[1] - origin[1]) / steps[1])), 0)
+    j_end = min(int(np.floor((bbox[3] - origin[1]) / steps[1])), n_1 - 1)
+    i_start = max(int(np.ceil((bbox[0] - origin[0]) / steps[0])), 0)
+    i_end = min(int(np.floor((bbox[2] - origin[0]) / steps[0])) + 1, n_0)
+    first_ring = shape_offsets[s]
+    for j in range(j_start, j_end + 1):
+        point_1 = origin[1] + j * steps[1]
+        column[i_start:i_end] = 0
+        fill_ring(coords, ring_offsets[first_ring], ring_offsets[first_ring + 1], point_1, origin, steps, column, 1,
+                  crossings)
+        for r in range(first_ring + 1, shape_offsets[s + 1]):
+            fill_ring(coords, ring_offsets[r], ring_offsets[r + 1], point_1, origin, steps, column, 0, crossings)
+
+        for i in range(i_start, i_end):
+            # The first shape containing a point keeps it
+            if column[i] == 1 and raster[i, j] == constants.no_match:
+                raster[i, j] = value
+
+
+@jit(nopython=True)
+def burn_shapes(coords, ring_offsets, shape_offsets, bboxes, values, origin, steps, raster):
+    # Each edge crosses a column at most once, so the crossings of a ring fit into an array of its point amount
+    max_points = 0
+    for r in range(len(ring_offsets) - 1):
+        max_points = max(max_points, ring_offsets[r + 1] - ring_offsets[r])
+    crossings = np.empty(max_points, dtype=np.float64)
+    # Cells of the current column that are inside of the current shape
+    column = np.zeros(raster.shape[0], dtype=np.int8)
+
+    for s in range(len(shape_offsets) - 1):
+        bbox = bboxes[s]
+        # Skip shapes outside of the raster
+        if bbox[2] < origin[0] or bbox[3] < origin[1] or \
+                bbox[0] > origin[0] + raster.shape[0] * steps[0] or bbox[1] > origin[1] + raster.shape[1] * steps[1]:
+            continue
+        burn_shape(coords, ring_offsets, shape_offsets, bbox, s, values[s], origin, steps, raster, column,
+                   crossings)
+    return raster
+
+
+def rasterize_shapes(shapes, bboxes, values, origin, steps, raster_shape):
+    # Burn the value of each shape into a raster, cells that are in no shape keep constants.no_match
+    coords, ring_offsets, shape_offsets = shapes
+    raster = np.full(raster_shape, constants.no_match, dtype=np.int16)
+    return burn_shapes(coords, ring_offsets, shape_offsets, bboxes, np.asarray(values, dtype=np.int16),
+                       np.asarray(origin, dtype=np.float64), np.asarray(steps, dtype=np.float64), raster)
+
@@ -5,16 +5,23 @@ import patch
 import environment_utils
 from numba import jit
 from dbfread import DBF
-from pyproj import Proj
+from pyproj import Proj, Transformer, CRS
 
 import time
+import functools
+import os
 
-import datum
+import point_store
+import grid_spec
 
-import math
 import constants
 
 import io_utils
+import cache_utils
+import index_utils
+import polygon_utils
+import raster_utils
+import parallel_utils
 
 '''
 This File contains all operations that are related to do the geometrical processing of the data points.
@@ -62,62 +69,22 @@ def find_closest_station(coord, stations):
     return best_stat
 
 
-def create_points_inner(topx, topy, botx, boty, x_add, y_add, dist):
-    # Create points from topx to boty without creating patches
-    cords = []
-    cord = [topx, topy]
-
-    while cord[1] + y_add < boty:
-        y_add = dist / get_long_fac(cord[0])
-        cords.append(cord)
-
-        while cord[0] + x_add < botx:
-            cord = [cord[0] + x_add, cord[1]]
-            cords.append(cord)
-        cord = [topx, cord[1] + y_add]
-
-    # If last coordinate is only excluded because of round-errors, include it
-    if (cord[1] + y_add - boty) / y_add < 0.00001:
-        cords.append(cord)
-        while cord[0] + x_add < botx:
-            cord = [cord[0] + x_add, cord[1]]
-            cords.append(cord)
-    return cords
-
-
-def create_points_inner_fixed(topx, topy, x_add, y_add, dist, amount):
-    # Create points from topx to boty without creating patches
-    cords = []
-    cord = [topx, topy]
-
-    for i in range(amount):
-        inner_counter = 0
-        cords.append(cord)
-        for j in range(amount - 1):
-            inner_counter += 1
-            cord = [cord[0] + x_add, cord[1]]
-            cords.append(cord)
-        cord = [topx, cord[1] + y_add]
-    return cords
+@jit(nopython=True)
+def find_closest_stations(coords, stations):
+    # Find the closest DWD station (see find_closest_station) of all coordinates in one call
+    # This runs on a single core: the TBB threads of a parallel kernel would make the process pools that follow the
+    # grid creation (e.g. reparse_parallel) hang when the main process exits
+    result = np.empty(len(coords), dtype=np.float64)
+    for i in range(len(coords)):
+        result[i] = find_closest_station(coords[i], stations)
+    return result
 
 
 def create_points(topx, topy, botx, boty, dist, patch_size_sqrt):
-    # Create points from topx to boty with equal distance dist
-    # Combine them in patches of patch_size
+    # Create the grid of points from topx to boty with equal distance dist
+    # Combine them in patches of patch_size, the points themselves are only described by the grid
     print("Starting to create points")
-
-    x_start = min(topx, botx)
-    y_start = min(topy, boty)
-    x_end = max(topx, botx)
-    y_end = max(topy, boty)
-
-    # Current coordinate that is being created
-    cord = [x_start, y_start]
-
-    x_add = dist / get_lat_fac()
-    y_add = dist / get_long_fac(cord[0])
-
-    patches = []
+    grid = grid_spec.from_corners([topx, topy, botx, boty], dist, patch_size_sqrt)
 
     # Store all DWD stations
     stations = environment_utils.get_stations()
@@ -128,92 +95,82 @@ def create_points(topx, topy, botx, boty, dist, patch_size_sqrt):
         stations_minimized.append([station['geo_lat'], station['geo_lon'], station['station_id']])
     stations_minimized = np.array(stations_minimized, dtype=np.float64)
 
-    # Iterate Grid
-    while cord[1] + patch_size_sqrt * y_add < y_end:
-        y_added = 0
-        while cord[0] + patch_size_sqrt * x_add < x_end:
-            # For each patch, create patch_size points (Standard: 100)
-            patch_points = create_points_inner_fixed(cord[0], cord[1], x_add, y_add, dist, patch_size_sqrt)
-
-            # Create additional Information about Patch
-            middle = get_middle(cord[0], cord[0] + patch_size_sqrt * x_add, cord[1], cord[1] + patch_size_sqrt * y_add)
-            station_id = find_closest_station(np.array(cord), stations_minimized)
-            corners = create_corners(cord, patch_size_sqrt * x_add, patch_size_sqrt * y_add)
+    # Origin and middle of all patches at once, the grid calculates them from the patch indices
+    indices = np.arange(grid.patch_amount())
+    origins = grid.cell_coords(*grid.patch_cells(indices))
+    middles = grid.patch_middles(indices).tolist()
+    station_ids = find_closest_stations(origins, stations_minimized).tolist()
 
-            patches.append(patch.Patch(patch_points, middle, station_id, corners))
-
-            # Adapt coordinate for next patch
-            cord = [cord[0] + patch_size_sqrt * x_add, cord[1]]
-            y_added += y_add
-
-        cord = [x_start, cord[1] + patch_size_sqrt * y_add]
-        y_add = dist / get_long_fac(cord[0])
+    patches = [patch.Patch(i, middles[i], station_ids[i]) for i in range(len(indices))]
 
     print("Created amount of Patches: " + str(len(patches)))
     print("Created amount of Points: " + str(len(patches) * (patch_size_sqrt ** 2)))
-    return patches
-
+    return grid, patches
 
-def create_corners(cord, x_delta, y_delta):
-    cords = [cord, [cord[0] + x_delta, cord[1]], [cord[0], cord[1] + y_delta], [cord[0] + x_delta, cord[1] + y_delta]]
-    return cords
 
+@functools.lru_cache(maxsize=None)
+def get_proj(projection):
+    # Creating a projection is expensive, so only do it once per coordinate system
+    return Proj(projection)
 
-def get_middle(x_start, x_end, y_start, y_end):
-    return [(x_start + x_end) / 2, (y_start + y_end) / 2]
 
-
-def calc_averages(shape_points):
-    # Calc averages of points
-    res = []
-    for i in range(len(shape_points)):
-        points = np.array(shape_points[i])
-        res.append([np.mean(points[:, 0]), np.mean(points[:, 1])])
-    return res
-
-
-@jit(nopython=True)
-def find_closest_point(point, points):
-    # Currently not used
-    arr = np.array([abs(get_distance(point[0], point[1], points[i][0], points[i][1])) for i in range(len(points))])
-    min_ind = np.argmin(arr)
-    return min_ind, points[min_ind]
+@functools.lru_cache(maxsize=None)
+def get_transformer(projection):
+    # Transformer from a coordinate system to EPSG:4326, with coordinates in order longitude, latitude
+    return Transformer.from_crs(CRS.from_user_input(projection), "EPSG:4326", always_xy=True)
 
 
 def project_coordinate_inverse(coordinate, projection):
     # Use inverse projection on coordinate
-    p = Proj(projection)
+    p = get_proj(projection)
     point = p(coordinate[0], coordinate[1], inverse=True)
     return [point[1], point[0]]
 
 
 def project_coordinate(coordinate, projection):
     # Use projection on coordinate
-    p = Proj(projection)
+    p = get_proj(projection)
     return p(coordinate[0], coordinate[1])
 
 
+def project_coordinates(coordinates, projection):
+    # Project a whole array of coordinates to EPSG:4326 in a single call
+    coordinates = np.reshape(np.asarray(coordinates, dtype=np.float64), (-1, 2))
+    lon, lat = get_transformer(projection).transform(coordinates[:, 0], coordinates[:, 1])
+    return np.column_stack((lon, lat))
+
+
 def project_shapes(shapes: list, projection: str):
     # If shapes are not stored in correct coordinate system
     # Project them to common coordinate system
     # We are currently using EPSG:4326
-    re = []
-    finished_shapes = 0
-    print("Start projecting %f Shapes", len(shapes))
+    # All points of all shapes are projected at once, the shapes keep their parts and the order longitude, latitude
+    print("Start projecting " + str(len(shapes)) + " Shapes")
+    lengths = [len(shape.points) for shape in shapes]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
 
+    coordinates = np.empty((offsets[-1], 2), dtype=np.float64)
     for i in range(len(shapes)):
-        points = shapes[i].points
-        projected_points = []
+        coordinates[offsets[i]:offsets[i + 1]] = np.reshape(shapes[i].points, (-1, 2))
+    projected = project_coordinates(coordinates, projection)
 
-        for point in points:
-            projected_points.append(project_coordinate_inverse(point, projection))
-            if finished_shapes % 1000 == 0:
-                print(str(finished_shapes) + " of " + str(len(points)))
-            finished_shapes += 1
+    for i in range(len(shapes)):
+        shapes[i].points = projected[offsets[i]:offsets[i + 1]]
+    return shapes
 
-        finished_shapes = 0
-        re.append(projected_points)
-    return re
+
+def read_projection(shape_folder):
+    # Read the coordinate system of a shape file from its .prj file
+    # Shape files without one are expected to already use EPSG:4326
+    if not os.path.exists(shape_folder + ".prj"):
+        return "EPSG:4326"
+    with open(shape_folder + ".prj") as fp:
+        return fp.read().strip()
+
+
+def is_common_projection(projection):
+    # True if the coordinate system already is EPSG:4326
+    return CRS.from_user_input(projection).to_epsg() == 4326
 
 
 def create_lookup(shape_folder):
@@ -227,246 +184,37 @@ def create_records(shape_folder):
     return sf.records()
 
 
-def parse_in_shape(shape_folder, projection):
+def parse_in_shape(shape_folder, projection=None):
     # Parse in a shape file
+    # Without a given projection, the coordinate system is read from the .prj file of the shape file
     sf = shapefile.Reader(shape_folder, encoding="iso-8859-1")
+    if projection is None:
+        projection = read_projection(shape_folder)
 
     # If projection is already the desired one -> Skip projecting it
-    if projection == "EPSG:4326":
+    if is_common_projection(projection):
         return sf.shapes(), sf.records(), create_lookup(shape_folder)
     return project_shapes(sf.shapes(), projection), sf.records(), create_lookup(shape_folder)
 
 
-@jit(nopython=True)
-def shape_contains_points(shape, points):
-    ctn = False
-    for point in points:
-        if shape_contains_point(shape, point):
-            ctn = True
-    return ctn
-
-
-def patch_in_shape(shape, patch):
-    # If one of the patch corners not contained in shape -> Check all
-    # Requires sufficiently smooth shape to work
-    if not shape_contains_points(np.array(shape), np.array(patch.corners)):
-        contained_points = []
-
-        for p in patch.points:
-            if shape_contains_point(np.array(shape), np.array(p)):
-                contained_points.append(p)
-                print("Kept point")
-
-        patch.points = contained_points
-        return
-
-
-def cut_patches(patches, shape):
-    # Ensure that patches only contain points in shape
-    # Used to remove all points that are not in a shape
-    # E.g. remove points that are not in Germany from all patches that lie on the border
-    for patch in patches:
-        patch_in_shape(np.array(shape), patch)
-
-
-def find_max_size_shape(shape):
-    # Approximate distance between the two most distant points in shape
-    shape = np.array(shape)
-    middle_point = shape[0]  # This is only an approximation, but will always over-estimate distance in the end
-    dist_arr = np.array(np.abs(get_distance_arr(shape[:, 0], shape[:, 1], middle_point[0], middle_point[1])))
-    return 2 * np.max(dist_arr)
-
-
-def find_max_size_shapes(shapes):
-    # Find the maximal distance between two shape points
-    dist_arr = []
-    for i in range(len(shapes)):
-        dist_arr.append(find_max_size_shape(shapes[i][0]))
-    return dist_arr
-
-
-@jit(nopython=True)
-def approximate_point_in_shapes(shapes, point):
-    # Currently not used anymore, but maybe useful later
-    # This approximates the shape as a square
-    # Then finds all shape_squares that contain this point
-    # May find more than one "fitting" shape
-    found_shapes = []
-    for i in range(len(shapes)):
-        shape = shapes[i]
-        upper_left = [np.max(shape[:, 0]), np.max(shape[:, 1])]
-        lower_right = [np.min(shape[:, 0]), np.min(shape[:, 1])]
-        upper_right = [lower_right[0], upper_left[1]]
-        lower_left = [upper_left[0], lower_right[1]]
-        reduced_shape = np.array([upper_left, upper_right, lower_right, lower_left, upper_left])
-        if shape_contains_point(reduced_shape, point):
-            found_shapes.append(shape)
-    return found_shapes
-
-
-def fit_trees_to_point(tree_shapes_points_arr, point, start_point: int):
-    # Find the shape that actually contains point
-    # May not find anything
-    # Start at index of last found shape (Speedup)
-    end_point = len(tree_shapes_points_arr) + start_point
-    for j in range(start_point, end_point):
-        ind = np.mod(j, len(tree_shapes_points_arr))
-        arr = tree_shapes_points_arr[ind]
-
-        if shape_contains_point(arr[0], point):
-            if len(arr) == 1:
-                return ind
-            else:
-                # Check that none of the inner (excluded shapes) contain the point
-                # As this means that the shape is not in the shape after all
-                inner_contains = False
-                for i in range(1, len(arr)):
-                    if shape_contains_point(arr[i], point):
-                        inner_contains = True
-                        break
-                if not inner_contains:
-                    return ind
-
-    return start_point
-
-
-#@jit(nopython=True)
-def fit_trees_to_points(tree_shapes_points, points):
-    # Find the correct shape for each point
-    # If no shape is found -> None
-    ret = []
-    tree_shapes_points_np = tree_shapes_points
-    re = 0
-    for i in range(len(points)):
-        re = fit_trees_to_point(tree_shapes_points, points[i], int(re))
-        ret.append(re)
-    return ret
-
-
-def get_fitting_shapes(tree_patches, middle, tree_preprocessed, tree_shapes_points_np, tree_records_np, patch,
-                       tree_bool, closest_points=4):
-    # Get all shapes that may fit to a point (All shapes that are near the 4 closest tree-patches-points)
-    indices = find_n_closest_points(tree_patches, middle, closest_points)
-
-    possible_shape_indices = []
-    for index in indices:
-        possible_shape_indices = possible_shape_indices + tree_preprocessed[index]
-
-    possible_shapes = tree_shapes_points_np[possible_shape_indices]
-    if tree_bool:
-        possible_records = tree_records_np[possible_shape_indices][:, 3]
-    else:
-        possible_records = tree_records_np[possible_shape_indices][:, 3]
-
-    # Now look for each point which shape is the correct one
-    # This fails surprisingly often...
-    fitting_shapes = fit_trees_to_points(possible_shapes, patch.points)
-
-    return fitting_shapes, possible_records
+def fit_values_to_patches(patches, store, value_store, value_index, trees_bool, parallel=False):
+    # This function finds the correct tree-types (or soil-types) at each point in each patch
+    # value_store holds the shapes in the flat format of polygon_utils, parallel see polygon_utils.points_in_shapes
+    # First find all shapes that could be used in each patch with a single query
+    patch_indices = store.first_patch() + np.arange(store.patch_amount())
+    candidate_offsets, candidates = index_utils.query_bboxes(value_index, store.grid.patch_bboxes(patch_indices))
 
+    # Then test all points of all patches in one call, each point only against the candidates of its patch
+    groups = np.repeat(np.arange(store.patch_amount()), store.points_per_patch)
+    coords, ring_offsets, shape_offsets = value_store.shapes()
+    fitting_shapes = polygon_utils.points_in_shapes(store.coords(), candidate_offsets, candidates, coords, ring_offsets,
+                                                    shape_offsets, value_store.bboxes, groups, parallel)
 
-@jit(nopython=True)
-def ccw(A, B, C):
-    return (C[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (C[0] - A[0])
-
-
-# Return true if line segments AB and CD intersect
-@jit(nopython=True)
-def intersect(A, B, C, D):
-    return ccw(A, C, D) != ccw(B, C, D) and ccw(A, B, C) != ccw(A, B, D)
-
-
-@jit(nopython=True)
-def extend_back(shapes_1, shapes_2):
-    # This is used to extend back the reduced array
-    for i in range(len(shapes_1)):
-        if shapes_1[i][0][0] == shapes_2[0][0] and shapes_1[i][0][1] == shapes_2[0][1]:
-            return i
-
-
-@jit(nopython=True)
-def remove_doubles_array(shapes):
-    # Remove shapes that are contained more than once
-    # -> Return unique shapes
-    shapes_reduced = []
-    for i in range(len(shapes)):
-        new_val = True
-        for j in range(len(shapes_reduced)):
-            if shapes[i][0][0] == shapes_reduced[j][0][0]:
-                new_val = False
-                break
-        if new_val:
-            shapes_reduced.append(shapes[i][0])
-
-    return shapes_reduced
-
-
-def shapes_from_dist(shapes, points):
-    # Currently not used anymore but may be useful later?
-    # Find all shapes that may contain this point
-    dist = 1000.0
-    best_ind = 0
-
-    possible_shapes = []
-    pos_shapes_indices = []
-
-    # Look which shape has the closest point to this point
-    # This should be the shape the point is in (or the one directly neighboring)
-    for i in range(len(shapes)):
-        shape = shapes[i][0]
-        m = np.min(np.abs(get_distance_arr(shape[:, 0], shape[:, 1], points[0], points[1])))
-        if np.abs(dist - m) < 0.0001:
-            possible_shapes.append(shape)
-            pos_shapes_indices.append(i)
-        elif dist > m:
-            dist = m
-            best_ind = i
-
-    possible_shapes.append(shapes[best_ind])
-    pos_shapes_indices.append(best_ind)
-    return possible_shapes, pos_shapes_indices, dist
-
-
-def create_dates(patch, fitting_shapes, possible_records, trees_bool):
-    # Use "while" instead of "for" to be able to manipulate the index j
-    for j in range(len(patch.points)):
-        value = possible_records[fitting_shapes[j]]
-        patch.dates[j].set_env(value, trees_bool)
-    return patch
-
-
-def fit_values_to_patches(patches, value_shapes_points, value_records, value_patches, value_preprocessed, trees_bool):
-    # This function iterates all patches and finds the correct tree-types at each point in each patch
-    #print("Started fitting with amount: " + str(len(patches)))
-    value_shapes_points_np = np.array(value_shapes_points)
-    value_records_np = np.array(value_records)
-    for i in range(len(patches)):
-        if i % 200 == 0:
-            #print("Progress: " + str(i))
-            pass
-        patch = patches[i]
-        middle = patch.middle
-        # Find all shapes that could be used in this patch
-        fitting_shapes, possible_records = get_fitting_shapes(value_patches, middle, value_preprocessed,
-                                                                               value_shapes_points_np, value_records_np,
-                                                                               patch, trees_bool)
-        # Calculate the actual shape for each point in the patch
-        patches[i] = create_dates(patch, fitting_shapes, possible_records, trees_bool)
-    return patches
-
-
-def preprocess_values(points, value_shapes, value_shape_distances, dist):
-    # For each point, find all tree-shapes that may be as close as dist/2 to it
-    ret = [[] for j in range(len(points))]
-    dist_half = dist / np.sqrt(2)
-    points = np.array(points)
-    for i in range(len(value_shapes)):
-        shape = value_shapes[i][0]
-        indices = np.where((get_distance_arr(points[:, 0], points[:, 1], shape[0][0], shape[0][1]) -
-                            value_shape_distances[i]) < dist_half * 2)[0]
-        for index in indices:
-            ret[index].append(i)
-    return ret
+    # Points that are in no shape keep constants.no_match
+    codes = np.where(fitting_shapes == constants.no_match, constants.no_match,
+                     np.asarray(value_store.codes)[fitting_shapes])
+    store.set_env(codes, value_store.names, trees_bool)
+    return store
 
 
 def find_n_closest_points(points, point, n):
@@ -481,10 +229,6 @@ def find_n_closest_points(points, point, n):
     return indices
 
 
-def middle_points(points):
-    return (points[:, 0] + points[:, 1] + points[:, 2] + points[:, 3]) / 4
-
-
 @jit(nopython=True)
 def shape_contains_point(shape, point):
     # Find out if a Shape contains a Point
@@ -514,14 +258,6 @@ def preprocess_records(records):
         records[i] = record
 
 
-def get_patches_shape(patches):
-    # Get the rectangle of patches
-    c = 0
-    while patches[c].corners[0][1] == patches[c + 1].corners[0][1]:
-        c += 1
-    return c + 1, int(len(patches) / (c + 1))
-
-
 def convert_shapes_to_format(shapes):
     # Convert the shapes to the format more suited for processing
     for i in range(len(shapes)):
@@ -540,97 +276,131 @@ def convert_shapes_to_format(shapes):
     return shapes
 
 
-def soil_parse(patches, start_cord, end_cord, complete_reparse, first_reparse):
-    # Parse in Soil Data
-    if complete_reparse:
-        soil_shapes, records, lu = parse_in_shape(constants.pwd + "/data/soil_folder/Bodenarten_new_new", "EPSG:4326")
-        # Changing first and second coordinate as format is inconsistent
-        soil_shapes = convert_shapes_to_format(soil_shapes)
-        io_utils.dump_to_file(soil_shapes, constants.pwd + "/data/dumps/soils.dump")
-
-    soil_shapes = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/soils.dump")
+def build_store(shape_folder, dump_file):
+    # Read in the shapes and their values of a shape file as a polygon store
+    if os.path.exists(shape_folder + ".shp"):
+        # Ensure that shape is in ESPG:4326, the coordinate system is read from the .prj file
+        shapes, records, lu = parse_in_shape(shape_folder)
+        # Changing first and second coordinate as format is inconsistent and split shape into its parts
+        shapes = polygon_utils.flatten_shapefile(shapes)
+    else:
+        # Only an older dump of the shapes (list of arrays per shape) is available
+        records = create_records(shape_folder)
+        shapes = polygon_utils.flatten_shapes(io_utils.read_dump_from_file(dump_file))
 
     # Preprocess Records to remove Encoding-Artifacts
-    records = create_records(constants.pwd + "/data/soil_folder/Bodenarten_new_new")
     preprocess_records(records)
+    return polygon_utils.create_store(shapes, [record[3] for record in records])
+
+
+def rasterize_values(value_store, grid):
+    # Burn the category of each shape into a raster with one cell per grid point
+    raster = raster_utils.rasterize_shapes(value_store.shapes(), value_store.bboxes, value_store.codes, grid.origin,
+                                           grid.steps, (grid.rows, grid.cols))
+    return [raster, list(value_store.names)]
+
+
+def fit_values_from_raster(store, value_raster, trees_bool):
+    # Look up the value of each point in the raster, the cell of a point follows from its index in the grid
+    raster, names = value_raster
+    rows, cols = store.cells()
+    store.set_env(raster[rows, cols], names, trees_bool)
+    return store
+
+
+def prepare_values(grid, shape_folder, name, rasterize):
+    # Load everything that is needed to find the value (tree- or soil-type) of each point
+    # Each derived artifact is only rebuilt if the shape file or the parameters it depends on changed
+    dump_folder = constants.pwd + "/data/dumps/"
+    dump_file = dump_folder + name + "s.dump"
+    store_key = cache_utils.artifact_key(cache_utils.shape_files(shape_folder) + [dump_file])
+
+    def load_store():
+        return cache_utils.cached(name + "s_store", dump_folder + name + "s_store", store_key,
+                                  lambda: build_store(shape_folder, dump_file),
+                                  polygon_utils.write_store, polygon_utils.read_store)
+
+    if rasterize:
+        # The raster covers the whole region, the shapes are only needed to create it
+        raster_key = cache_utils.artifact_key([], store=store_key, origin=grid.origin, steps=grid.steps,
+                                              shape=[grid.rows, grid.cols])
+        return cache_utils.cached(name + "_raster", dump_folder + name + "_raster.dump", raster_key,
+                                  lambda: rasterize_values(load_store(), grid),
+                                  io_utils.dump_to_file, io_utils.read_dump_from_file)
+
+    value_store = load_store()
+
+    # Sort the shapes into a spatial index, this replaces searching the closest shapes for every patch
+    index_key = cache_utils.artifact_key([], store=store_key, cell_size=constants.index_cell_size)
+    value_index = cache_utils.cached(name + "_index", dump_folder + name + "_index.dump", index_key,
+                                     lambda: index_utils.build_index(value_store.bboxes),
+                                     io_utils.dump_to_file, io_utils.read_dump_from_file)
+    return [value_store, value_index]
+
+
+def fit_values(patches, store, value_data, rasterize, trees_bool, parallel=False):
+    # Find the value (tree- or soil-type) of each point
+    if rasterize:
+        return fit_values_from_raster(store, value_data, trees_bool)
+    # Now find out which shape each created Data-Point lies in
+    # This requires the most calculation effort -> Speed-Up as much as possible
+    return fit_values_to_patches(patches, store, *value_data, trees_bool, parallel)
 
-    soil_patches = create_points_inner(start_cord[0], start_cord[1], end_cord[0], end_cord[1], 1.0 / get_lat_fac(), 1.0 / get_long_fac(end_cord[0]), 1.0)
-
-    if complete_reparse:
-        soil_shape_distances = find_max_size_shapes(soil_shapes)
-        io_utils.dump_to_file(soil_shape_distances, constants.pwd + "/data/dumps/soil_shape_dist.dump")
-
-    soil_shape_distances = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/soil_shape_dist.dump")
 
-    #if complete_reparse:
-    if first_reparse:
-        prepro = preprocess_values(soil_patches, soil_shapes, soil_shape_distances, 1.0)
-        io_utils.dump_to_file(prepro, constants.pwd + "/data/dumps/soil_prepro.dump")
+def prepare_reparse(grid, rasterize=True):
+    # Load the tree- and soil-data once for all patches of the grid that are reparsed
+    # With rasterize, the shapes are burned into a raster of the whole region once instead of searching
+    # the containing shape of every point
+    return {"rasterize": rasterize, "grid": grid,
+            "soil": prepare_values(grid, constants.pwd + "/data/soil_folder/Bodenarten_new_new", "soil", rasterize),
+            "tree": prepare_values(grid, constants.pwd + "/data/tree_folder/trees", "tree", rasterize)}
 
-    prepro = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/soil_prepro.dump")
 
-    #print("Started fitting soils")
-    before = time.time()
-    patches = fit_values_to_patches(patches, soil_shapes, records, soil_patches, prepro, False)
-    end = time.time()
-    #print("Time: " + str(end - before))
-    return patches
+def soil_parse(patches, store, values, parallel=False):
+    # Parse in Soil Data
+    return fit_values(patches, store, values["soil"], values["rasterize"], False, parallel)
 
 
-def fill_patches_with_empy_dates(patches):
-    for j in range(len(patches)):
-        for i in range(len(patches[j].points)):
-            patches[j].dates.append(datum.Datum(patches[j].points[i]))
-    return patches
+def create_point_store(patches, grid):
+    # Columnar store for the points of all patches, the patches follow each other in the grid
+    return point_store.PointStore(grid, patches[0].index * grid.points_per_patch,
+                                  len(patches) * grid.points_per_patch)
 
 
-def reparse(patches, corners, first_reparse):
-    # Recreate everything
+def reparse(patches, values, parallel=False):
+    # Recreate everything, values is the tree- and soil-data from prepare_reparse
+    # Returns the patches and a store with the data of all their points
+    # parallel fits the shapes with the multi-core kernel, see polygon_utils.points_in_shapes
     start = time.time()
 
-    start_cord = [math.floor(min(corners[0], corners[2])) - 0.5, math.floor(min(corners[1], corners[3])) - 0.5]
-    end_cord = [math.ceil(max(corners[0], corners[2])) + 0.5, math.ceil(max(corners[1], corners[3])) + 0.5]
-
-    COMPLETE_REPARSE = False
-
-    if COMPLETE_REPARSE:
-        # Ensure that shape is in ESPG
-        tree_shapes, records, lu = parse_in_shape(constants.pwd + "/data/tree_folder/trees", "EPSG:4326")
-        # Changing first and second coordinate as format is inconsistent and split shape into its parts
-        tree_shapes = convert_shapes_to_format(tree_shapes)
-        io_utils.dump_to_file(tree_shapes, constants.pwd + "/data/dumps/trees.dump")
-
-    # Read in Shapes and Values of Tree-Data
-    records = create_records(constants.pwd + "/data/tree_folder/trees")
-    tree_shapes = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/trees.dump")
-
-    # Preprocess Records to remove Encoding-Artifacts
-    preprocess_records(records)
-
-    fill_patches_with_empy_dates(patches)
-
-    patches = soil_parse(patches, start_cord, end_cord, COMPLETE_REPARSE, first_reparse)
+    store = create_point_store(patches, values["grid"])
 
-    # Create a second Grid of Tree-Points to speed up Calculations later
-    tree_patches = create_points_inner(start_cord[0], start_cord[1], end_cord[0], end_cord[1], 1.0 / get_lat_fac(), 1.0 / get_long_fac(end_cord[0]), 1.0)
+    store = soil_parse(patches, store, values, parallel)
 
-    if COMPLETE_REPARSE:
-        # Find max. Size of each Tree-Shape
-        tree_shape_distances = find_max_size_shapes(tree_shapes)
-        io_utils.dump_to_file(tree_shape_distances, constants.pwd + "/data/dumps/tree_shape_dist.dump")
-
-    tree_shape_distances = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/tree_shape_dist.dump")
-
-    if first_reparse:
-        prepro = preprocess_values(tree_patches, tree_shapes, tree_shape_distances, 1)
-        io_utils.dump_to_file(prepro, constants.pwd + "/data/dumps/prepro_trees.dump")
-
-    prepro = io_utils.read_dump_from_file(constants.pwd + "/data/dumps/prepro_trees.dump")
-
-    # Now find out which Tree-Type (Shape) each created Data-Point has
-    # This requires the most calculation effort -> Speed-Up as much as possible
-    patches = fit_values_to_patches(patches, tree_shapes, records, tree_patches, prepro, True)
+    # Find the Tree-Type of each Data-Point
+    store = fit_values(patches, store, values["tree"], values["rasterize"], True, parallel)
     end = time.time()
     #print("Total Time for Parsing: " + str(end - start))
     print("Time per Patch: " + str((end - start) / float(len(patches))))
-    return patches
\ No newline at end of file
+    return [patches, store]
+
+
+def reparse_worker(task):
+    i, patches, file_name = task
+    # The tree- and soil-data is the data of the pool, see parallel_utils.worker_arrays
+    # A worker never forks a pool itself, so it fits the shapes with the multi-core kernel, using the threads that
+    # the pool gives each worker (all cores with a single worker, see parallel_utils.worker_threads)
+    io_utils.dump_to_file(reparse(patches, parallel_utils.worker_arrays(), parallel=True), file_name)
+    return i
+
+
+def reparse_parallel(patches_split, chunks, file_names, values, workers):
+    # Reparse the given chunks of patches_split on a pool of worker processes
+    # Each finished chunk is directly dumped to its file, so an interrupted run can be recovered
+    # With a single worker (or a single chunk), the chunks are parsed one after another by one process that uses all
+    # cores. The main process never runs the multi-core kernel itself, so it can still fork pools afterwards.
+    workers = max(1, min(workers, len(chunks)))
+    with parallel_utils.pool(values, workers) as pool:
+        tasks = ((i, patches_split[i], file_names[i]) for i in chunks)
+        for i in pool.imap_unordered(reparse_worker, tasks):
+            print(f"Finished parsing patch {i} of {len(patches_split)}")
@@ -12,6 +12,18 @@ def create_table(cursor, name, values):
     return 1
 
 
+def column_names(cursor, table):
+    return [row[1] for row in cursor.execute('PRAGMA table_info(' + str(table) + ')')]
+
+
+def add_missing_column(cursor, table, name, kind):
+    # Add a column to a table that was created before the column existed
+    if name in column_names(cursor, table):
+        return 0
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+    return 1
+
+
 def list_table(cursor, table):
     print('*' * 49)
     print("Listing Table: " + str(table))
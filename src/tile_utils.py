@@ -0,0 +1,302 @@
+import itertools
+import math
+import os
+import struct
+
+import numpy as np
+from numba import jit
+
+import constants
+import parallel_utils
+import polygonize_utils
+
+'''
+Export of the probability map as a pyramid of Mapbox Vector Tiles (web/tiles/<species>/{z}/{x}/{y}.pbf).
+The browser only loads the tiles of the visible area instead of the whole map.
+For every zoom level the raster is generalized first: blocks of points are averaged until a point is at least one
+screen pixel large, then the coarser raster is polygonized. So the lower zoom levels only contain as many polygons as
+can be seen. The polygons of a level are cut into the tiles that they touch and each tile is encoded and written by a
+pool of worker processes, the polygons are shared with the workers through shared memory.
+The tiles are encoded directly according to the vector tile specification (protobuf), so no further dependency is
+needed. The probability of each polygon is stored in the property "probability".
+'''
+
+tiles_directory = constants.pwd + "/web/tiles"
+
+
+def world_pixels(coords, zoom, extent=constants.tile_extent):
+    # Web mercator position of [lon, lat] coordinates in units of the tile extent, tile (x, y) covers the units
+    # x * extent to (x + 1) * extent
+    size = extent * 2 ** zoom
+    lat = np.radians(coords[:, 1])
+    x = (coords[:, 0] + 180.0) / 360.0 * size
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * size
+    return np.stack((x, y), axis=1)
+
+
+def generalize(raster, origin, steps, factor):
+    # Average blocks of factor x factor points into one point, points outside of the grid are left out
+    # Returns the coarser raster, its origin and steps like a grid_spec.GridSpec
+    if factor == 1:
+        return raster, origin, steps
+    n_0 = -(-raster.shape[0] // factor)
+    n_1 = -(-raster.shape[1] // factor)
+    padded = np.full((n_0 * factor, n_1 * factor), np.nan)
+    padded[:raster.shape[0], :raster.shape[1]] = raster
+    blocks = padded.reshape(n_0, factor, n_1, factor)
+    counts = np.sum(~np.isnan(blocks), axis=(1, 3))
+    coarse = np.nansum(blocks, axis=(1, 3)) / np.maximum(counts, 1)
+    origin = np.asarray(origin, dtype=np.float64) + (factor - 1) / 2.0 * np.asarray(steps, dtype=np.float64)
+    return coarse, origin, np.asarray(steps, dtype=np.float64) * factor
+
+
+def level_factor(steps, zoom):
+    # Smallest power of two so that a generalized point is at least one screen pixel wide at zoom
+    pixel = 360.0 / (2 ** zoom * constants.tile_size)
+    factor = 1
+    while steps[1] * factor < pixel:
+        factor *= 2
+    return factor
+
+
+def build_level(raster, origin, steps, zoom):
+    # Polygons of one zoom level in world pixels and the tiles that they touch
+    # Returns the level (dictionary of arrays) and the tiles as [x, y, indices of the polygons]
+    coarse, coarse_origin, coarse_steps = generalize(raster, origin, steps, level_factor(steps, zoom))
+    coords, ring_offsets, polygon_offsets, values = polygonize_utils.polygonize_arrays(coarse, coarse_origin,
+                                                                                       coarse_steps)
+    pixels = world_pixels(coords, zoom)
+    level = {"pixels": pixels, "ring_offsets": ring_offsets, "polygon_offsets": polygon_offsets, "values": values}
+    if len(values) == 0:
+        return level, []
+
+    # Bounding box of each polygon from its outer border (the first ring)
+    mins = np.minimum.reduceat(pixels, ring_offsets[:-1], axis=0)[polygon_offsets[:-1]]
+    maxs = np.maximum.reduceat(pixels, ring_offsets[:-1], axis=0)[polygon_offsets[:-1]]
+    first = np.floor((mins - constants.tile_buffer) / constants.tile_extent).astype(np.int64)
+    last = np.floor((maxs + constants.tile_buffer) / constants.tile_extent).astype(np.int64)
+
+    # One entry for every pair of tile and polygon
+    widths = last[:, 0] - first[:, 0] + 1
+    heights = last[:, 1] - first[:, 1] + 1
+    counts = widths * heights
+    polygons = np.repeat(np.arange(len(values)), counts)
+    within = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile_x = first[polygons, 0] + within % widths[polygons]
+    tile_y = first[polygons, 1] + within // widths[polygons]
+
+    order = np.lexsort((tile_y, tile_x))
+    tile_x, tile_y, polygons = tile_x[order], tile_y[order], polygons[order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(tile_x) != 0) | (np.diff(tile_y) != 0)])
+    ends = np.r_[starts[1:], len(order)]
+    return level, [[int(tile_x[s]), int(tile_y[s]), polygons[s:e]] for s, e in zip(starts, ends)]
+
+
+@jit(nopython=True)
+def clip_axis(ring, axis, low, high):
+    # Cut a ring (in tile units) to the strip from low to high on one axis (Sutherland-Hodgman)
+    # The borders of the tiles overlap by the buffer, so the cut edges are never visible
+    for side in range(2):
+        bound = low if side == 0 else high
+        if len(ring) == 0:
+            return ring
+        clipped = np.empty((2 * len(ring), 2), dtype=np.float64)
+        n = 0
+        for k in range(len(ring)):
+            current = ring[k]
+            previous = ring[k - 1]
+            current_in = current[axis] >= bound if side == 0 else current[axis] <= bound
+            previous_in = previous[axis] >= bound if side == 0 else previous[axis] <= bound
+            if current_in != previous_in:
+                t = (bound - previous[axis]) / (current[axis] - previous[axis])
+                clipped[n] = previous + t * (current - previous)
+                clipped[n, axis] = bound
+                n += 1
+            if current_in:
+                clipped[n] = current
+                n += 1
+        ring = clipped[:n]
+    return ring
+
+
+def simplify_ring(ring):
+    # Remove repeated and collinear corners, e.g. after rounding to whole tile units
+    # Removing a corner can make its neighbours collinear (e.g. the tip of a spike), so this is repeated
+    while len(ring) >= 3:
+        ring = ring[np.any(ring != np.roll(ring, 1, axis=0), axis=1)]
+        previous = np.roll(ring, 1, axis=0)
+        following = np.roll(ring, -1, axis=0)
+        cross = (ring[:, 0] - previous[:, 0]) * (following[:, 1] - ring[:, 1]) - \
+            (ring[:, 1] - previous[:, 1]) * (following[:, 0] - ring[:, 0])
+        if np.all(cross != 0):
+            break
+        ring = ring[cross != 0]
+    return ring
+
+
+def ring_area(ring):
+    # Signed area of a ring in tile units, positive means clockwise on the screen (the y axis points down)
+    return 0.5 * np.sum(ring[:, 0] * np.roll(ring[:, 1], -1) - np.roll(ring[:, 0], -1) * ring[:, 1])
+
+
+def encode_varints(values):
+    # Protobuf varint encoding of an array of non negative integers
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for bits in range(7, 64, 7):
+        lengths += values >= np.uint64(1 << bits)
+    starts = np.cumsum(lengths) - lengths
+    encoded = np.empty(np.sum(lengths), dtype=np.uint8)
+    for k in range(int(lengths.max(initial=0))):
+        mask = lengths > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        encoded[starts[mask] + k] = byte | np.where(lengths[mask] > k + 1, 0x80, 0).astype(np.uint64)
+    return encoded.tobytes()
+
+
+def field(number, wire_type):
+    return encode_varints([(number << 3) | wire_type])
+
+
+def message(number, content):
+    # Length delimited field
+    return field(number, 2) + encode_varints([len(content)]) + content
+
+
+def zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def encode_geometry(rings):
+    # Geometry commands of a polygon: MoveTo, LineTo and ClosePath for each ring, the coordinates are relative to the
+    # previous position
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for ring in rings:
+        deltas = zigzag(np.diff(ring, axis=0, prepend=cursor[None]))
+        commands.append(np.array([(1 << 3) | 1], dtype=np.int64))
+        commands.append(deltas[0])
+        commands.append(np.array([((len(ring) - 1) << 3) | 2], dtype=np.int64))
+        commands.append(deltas[1:].ravel())
+        commands.append(np.array([(1 << 3) | 7], dtype=np.int64))
+        cursor = ring[-1]
+    return np.concatenate(commands)
+
+
+def column_rings(level, polygon, x):
+    # Rings of a polygon cut to the column of tiles x (with the buffer), the first axis in the units of the tiles of
+    # the column. A polygon usually covers several tiles of a column, so it is only cut along the first axis once
+    # and each tile only cuts the (much shorter) part of the column.
+    # Returns the rings and the smallest and largest second coordinate of each ring (inf / -inf for empty rings)
+    pixels = level["pixels"]
+    ring_offsets = level["ring_offsets"]
+    offset = np.array([x * constants.tile_extent, 0], dtype=np.float64)
+    rings = [clip_axis(pixels[ring_offsets[r]:ring_offsets[r + 1]] - offset, 0, -constants.tile_buffer,
+                       constants.tile_extent + constants.tile_buffer)
+             for r in range(level["polygon_offsets"][polygon], level["polygon_offsets"][polygon + 1])]
+    mins = np.array([np.min(ring[:, 1]) if len(ring) > 0 else np.inf for ring in rings])
+    maxs = np.array([np.max(ring[:, 1]) if len(ring) > 0 else -np.inf for ring in rings])
+    return rings, mins, maxs
+
+
+def tile_rings(level, polygon, x, y, columns=None):
+    # Rings of a polygon in the units of tile (x, y), outer border first
+    # columns holds the column_rings of the polygons of column x that were already cut
+    # Returns None if the polygon does not cover any area of the tile
+    if columns is None:
+        columns = {}
+    if polygon not in columns:
+        columns[polygon] = column_rings(level, polygon, x)
+    column, mins, maxs = columns[polygon]
+    low = -constants.tile_buffer
+    high = constants.tile_extent + constants.tile_buffer
+    offset = y * constants.tile_extent
+    # Only the outer border and the holes that reach into the rows of the tile are cut
+    touching = (maxs - offset >= low) & (mins - offset <= high)
+    if not touching[0]:
+        return None
+    rings = []
+    for r in np.flatnonzero(touching):
+        ring = simplify_ring(np.round(clip_axis(column[r] - np.array([0, offset], dtype=np.float64), 1, low, high)))
+        area = ring_area(ring) if len(ring) >= 3 else 0
+        if area == 0:
+            if len(rings) == 0:
+                return None
+            continue
+        # Outer borders are clockwise on the screen, holes counter-clockwise
+        if (area > 0) != (len(rings) == 0):
+            ring = ring[::-1]
+        rings.append(ring.astype(np.int64))
+    return rings
+
+
+def encode_tile(level, x, y, polygons, name, columns=None):
+    # Encode the given polygons of a level as vector tile (x, y) with a single layer called name
+    # The probabilities are the values of the layer, each feature refers to its value
+    # columns is shared by the tiles of column x, see tile_rings
+    values = level["values"]
+    value_table = {}
+    features = []
+    for polygon in polygons:
+        rings = tile_rings(level, polygon, x, y, columns)
+        if rings is None:
+            continue
+        value = float(values[polygon])
+        if value not in value_table:
+            value_table[value] = len(value_table)
+        features.append(message(2, message(2, encode_varints([0, value_table[value]])) +
+                                field(3, 0) + encode_varints([3]) +
+                                message(4, encode_varints(encode_geometry(rings)))))
+    if len(features) == 0:
+        return None
+
+    layer = field(15, 0) + encode_varints([2]) + message(1, name.encode("utf-8")) + b"".join(features) + \
+        message(3, "probability".encode("utf-8"))
+    for value in value_table:
+        layer += message(4, field(3, 1) + struct.pack("<d", value))
+    layer += field(5, 0) + encode_varints([constants.tile_extent])
+    return message(3, layer)
+
+
+def write_tile_column(task):
+    # Write the tiles of one column x of a zoom level, tiles holds [y, indices of the polygons] of each tile
+    directory, name, zoom, x, tiles = task
+    # The polygons of all levels are the data of the pool, see parallel_utils.worker_arrays
+    level = parallel_utils.worker_arrays()[zoom]
+    columns = {}
+    written = 0
+    for y, polygons in tiles:
+        tile = encode_tile(level, x, y, polygons, name, columns)
+        if tile is None:
+            continue
+        os.makedirs(directory + f"/{zoom}/{x}", exist_ok=True)
+        with open(directory + f"/{zoom}/{x}/{y}.pbf", 'wb') as fp:
+            fp.write(tile)
+        written += 1
+    return written
+
+
+def write_tile_pyramid(raster, origin, steps, name, workers=os.cpu_count(), directory=None,
+                       min_zoom=constants.tile_min_zoom):
+    # Write the vector tiles of the zoom levels from min_zoom to tile_max_zoom of a probability raster
+    # (see grid_spec.GridSpec.layout), workers = 1 writes all tiles in this process
+    if directory is None:
+        directory = tiles_directory + "/" + name
+    levels = {}
+    tasks = []
+    for zoom in range(min_zoom, constants.tile_max_zoom + 1):
+        levels[zoom], tiles = build_level(raster, origin, steps, zoom)
+        # The tiles are sorted by column, each column is one task
+        for x, column in itertools.groupby(tiles, key=lambda tile: tile[0]):
+            tasks.append([directory, name, zoom, x, [[y, polygons] for _, y, polygons in column]])
+        print(f"Zoom {zoom}: {len(levels[zoom]['values'])} polygons in {len(tiles)} tiles")
+
+    if workers > 1:
+        with parallel_utils.pool(levels, workers) as pool:
+            written = sum(pool.imap_unordered(write_tile_column, tasks))
+    else:
+        # E.g. inside of a worker process that exports a whole species
+        with parallel_utils.local_worker(levels):
+            written = sum(map(write_tile_column, tasks))
+    print("Written tiles: " + str(written))
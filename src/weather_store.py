@@ -0,0 +1,133 @@
+import datetime
+
+import numpy as np
+
+import constants
+import sql_utils
+
+'''
+Persistent store of the daily weather of the DWD stations, kept in a sqlite database between runs.
+Only days that are not stored yet are fetched. DWD corrects its observations during the first days after publishing
+them, so a day only becomes final once it was fetched constants.weather_final_days after it was observed. Days that
+are not final yet are fetched again on each run.
+'''
+
+store_file = constants.pwd + "/data/dumps/weather.db"
+
+# Variables stored for each station and day, in the order of the last axis of StationWeather.values
+weather_variables = ["temperature", "rain", "humidity"]
+
+
+class StationWeather:
+    # Weather of a set of stations on a set of days, shared by all patches
+    # A patch only refers to its station, the values are looked up through the index of the station
+
+    def __init__(self, station_ids, days, values):
+        self.station_ids = station_ids
+        self.days = days
+        # [stations x days x weather_variables] as float32, NaN marks missing values
+        self.values = values
+
+    def variable(self, name):
+        # [stations x days] matrix of one weather variable
+        return self.values[:, :, weather_variables.index(name)]
+
+    def station_index(self, station_ids):
+        # Index of each of the given stations in this weather data, constants.no_match for stations without data
+        station_ids = np.asarray(station_ids, dtype=np.int64)
+        if len(self.station_ids) == 0:
+            return np.full(len(station_ids), constants.no_match, dtype=np.int64)
+        order = np.argsort(self.station_ids)
+        index = order[np.minimum(np.searchsorted(self.station_ids, station_ids, sorter=order),
+                                 len(self.station_ids) - 1)]
+        return np.where(self.station_ids[index] == station_ids, index, constants.no_match)
+
+    def station_values(self, station_ids):
+        # [stations x days x weather_variables] of the given stations, stations without data only have NaN values
+        index = self.station_index(station_ids)
+        values = np.full((len(index),) + self.values.shape[1:], np.nan, dtype=self.values.dtype)
+        values[index != constants.no_match] = self.values[index[index != constants.no_match]]
+        return values
+
+
+def connect(filename=None):
+    cursor, con = sql_utils.connect_database(store_file if filename is None else filename)
+    cursor.execute("CREATE TABLE IF NOT EXISTS observations (station_id integer, day integer, temperature real, "
+                   "rain real, humidity real, final integer, PRIMARY KEY (station_id, day))")
+    con.commit()
+    return con
+
+
+def day_number(day):
+    # Days are stored as number in the format of DWD, e.g. 20230914
+    return int(day.strftime("%Y%m%d"))
+
+
+def missing_days(con, station_ids, days):
+    # Days of each station that still have to be fetched, i.e. that are not stored or not final yet
+    # Returns a dictionary station_id -> list of days
+    stations = sorted(set(int(station_id) for station_id in station_ids))
+    if len(stations) == 0 or len(days) == 0:
+        return {}
+    numbers = [day_number(day) for day in days]
+    final = set(con.execute("SELECT station_id, day FROM observations WHERE final = 1 AND day BETWEEN ? AND ?",
+                            (min(numbers), max(numbers))).fetchall())
+    missing = {}
+    for station_id in stations:
+        station_missing = [days[d] for d in range(len(days)) if (station_id, numbers[d]) not in final]
+        if len(station_missing) > 0:
+            missing[station_id] = station_missing
+    return missing
+
+
+def insert(con, station_weather, days, fetch_day=None):
+    # Store the fetched weather, station_weather maps each station_id to one record (or None) per day
+    # Records are dictionaries of the weather_variables, days without record are not published yet and not stored
+    if fetch_day is None:
+        fetch_day = datetime.datetime.today()
+    rows = []
+    for station_id, records in station_weather.items():
+        for day, record in zip(days, records):
+            if record is None:
+                continue
+            final = int((fetch_day - day).days >= constants.weather_final_days)
+            rows.append([int(station_id), day_number(day)] + [record[v] for v in weather_variables] + [final])
+    con.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+    con.commit()
+
+
+def insert_series(con, station_id, numbers, values, fetch_day=None):
+    # Store a whole series of one station at once, e.g. from a DWD archive file
+    # numbers are the days as numbers (see day_number), values is [days x weather_variables] with NaN if missing
+    if fetch_day is None:
+        fetch_day = datetime.datetime.today()
+    last_final = day_number(fetch_day - datetime.timedelta(days=constants.weather_final_days))
+    rows = [[int(station_id), int(numbers[d])] + [None if np.isnan(value) else float(value) for value in values[d]] +
+            [int(numbers[d] <= last_final)] for d in range(len(numbers))]
+    con.executemany("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?, ?, ?)", rows)
+    con.commit()
+
+
+def load(con, station_ids, days):
+    # Read the weather of all stations and days in a single query
+    # Returns a StationWeather, missing values are NaN
+    station_ids = np.asarray(station_ids, dtype=np.int64)
+    numbers = np.array([day_number(day) for day in days], dtype=np.int64)
+    values = np.full((len(station_ids), len(numbers), len(weather_variables)), np.nan, dtype=np.float32)
+    if len(station_ids) == 0 or len(numbers) == 0:
+        return StationWeather(station_ids, list(days), values)
+
+    rows = con.execute("SELECT station_id, day, " + ", ".join(weather_variables) +
+                       " FROM observations WHERE day BETWEEN ? AND ?", (int(numbers.min()), int(numbers.max())))
+    rows = np.array([[np.nan if value is None else value for value in row] for row in rows], dtype=np.float64)
+    if len(rows) > 0:
+        # Position of each row in the array, rows of other stations or days are dropped
+        station_order = np.argsort(station_ids)
+        s = np.searchsorted(station_ids, rows[:, 0], sorter=station_order)
+        s = station_order[np.minimum(s, len(station_ids) - 1)]
+        day_order = np.argsort(numbers)
+        d = np.searchsorted(numbers, rows[:, 1], sorter=day_order)
+        d = day_order[np.minimum(d, len(numbers) - 1)]
+        found = (station_ids[s] == rows[:, 0]) & (numbers[d] == rows[:, 1])
+        values[s[found], d[found]] = rows[found, 2:]
+    return StationWeather(station_ids, list(days), values)
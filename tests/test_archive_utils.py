@@ -0,0 +1,51 @@
+import datetime
+import io
+import zipfile
+
+import numpy as np
+
+import archive_utils
+import environment_utils
+import weather_store
+
+'''
+Import of DWD kl daily archive files into the weather store, with small synthetic zip files.
+'''
+
+header = "STATIONS_ID;MESS_DATUM;QN_3;FX;FM;QN_4;RSK;RSKF;SDK;SHK_TAG;NM;VPM;PM;TMK;UPM;TXK;TNK;TGK;eor"
+
+
+def product_line(station_id, day, rain, humidity, temperature):
+    return f"{station_id};{day};10;-999;-999;3;{rain};6;-999;0;-999;-999;-999;-999;{humidity};{temperature};" \
+           f"-999;-999;eor"
+
+
+def archive_bytes(station_id, rows):
+    # Zip file as offered by DWD, the observations are in the produkt_klima_tag file
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        archive.writestr(f"produkt_klima_tag_20230101_20231231_{station_id:05d}.txt",
+                         "\n".join([header] + [product_line(station_id, *row) for row in rows]) + "\n")
+        archive.writestr(f"Metadaten_Geographie_{station_id:05d}.txt", "unused")
+    return data.getvalue()
+
+
+def test_recent_archive_replaces_overlapping_historical_days(tmp_path, monkeypatch):
+    station_id = 1420
+    monkeypatch.setattr(environment_utils, "get_stations", lambda: [{"station_id": station_id}])
+    # The historical file ends on the day the recent file starts, that day is corrected in the recent file
+    (tmp_path / f"tageswerte_KL_{station_id:05d}_20230101_20230902_hist.zip").write_bytes(
+        archive_bytes(station_id, [[20230901, 1.5, 80, 20.5], [20230902, 2.0, 70, 21.0]]))
+    (tmp_path / f"tageswerte_KL_{station_id:05d}_akt.zip").write_bytes(
+        archive_bytes(station_id, [[20230902, 4.0, 75, 19.0], [20230903, 0.0, -999, 22.5]]))
+
+    con = weather_store.connect(str(tmp_path / "weather.db"))
+    archive_utils.ingest_archives(str(tmp_path), workers=1, con=con)
+    days = [datetime.date(2023, 9, 1) + datetime.timedelta(days=d) for d in range(3)]
+    weather = weather_store.load(con, [station_id], days)
+    con.close()
+
+    assert np.array_equal(weather.variable("temperature")[0], [20.5, 19.0, 22.5])
+    assert np.array_equal(weather.variable("rain")[0], [1.5, 4.0, 0.0])
+    # Missing values (-999) are stored as NaN
+    assert np.array_equal(weather.variable("humidity")[0], [80, 75, np.nan], equal_nan=True)
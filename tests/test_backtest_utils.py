@@ -0,0 +1,66 @@
+import datetime
+
+import numpy as np
+
+import backtest_utils
+import factor_calculations
+import weather_store
+
+'''
+Ranking and scoring of parameter sets on a small synthetic weather history.
+'''
+
+
+def test_average_ranks_share_the_rank_of_ties():
+    values = np.array([[0.5, 0.1, 0.5, 0.9, 0.1],
+                       [2.0, 2.0, 2.0, 2.0, 2.0]])
+    ranks = backtest_utils.average_ranks(values)
+    assert np.array_equal(ranks[0], [2.5, 0.5, 2.5, 4, 0.5])
+    # A constant factor ranks every day in the middle
+    assert np.array_equal(ranks[1], np.full(5, 2.0))
+
+
+def synthetic_weather(rng, stations, days):
+    first_day = datetime.date(2022, 6, 1)
+    values = np.stack((rng.uniform(0, 30, (stations, days)), rng.exponential(4, (stations, days)),
+                       rng.uniform(40, 100, (stations, days))), axis=2).astype(np.float32)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    return weather_store.StationWeather(np.arange(stations, dtype=np.int64) + 100,
+                                        [first_day + datetime.timedelta(days=d) for d in range(days)], values)
+
+
+def test_backtest_scores_the_rank_of_the_finding_days():
+    rng = np.random.default_rng(17)
+    weather = synthetic_weather(rng, 4, 90)
+    sets = backtest_utils.parameter_sets({"optimal_temp": [12, 18], "mix": [(1, 0, 0), (2, 1, 0.7)]})
+    finding_stations = np.array([0, 1, 1, 3, 2])
+    finding_windows = np.array([5, 10, 40, 62, 0])
+
+    scores = backtest_utils.backtest(weather, finding_stations, finding_windows, sets)
+
+    # The factor of every parameter set calculated on its own, ranked among the days of each station
+    rains, temperatures, humidities = factor_calculations.fill_missing(
+        *[weather.variable(name).astype(np.float64) for name in ["rain", "temperature", "humidity"]])
+    for parameters, score in zip(sets, scores):
+        factors = factor_calculations.dynamic_factors(rains, temperatures, humidities, parameters)
+        ranks = np.array([[np.mean(row < row[w]) + 0.5 * (np.sum(row == row[w]) - 1) / len(row) for w in
+                           range(len(row))] for row in factors]) * len(factors[0]) / (len(factors[0]) - 1)
+        assert np.isclose(score, np.mean(ranks[finding_stations, finding_windows]))
+
+
+def test_findings_on_the_best_days_score_one():
+    rng = np.random.default_rng(18)
+    weather = synthetic_weather(rng, 3, 60)
+    # Only the rain counts, the findings are on the window with the most rain of each station
+    sets = backtest_utils.parameter_sets({"mix": [(1, 0, 0)], "rain_weights": [(1, 1, 1)]})
+    _, temperatures, humidities = factor_calculations.fill_missing(
+        *[weather.variable(name).astype(np.float64) for name in ["rain", "temperature", "humidity"]])
+    # Rain below the clamp of 25mm and of the factor, so the best window is unique
+    weather.values[:, :, weather_store.weather_variables.index("rain")] = np.nan_to_num(
+        weather.variable("rain"), nan=0) / 100
+    factors = factor_calculations.dynamic_factors(weather.variable("rain").astype(np.float64), temperatures,
+                                                  humidities, sets[0])
+    best = np.argmax(factors, axis=1)
+
+    scores = backtest_utils.backtest(weather, np.arange(3), best, sets)
+    assert np.isclose(scores[0], 1.0)
@@ -0,0 +1,61 @@
+import json
+import os
+
+import cache_utils
+
+'''
+Artifacts have to be rebuilt exactly when the content of a source file or a parameter changed.
+'''
+
+
+def test_cached_rebuilds_only_on_changed_inputs(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_utils, "manifest_file", str(tmp_path / "cache_manifest.json"))
+    source = tmp_path / "trees.shp"
+    source.write_bytes(b"first shapes")
+    artifact = str(tmp_path / "trees.dump")
+    builds = []
+
+    def load(region):
+        key = cache_utils.artifact_key([str(source)], region=region)
+
+        def build():
+            builds.append(region)
+            return source.read_text() + " " + region
+
+        def write(value, path):
+            with open(path, "w") as fp:
+                fp.write(value)
+
+        def read(path):
+            with open(path) as fp:
+                return fp.read()
+        return cache_utils.cached("trees", artifact, key, build, write, read)
+
+    assert load("mayen") == "first shapes mayen"
+    assert load("mayen") == "first shapes mayen"
+    assert len(builds) == 1
+
+    # A changed parameter
+    assert load("eifel") == "first shapes eifel"
+    assert len(builds) == 2
+
+    # Changed content of a source file
+    source.write_bytes(b"second shapes")
+    assert load("eifel") == "second shapes eifel"
+    assert len(builds) == 3
+
+    # Only the modification time changed, the content hash is the same
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert load("eifel") == "second shapes eifel"
+    assert len(builds) == 3
+
+    # A deleted artifact is rebuilt with the same key
+    os.remove(artifact)
+    assert load("eifel") == "second shapes eifel"
+    assert len(builds) == 4
+
+    with open(cache_utils.manifest_file) as fp:
+        manifest = json.load(fp)
+    assert list(manifest["artifacts"]) == ["trees"]
+    assert manifest["files"][str(source)]["stamp"] == [os.stat(source).st_size, os.stat(source).st_mtime_ns]
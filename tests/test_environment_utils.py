@@ -0,0 +1,42 @@
+import datetime
+import threading
+
+import constants
+import environment_utils
+
+'''
+Bulk fetching of the weather with a fake backend instead of DWD.
+'''
+
+
+class FakeBackend:
+    # Backend in the format of environment_utils.DwdBackend, stations fail a given amount of times before they answer
+    # A station with failures None never answers
+
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, station_id, days):
+        with self.lock:
+            self.calls[station_id] = self.calls.get(station_id, 0) + 1
+            calls = self.calls[station_id]
+        failures = self.failures.get(station_id, 0)
+        if failures is None or calls <= failures:
+            raise ConnectionError("station " + str(station_id) + " not reachable")
+        return [{"station_id": station_id, "day": day} for day in days]
+
+
+def test_fetch_weather_retries_and_reports_failed_stations(monkeypatch):
+    monkeypatch.setattr(constants, "weather_retry_delay", 0)
+    days = [datetime.date(2023, 9, 1) + datetime.timedelta(days=d) for d in range(3)]
+    backend = FakeBackend({1: 0, 2: 2, 3: None})
+
+    series, failed = environment_utils.fetch_weather([3, 1, 2, 1], days, backend, workers=3, retries=2)
+
+    # Every station is only fetched once, station 2 succeeds with its last retry
+    assert backend.calls == {1: 1, 2: 3, 3: 3}
+    assert sorted(series.keys()) == [1, 2]
+    assert [record["day"] for record in series[2]] == days
+    assert failed == [3]
@@ -0,0 +1,171 @@
+import os
+
+import numpy as np
+
+import constants
+import factor_calculations
+import grid_spec
+import mushroom
+import patch
+import point_store
+import soil
+import weather_store
+
+'''
+The dynamic factors of a range of days have to be the same as calculating each day on its own, and the same as the
+loop over the patches that calculated them before. The static table has to give each point the factors it got
+point by point.
+'''
+
+
+def random_weather(rng, station_ids, days):
+    values = np.stack((rng.uniform(-5, 30, (len(station_ids), days)), rng.exponential(3, (len(station_ids), days)),
+                       rng.uniform(40, 100, (len(station_ids), days))), axis=2).astype(np.float32)
+    # Some missing values
+    values[rng.random(values.shape) < 0.05] = np.nan
+    return weather_store.StationWeather(np.asarray(station_ids, dtype=np.int64), list(range(days)), values)
+
+
+def test_dynamic_range_matches_the_single_days():
+    rng = np.random.default_rng(16)
+    days = 10
+    # 28 days before the first day of the range until the last day, see utils.weather_days
+    weather = random_weather(rng, [3, 1, 2], days + 28)
+    # Station 4 has no weather data
+    patches = [patch.Patch(i, [0, 0], station) for i, station in enumerate([1, 2, 2, 3, 4, 1])]
+
+    dynamic_range = factor_calculations.calc_dynamic_range(patches, weather)
+
+    assert dynamic_range.shape == (len(patches), days)
+    for d in range(days):
+        single_day = weather_store.StationWeather(weather.station_ids, weather.days[d:d + 29],
+                                                  weather.values[:, d:d + 29])
+        assert np.allclose(dynamic_range[:, d], factor_calculations.calc_dynamic_range(patches, single_day)[:, 0],
+                           rtol=1e-5)
+        # The factor of a day from its 28 days directly
+        station = list(weather.station_ids).index(patches[0].station)
+        rain, temperature, humidity = factor_calculations.fill_missing(
+            *[weather.variable(name)[station, d:d + 28].astype(np.float64) for name in ["rain", "temperature",
+                                                                                        "humidity"]])
+        factors = factor_calculations.environment_factor(rain, temperature, humidity)
+        mix = factor_calculations.dynamic_parameters["mix"]
+        assert np.isclose(dynamic_range[0, d], np.dot(mix, factors) / sum(mix), rtol=1e-5)
+
+
+def baseline_temp_deviation(temp, opt_val):
+    if temp < opt_val:
+        return temp / opt_val
+    elif temp > opt_val + 5:
+        return opt_val / temp
+    else:
+        return 1.0
+
+
+def baseline_environment_factor(rain, temperature, humidity):
+    # The factor of one patch, calculated day by day the way it was before the windows were vectorized
+    ra = 0
+    temp = 0
+    hum = 0
+    for start, end, rain_weight, temp_weight in [(0, 14, 0.5, 0.3), (14, 21, 3, 0.75), (21, 28, 0.75, 2)]:
+        for j in range(start, end):
+            ra += rain_weight * min(rain[j], 25) / (end - start)
+            temp += temp_weight * baseline_temp_deviation(temperature[j], 15) / (end - start)
+            if humidity[j] is None:
+                humidity[j] = 60
+            hum += humidity[j] / 90 / (end - start)
+    norm_rain = 0.5 * 14 + 3 * 7 + 7 * 0.75
+    return min(ra / norm_rain / 0.3, 3), min(temp / 3, 3), hum / 2.0
+
+
+def baseline_dynamic_factor(weather, station, days):
+    # One environment_factor call per patch over the weather of its days, missing days are filled one by one
+    temperatures = []
+    rains = []
+    humidities = []
+    for day in days:
+        values = weather.get((station, day))
+        if values is None or values["temperature"] is None or values["rain"] is None:
+            temperatures.append(0)
+            rains.append(0)
+            humidities.append(50)
+            continue
+        temperatures.append(values["temperature"])
+        rains.append(values["rain"])
+        humidities.append(values["humidity"])
+    rain_val, temp_val, hum_val = baseline_environment_factor(rains, temperatures, humidities)
+    return (2 * rain_val + 1 * temp_val + 0.7 * hum_val) / 3.7
+
+
+def test_dynamic_values_match_the_baseline_loop():
+    rng = np.random.default_rng(17)
+    days = 5
+    weather = random_weather(rng, [3, 1, 2], days + 28)
+    # Whole missing days of a station and missing humidity of days with known rain and temperature
+    weather.values[0, 3:6] = np.nan
+    weather.values[1, 10, weather_store.weather_variables.index("rain")] = np.nan
+    weather.values[2, rng.random(days + 28) < 0.3, weather_store.weather_variables.index("humidity")] = np.nan
+    # The same weather as one dict per station and day, with None for unknown values
+    weather_dict = {}
+    for s, station in enumerate(weather.station_ids):
+        for d in weather.days:
+            if not np.all(np.isnan(weather.values[s, d])):
+                weather_dict[(station, d)] = {name: None if np.isnan(weather.variable(name)[s, d]) else
+                                              float(weather.variable(name)[s, d])
+                                              for name in weather_store.weather_variables}
+
+    grid = grid_spec.GridSpec([0, 0], 0.01, 0.01, 2, 3, 2)
+    patches = [patch.Patch(i, [0, 0], station) for i, station in enumerate([1, 2, 2, 3, 4, 1])]
+    dynamic_range = factor_calculations.calc_dynamic_range(patches, weather)
+
+    expected = np.array([[baseline_dynamic_factor(weather_dict, p.station, weather.days[d:d + 28])
+                          for d in range(days)] for p in patches])
+    assert np.allclose(dynamic_range, expected, rtol=1e-5)
+
+    # The probabilities of the last day, min(static * dynamic_factor, 1) for every point and mushroom type
+    store = point_store.PointStore(grid, 0, len(grid))
+    store.static = rng.uniform(0, 2, (len(grid), 4)).astype(np.float32)
+    factor_calculations.calc_dynamic_value(patches, store, weather, dynamic_range=dynamic_range)
+    for i in range(len(store)):
+        for species in range(store.static.shape[1]):
+            assert np.isclose(store.probabilities[i, species],
+                              min(store.static[i, species] * expected[i // grid.points_per_patch, -1], 1), rtol=1e-5)
+
+
+def test_static_table_matches_the_values_of_single_points(monkeypatch):
+    data = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    monkeypatch.setattr(factor_calculations, "mushroom_file", os.path.join(data, "mushrooms_databank.xml"))
+    monkeypatch.setattr(factor_calculations, "soil_file", os.path.join(data, "soil_databank.xml"))
+    mushrooms = mushroom.read_mushroom_XML(factor_calculations.mushroom_file)
+    soils = soil.read_soil_XML(factor_calculations.soil_file)
+
+    tree_names = ["Laubwaelder", "Nadelwaelder", "Mischwaelder", "Wiesen und Weiden", "Siedlung"]
+    # Real soil-types of the databank in the case of the shape files and one that is not in the databank
+    soil_names = [name.capitalize() for name in list(soils)[:6]] + ["Unbekannter Boden"]
+    table, species = factor_calculations.compile_static_table(tuple(tree_names), tuple(soil_names))
+    assert species == [shroom.attr['name'] for shroom in mushrooms.values()]
+    assert table.shape == (len(tree_names) + 1, len(soil_names) + 1, len(species))
+
+    rng = np.random.default_rng(9)
+    # Codes of the points, constants.no_match for points in no shape
+    trees = rng.integers(-1, len(tree_names), 500).astype(np.int16)
+    soils_codes = rng.integers(-1, len(soil_names), 500).astype(np.int16)
+    trees[:2] = constants.no_match
+    soils_codes[1:3] = constants.no_match
+    values = table[trees, soils_codes]
+
+    for i in range(len(trees)):
+        tree = constants.no_value if trees[i] == constants.no_match else tree_names[trees[i]]
+        soil_type = constants.no_value if soils_codes[i] == constants.no_match else soil_names[soils_codes[i]].lower()
+        for j, shroom in enumerate(mushrooms.values()):
+            tree_val = factor_calculations.tree_value(shroom, tree)
+            if soil_type not in soils:
+                soil_val = 0.0
+            else:
+                soil_val = factor_calculations.soil_value(shroom, soils[soil_type])
+            if tree_val == 0 or soil_val == 0:
+                expected = 0.0
+            else:
+                expected = (tree_val + soil_val) / 2
+            assert np.isclose(values[i, j], expected, rtol=1e-6)
+    # Points without a soil-type never get a factor
+    assert np.all(values[soils_codes == constants.no_match] == 0)
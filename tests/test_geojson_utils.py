@@ -0,0 +1,53 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import geojson_utils
+
+'''
+Streaming of polygons into GEOJSON files.
+'''
+
+
+def squares(amount):
+    # Polygons in the format of polygonize_utils.polygonize_arrays, every second one with a hole
+    rings = []
+    polygon_offsets = [0]
+    for p in range(amount):
+        rings.append(np.array([[0, 0], [3, 0], [3, 3], [0, 3]], dtype=np.float64) + [4 * p + 0.123456789, 0])
+        if p % 2 == 1:
+            rings.append(np.array([[1, 1], [1, 2], [2, 2], [2, 1]], dtype=np.float64) + [4 * p, 0])
+        polygon_offsets.append(len(rings))
+    ring_offsets = np.concatenate(([0], np.cumsum([len(ring) for ring in rings])))
+    return np.concatenate(rings), ring_offsets, np.array(polygon_offsets), np.arange(amount) % 10 / 10
+
+
+def test_polygons_are_written_in_batches(tmp_path):
+    coords, ring_offsets, polygon_offsets, values = squares(25)
+    filename = str(tmp_path / "data0.json")
+    with geojson_utils.FeatureWriter(filename, precision=5) as writer:
+        writer.write_polygons(coords, ring_offsets, polygon_offsets, values, classes=10, batch=4)
+
+    with open(filename) as fp:
+        data = json.load(fp)
+    with gzip.open(filename + ".gz") as fp:
+        assert json.load(fp) == data
+    assert len(data["features"]) == 25
+    for p, feature in enumerate(data["features"]):
+        rings = feature["geometry"]["coordinates"]
+        assert len(rings) == polygon_offsets[p + 1] - polygon_offsets[p]
+        outer = coords[ring_offsets[polygon_offsets[p]]:ring_offsets[polygon_offsets[p] + 1]]
+        assert rings[0] == np.round(np.vstack((outer, outer[:1])), 5).tolist()
+        assert feature["properties"] == {"class": p % 10}
+
+
+def test_interrupted_file_is_removed(tmp_path):
+    coords, ring_offsets, polygon_offsets, values = squares(3)
+    filename = str(tmp_path / "data0.json")
+    with pytest.raises(RuntimeError):
+        with geojson_utils.FeatureWriter(filename) as writer:
+            writer.write_polygons(coords, ring_offsets, polygon_offsets, values)
+            raise RuntimeError("polygonization failed")
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,49 @@
+import numpy as np
+
+import constants
+import grid_spec
+
+'''
+The grid has to describe the same points, in the same order, as the patches that were created point by point before.
+'''
+
+
+def patch_points_one_by_one(topx, topy, botx, boty, dist, patch_size_sqrt):
+    # The points of all patches, created the way reparse_utils.create_points did it before the grid existed
+    x_start = min(topx, botx)
+    y_start = min(topy, boty)
+    x_end = max(topx, botx)
+    y_end = max(topy, boty)
+    cord = [x_start, y_start]
+    x_add = dist / constants.km_per_lat
+    y_add = dist / np.abs(constants.km_per_lon * np.cos(cord[0]))
+
+    points = []
+    while cord[1] + patch_size_sqrt * y_add < y_end:
+        while cord[0] + patch_size_sqrt * x_add < x_end:
+            point = [cord[0], cord[1]]
+            for i in range(patch_size_sqrt):
+                points.append(point)
+                for j in range(patch_size_sqrt - 1):
+                    point = [point[0] + x_add, point[1]]
+                    points.append(point)
+                point = [cord[0], point[1] + y_add]
+            cord = [cord[0] + patch_size_sqrt * x_add, cord[1]]
+        cord = [x_start, cord[1] + patch_size_sqrt * y_add]
+    return np.array(points), x_add, y_add
+
+
+def test_grid_reproduces_the_points_of_the_patches():
+    corners = [50.385642, 7.343229, 50.285642, 7.523229]
+    points, x_add, y_add = patch_points_one_by_one(*corners, 0.5, 4)
+    grid = grid_spec.from_corners(corners, 0.5, 4)
+
+    assert len(grid) == len(points)
+    assert np.allclose(grid.point_coords(np.arange(len(grid))), points, rtol=0, atol=1e-9)
+
+    # Every point lies in the cell of the raster layout that its coordinates belong to
+    rows = np.rint((points[:, 0] - min(corners[0], corners[2])) / x_add).astype(np.int64)
+    cols = np.rint((points[:, 1] - min(corners[1], corners[3])) / y_add).astype(np.int64)
+    layout = grid.layout()
+    assert layout.shape == (rows.max() + 1, cols.max() + 1)
+    assert np.array_equal(layout[rows, cols], np.arange(len(points)))
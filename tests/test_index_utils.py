@@ -0,0 +1,64 @@
+import numpy as np
+
+import index_utils
+
+'''
+Queries of the grid index against a brute force overlap test of all bounding boxes.
+'''
+
+
+def brute_force(bboxes, query):
+    return np.flatnonzero((bboxes[:, 0] <= query[2]) & (query[0] <= bboxes[:, 2]) &
+                          (bboxes[:, 1] <= query[3]) & (query[1] <= bboxes[:, 3]))
+
+
+def random_boxes(rng, amount, low, high, max_size):
+    corner = rng.uniform(low, high, (amount, 2))
+    size = rng.uniform(0, max_size, (amount, 2))
+    return np.column_stack((corner, corner + size))
+
+
+def assert_matches_brute_force(bboxes, queries, cell_size):
+    index = index_utils.build_index(bboxes, cell_size)
+    offsets, items = index_utils.query_bboxes(index, queries)
+    assert len(offsets) == len(queries) + 1
+    for i, query in enumerate(queries):
+        np.testing.assert_array_equal(items[offsets[i]:offsets[i + 1]], brute_force(bboxes, query))
+
+
+def test_query_finds_the_same_boxes_as_brute_force():
+    rng = np.random.default_rng(5)
+    bboxes = random_boxes(rng, 300, 0, 10, 2)
+    # Queries partly and fully outside of the indexed area are clipped to the grid
+    queries = random_boxes(rng, 200, -2, 12, 3)
+    assert_matches_brute_force(bboxes, queries, 0.5)
+
+
+def test_boxes_on_cell_edges():
+    cell_size = 1.0
+    # Boxes that start, end or lie exactly on the cell borders and boxes that span several cells
+    bboxes = np.array([
+        [0.0, 0.0, 1.0, 1.0],
+        [1.0, 1.0, 2.0, 2.0],
+        [0.5, 0.5, 3.5, 0.5],
+        [2.0, 0.0, 2.0, 3.0],
+        [0.0, 3.0, 4.0, 4.0],
+        [3.0, 3.0, 3.0, 3.0],
+    ])
+    queries = np.array([
+        [1.0, 1.0, 1.0, 1.0],
+        [2.0, 2.0, 2.0, 2.0],
+        [0.0, 0.0, 4.0, 4.0],
+        [3.5, 0.5, 3.5, 0.5],
+        [1.999, 0.0, 1.999, 4.0],
+        [3.0, 3.0, 5.0, 5.0],
+        [-1.0, -1.0, -0.5, -0.5],
+    ])
+    assert_matches_brute_force(bboxes, queries, cell_size)
+    # Random boxes whose corners all lie on cell borders
+    rng = np.random.default_rng(6)
+    corners = rng.integers(0, 8, (100, 2)).astype(np.float64) * cell_size
+    bboxes = np.column_stack((corners, corners + rng.integers(0, 3, (100, 2)) * cell_size))
+    corners = rng.integers(-1, 10, (100, 2)).astype(np.float64) * cell_size
+    queries = np.column_stack((corners, corners + rng.integers(0, 3, (100, 2)) * cell_size))
+    assert_matches_brute_force(bboxes, queries, cell_size)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import constants
+import interpolation_utils
+
+'''
+Inverse distance weights of the closest stations, with random stations instead of the DWD station list.
+'''
+
+
+def random_stations(rng, amount):
+    coords = np.column_stack((rng.uniform(47.5, 55, amount), rng.uniform(6, 15, amount)))
+    return [{'geo_lat': lat, 'geo_lon': lon, 'station_id': 1000 + i} for i, (lat, lon) in enumerate(coords)], coords
+
+
+def test_nearest_stations_are_the_closest_ones():
+    rng = np.random.default_rng(14)
+    stations, coords = random_stations(rng, 300)
+    points = np.column_stack((rng.uniform(47, 55.5, 500), rng.uniform(5.5, 15.5, 500)))
+
+    nearest, distances = interpolation_utils.nearest_stations(points, coords, 4)
+
+    for i in range(len(points)):
+        all_distances = interpolation_utils.station_distances(np.repeat(points[i:i + 1], len(coords), axis=0), coords)
+        assert np.allclose(distances[i], np.sort(all_distances)[:4])
+        assert np.allclose(all_distances[nearest[i]], distances[i])
+
+
+def test_weights_sum_to_one_and_a_station_at_the_point_dominates():
+    rng = np.random.default_rng(15)
+    stations, coords = random_stations(rng, 50)
+    # The first points lie exactly on stations
+    points = np.vstack((coords[:10], np.column_stack((rng.uniform(48, 54, 100), rng.uniform(7, 14, 100)))))
+
+    weights = interpolation_utils.build_weights(points, stations)
+
+    assert len(weights) == len(points)
+    assert np.all(np.diff(weights.offsets) == constants.interpolation_stations)
+    sums = np.add.reduceat(weights.weights, weights.offsets[:-1])
+    assert np.allclose(sums, 1)
+    for p in range(10):
+        own = weights.offsets[p]
+        assert weights.station_ids[weights.stations[own]] == 1000 + p
+        assert weights.weights[own] > 0.99
+    assert set(weights.used_stations()) <= set(station['station_id'] for station in stations)
+
+
+def test_no_stations():
+    points = np.array([[50.0, 7.0], [51.0, 8.0]])
+    with pytest.raises(ValueError):
+        interpolation_utils.nearest_stations(points, np.empty((0, 2)), 4)
+    with pytest.raises(ValueError):
+        interpolation_utils.build_weights(points, [])
@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import constants
+import grid_spec
+import io_utils
+import parallel_utils
+import point_store
+import tile_utils
+
+'''
+Export of the species into the tiles directory, over several runs and with several species at once.
+'''
+
+
+def export(raster, origin, steps):
+    values = [raster.reshape(-1, 1), np.arange(raster.size).reshape(raster.shape), origin, steps]
+    with parallel_utils.local_worker(values):
+        io_utils.export_species(["Steinpilz", 0, False, False, True, 1])
+
+
+def tile_files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, _, names in os.walk(directory) for name in names)
+
+
+def test_tiles_that_became_empty_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(tile_utils, "tiles_directory", str(tmp_path))
+    origin, steps = np.array([49.5, 8.2]), np.array([0.001, 0.001])
+    raster = np.zeros((40, 40))
+    raster[5:15, 5:15] = 0.5
+
+    export(raster, origin, steps)
+    written = tile_files(str(tmp_path / "Steinpilz"))
+    assert len(written) > 0
+
+    # Nothing is left on the map in the next run
+    export(np.zeros((40, 40)), origin, steps)
+    assert tile_files(str(tmp_path / "Steinpilz")) == []
+    assert sorted(os.listdir(tmp_path)) == ["Steinpilz"]
+
+
+def test_map_of_several_species_in_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(tile_utils, "tiles_directory", str(tmp_path))
+    rng = np.random.default_rng(22)
+    grid = grid_spec.GridSpec([49.5, 8.2], 0.001, 0.0015, 5, 4, 8)
+    store = point_store.PointStore(grid, 0, len(grid))
+    store.species = ["Steinpilz", "Pfifferling", "Maronenroehrling"]
+    store.probabilities = rng.uniform(0, 1, (len(grid), 3)).astype(np.float32)
+    # Nothing of the last species is on the map
+    store.probabilities[:, 2] = 0
+
+    io_utils.write_map([], store, workers=2, legacy=False)
+
+    with open(tmp_path / "species.json") as fp:
+        assert json.load(fp) == store.species
+    # The map takes the zoom levels of the tiles from tiles.json, the vector tiles start above the image tiles
+    with open(tmp_path / "tiles.json") as fp:
+        levels = json.load(fp)
+    assert levels == {"images": {"min_zoom": constants.raster_min_zoom, "max_zoom": constants.raster_max_zoom},
+                      "vectors": {"min_zoom": constants.raster_max_zoom + 1, "max_zoom": constants.tile_max_zoom}}
+    assert sorted(os.listdir(tmp_path)) == sorted(store.species + ["species.json", "tiles.json"])
+    assert tile_files(str(tmp_path / "Maronenroehrling")) == []
+
+    # Each species gets its own tiles, the same as exporting it on its own
+    monkeypatch.setattr(tile_utils, "tiles_directory", str(tmp_path / "single"))
+    with parallel_utils.local_worker([store.probabilities, grid.layout(), grid.origin, grid.steps]):
+        for name in store.species[:2]:
+            io_utils.export_species([name, store.species_column(name), False, True, True, 1])
+    for name in store.species[:2]:
+        written = tile_files(str(tmp_path / name))
+        # Every zoom level of tiles.json has tiles of its kind
+        expected = {}
+        for kind, ending in [("images", "png"), ("vectors", "pbf")]:
+            zooms = range(levels[kind]["min_zoom"], levels[kind]["max_zoom"] + 1)
+            expected.update({str(zoom): ending for zoom in zooms})
+        assert {f.split(os.sep)[0]: f[-3:] for f in written} == expected
+        assert tile_files(str(tmp_path / "single" / name)) == written
+        for f in written:
+            assert (tmp_path / "single" / name / f).read_bytes() == (tmp_path / name / f).read_bytes()
+
+
+def test_map_of_a_partial_store_is_not_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(tile_utils, "tiles_directory", str(tmp_path))
+    grid = grid_spec.GridSpec([49.5, 8.2], 0.001, 0.001, 2, 2, 4)
+    # The last patch is missing
+    store = point_store.PointStore(grid, 0, len(grid) - grid.points_per_patch)
+    store.species = ["Steinpilz", "Pfifferling"]
+    store.probabilities = np.ones((len(store), 2), dtype=np.float32)
+    with pytest.raises(ValueError):
+        io_utils.write_map([], store, workers=2, legacy=False)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import constants
+import grid_spec
+import io_utils
+import point_store
+
+'''
+Combining the stores of the shards of a reparse into one store of the whole grid.
+'''
+
+
+def shard(grid, first, amount, rng, tree_names, soil_names, species):
+    store = point_store.PointStore(grid, first, amount)
+    store.set_env(rng.integers(-1, len(tree_names), amount), tree_names, True)
+    store.set_env(rng.integers(-1, len(soil_names), amount), soil_names, False)
+    store.species = list(species)
+    store.static = rng.uniform(0, 2, (amount, len(species))).astype(np.float32)
+    store.probabilities = rng.uniform(0, 1, (amount, len(species))).astype(np.float32)
+    return store
+
+
+def test_concatenate_remaps_the_categories_of_each_shard():
+    rng = np.random.default_rng(8)
+    grid = grid_spec.GridSpec([50, 7], 0.001, 0.001, 3, 2, 2)
+    species = ["Steinpilz", "Pfifferling"]
+    # Every shard only knows the categories of its own points, in its own order
+    shards = [shard(grid, 0, 8, rng, ["Nadelwaelder", "Laubwaelder"], ["podsol"], species),
+              shard(grid, 8, 4, rng, [], ["lehm", "podsol"], species),
+              shard(grid, 12, 12, rng, ["Mischwaelder", "Laubwaelder", "Siedlung"], [], species)]
+    store = point_store.concatenate(shards)
+
+    assert store.first == 0
+    assert len(store) == len(grid)
+    assert store.tree_names == ["Laubwaelder", "Mischwaelder", "Nadelwaelder", "Siedlung"]
+    assert store.soil_names == ["lehm", "podsol"]
+    assert store.trees.dtype == np.int16 and store.soils.dtype == np.int16
+
+    def names(codes, category_names):
+        return [constants.no_value if code == constants.no_match else category_names[code] for code in codes]
+    # Every point keeps its category, points without one keep constants.no_match
+    expected_trees = sum([names(s.trees, s.tree_names) for s in shards], [])
+    expected_soils = sum([names(s.soils, s.soil_names) for s in shards], [])
+    assert names(store.trees, store.tree_names) == expected_trees
+    assert names(store.soils, store.soil_names) == expected_soils
+    assert np.array_equal(store.trees == constants.no_match,
+                          np.concatenate([s.trees for s in shards]) == constants.no_match)
+
+    assert np.array_equal(store.static, np.concatenate([s.static for s in shards]))
+    assert np.array_equal(store.probabilities[:, store.species_column("Pfifferling")],
+                          np.concatenate([s.probabilities[:, 1] for s in shards]))
+    with pytest.raises(ValueError):
+        store.species_column("Fliegenpilz")
+
+
+def test_concatenate_checks_the_species():
+    rng = np.random.default_rng(9)
+    grid = grid_spec.GridSpec([50, 7], 0.001, 0.001, 1, 2, 2)
+    shards = [shard(grid, 0, 4, rng, [], [], ["Steinpilz"]), shard(grid, 4, 4, rng, [], [], ["Pfifferling"])]
+    with pytest.raises(ValueError):
+        point_store.concatenate(shards)
+
+
+def test_map_needs_all_points_of_the_grid():
+    rng = np.random.default_rng(10)
+    grid = grid_spec.GridSpec([50, 7], 0.001, 0.001, 3, 2, 2)
+    # The first shard of an interrupted reparse is missing
+    store = point_store.concatenate([shard(grid, 8, 8, rng, [], [], ["Steinpilz"]),
+                                     shard(grid, 16, 8, rng, [], [], ["Steinpilz"])])
+    assert store.first == 8
+    assert len(store) == 16
+    with pytest.raises(ValueError):
+        io_utils.write_map([], store, workers=1)
@@ -0,0 +1,103 @@
+import types
+
+import numpy as np
+
+import constants
+import polygon_utils
+
+'''
+Point-in-polygon tests of whole groups of points against the flat shapes and the shapes stored on disk.
+'''
+
+
+def test_serial_and_parallel_kernel_find_the_same_shapes():
+    rng = np.random.default_rng(2)
+    shapes = []
+    for _ in range(30):
+        center = rng.uniform(0, 10, 2)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(3, 10)))
+        outer = center + np.column_stack((np.cos(angles), np.sin(angles))) * rng.uniform(0.5, 1.5, (len(angles), 1))
+        # A square hole in the middle of every second shape
+        holes = [center + np.array([[-0.2, -0.2], [-0.2, 0.2], [0.2, 0.2], [0.2, -0.2]])] if len(shapes) % 2 else []
+        shapes.append([outer] + holes)
+    coords, ring_offsets, shape_offsets = polygon_utils.flatten_shapes(shapes)
+    bboxes = polygon_utils.flat_bboxes(coords, ring_offsets, shape_offsets)
+
+    # Each group of points only tests a random part of the shapes
+    points = rng.uniform(-1, 11, (5000, 2))
+    groups = rng.integers(0, 4, len(points))
+    candidates = [np.sort(rng.choice(len(shapes), 20, replace=False)) for _ in range(4)]
+    candidate_offsets = np.concatenate(([0], np.cumsum([len(c) for c in candidates])))
+    candidates = np.concatenate(candidates)
+
+    serial = polygon_utils.points_in_shapes(points, candidate_offsets, candidates, coords, ring_offsets, shape_offsets,
+                                            bboxes, groups, parallel=False)
+    parallel = polygon_utils.points_in_shapes(points, candidate_offsets, candidates, coords, ring_offsets,
+                                              shape_offsets, bboxes, groups, parallel=True)
+
+    assert np.array_equal(serial, parallel)
+    assert np.any(serial == constants.no_match)
+    # Every found shape is the first candidate of the group that contains the point
+    for i in range(0, len(points), 50):
+        group_candidates = candidates[candidate_offsets[groups[i]]:candidate_offsets[groups[i] + 1]]
+        containing = [s for s in group_candidates
+                      if polygon_utils.flat_shape_contains_point(coords, ring_offsets, shape_offsets, s, *points[i])]
+        assert serial[i] == (containing[0] if containing else constants.no_match)
+    # Points in a hole are not in the shape
+    center = shapes[1][1].mean(axis=0)
+    assert not polygon_utils.flat_shape_contains_point(coords, ring_offsets, shape_offsets, 1, *center)
+
+
+def square(center, radius):
+    # Corners of a square as [longitude, latitude], the order of the shape files
+    return [[center[1] - radius, center[0] - radius], [center[1] + radius, center[0] - radius],
+            [center[1] + radius, center[0] + radius], [center[1] - radius, center[0] + radius]]
+
+
+def shapefile_shape(rings):
+    # A shape as read by pyshp: all points in one list, parts holds the index of the first point of each ring
+    parts = list(np.cumsum([0] + [len(ring) for ring in rings[:-1]]))
+    return types.SimpleNamespace(parts=parts, points=[point for ring in rings for point in ring])
+
+
+def test_flatten_shapefile_keeps_all_parts():
+    shapes = [shapefile_shape([square([5, 5], 2)]),
+              # Outer border with two holes, the last one used to be dropped
+              shapefile_shape([square([0, 0], 3), square([-1, -1], 0.5), square([1, 1], 0.5)])]
+    coords, ring_offsets, shape_offsets = polygon_utils.flatten_shapefile(shapes)
+
+    assert list(shape_offsets) == [0, 1, 4]
+    assert list(ring_offsets) == [0, 4, 8, 12, 16]
+    # Latitude first
+    assert np.array_equal(coords, np.concatenate([np.array(shape.points)[:, ::-1] for shape in shapes]))
+    # The point in the last hole does not lie in the shape anymore
+    assert polygon_utils.flat_shape_contains_point(coords, ring_offsets, shape_offsets, 1, 0.0, 0.0)
+    assert not polygon_utils.flat_shape_contains_point(coords, ring_offsets, shape_offsets, 1, -1.0, -1.0)
+    assert not polygon_utils.flat_shape_contains_point(coords, ring_offsets, shape_offsets, 1, 1.0, 1.0)
+
+
+def test_store_round_trip(tmp_path):
+    shapes = [shapefile_shape([square([5, 5], 2)]),
+              shapefile_shape([square([0, 0], 3), square([-1, -1], 0.5), square([1, 1], 0.5)]),
+              shapefile_shape([square([10, 0], 1), square([10, 0], 0.25)])]
+    store = polygon_utils.create_store(polygon_utils.flatten_shapefile(shapes), ["Laubwaelder", "Nadelwaelder",
+                                                                                 "Laubwaelder"])
+    folder = str(tmp_path / "trees")
+    polygon_utils.write_store(store, folder)
+    # Writing again replaces the store
+    polygon_utils.write_store(store, folder)
+    read = polygon_utils.read_store(folder)
+
+    for name in polygon_utils.store_arrays:
+        assert isinstance(getattr(read, name), np.memmap)
+        assert getattr(read, name).dtype == getattr(store, name).dtype
+        assert np.array_equal(getattr(read, name), getattr(store, name))
+    assert read.names == ["Laubwaelder", "Nadelwaelder"]
+    assert list(read.codes) == [0, 1, 0]
+    assert np.array_equal(read.bboxes[1], [-3, -3, 3, 3])
+    # The memory-mapped store finds the same shapes, holes included
+    points = np.array([[5, 5], [0, 0], [-1, -1], [1, 1], [10, 0], [10.5, 0.5], [20, 20]], dtype=np.float64)
+    candidate_offsets = np.array([0, 3])
+    candidates = np.arange(3)
+    found = polygon_utils.points_in_shapes(points, candidate_offsets, candidates, *read.shapes(), read.bboxes)
+    assert list(found) == [0, 1, constants.no_match, constants.no_match, constants.no_match, 2, constants.no_match]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import polygonize_utils
+
+shapely = pytest.importorskip("shapely")
+
+'''
+The polygons of a raster are checked with shapely: every polygon has to be valid and the polygons of each class have to
+cover exactly the cells of that class.
+'''
+
+
+def polygons_of(raster):
+    # One cell is one square unit, the cell [i, j] covers lon j - 0.5 to j + 0.5 and lat i - 0.5 to i + 0.5
+    coords, ring_offsets, polygon_offsets, values = polygonize_utils.polygonize_arrays(raster, [0, 0], [1, 1])
+    polygons = []
+    for p in range(len(values)):
+        rings = [coords[ring_offsets[r]:ring_offsets[r + 1]] for r in range(polygon_offsets[p], polygon_offsets[p + 1])]
+        polygons.append([shapely.Polygon(rings[0], rings[1:]), values[p]])
+    return polygons
+
+
+def test_hole_touching_the_outer_border_at_a_corner():
+    # The hole in the middle touches the outside at the corner between [2, 2] and [3, 3]
+    raster = np.ones((4, 4))
+    raster[1:3, 1:3] = 0
+    raster[3, 3] = 0
+    polygons = polygons_of(raster)
+    assert len(polygons) == 1
+    assert shapely.is_valid(polygons[0][0])
+    assert polygons[0][0].area == 11
+    assert len(polygons[0][0].interiors) == 1
+
+
+def test_random_rasters_give_valid_polygons_of_the_cell_area():
+    rng = np.random.default_rng(18)
+    for _ in range(300):
+        raster = rng.choice([0, 0.5, 1], size=rng.integers(1, 12, 2))
+        polygons = polygons_of(raster)
+        for polygon, _ in polygons:
+            assert shapely.is_valid(polygon), shapely.is_valid_reason(polygon)
+        for value in (0.5, 1):
+            area = sum(polygon.area for polygon, polygon_value in polygons if polygon_value == value)
+            assert area == np.sum(raster == value)
+        # The polygons do not overlap
+        assert shapely.union_all([polygon for polygon, _ in polygons]).area == np.sum(raster > 0)
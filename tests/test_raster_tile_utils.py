@@ -0,0 +1,101 @@
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import constants
+import polygonize_utils
+import raster_tile_utils
+
+'''
+The written PNG tiles have to show the class of the closest point of the grid, each lower zoom level the rounded up
+mean of 2 x 2 pixels of the level above it.
+'''
+
+
+def decode_png(data):
+    # Palette indices of an 8 bit palette PNG as written by raster_tile_utils.encode_png, and its palette
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    chunks = {}
+    position = 8
+    while position < len(data):
+        length = struct.unpack(">I", data[position:position + 4])[0]
+        kind = data[position + 4:position + 8]
+        content = data[position + 8:position + 8 + length]
+        assert struct.unpack(">I", data[position + 8 + length:position + 12 + length])[0] == \
+               zlib.crc32(kind + content) & 0xffffffff
+        chunks[kind] = content
+        position += 12 + length
+    width, height, depth, color_type = struct.unpack(">IIBB", chunks[b"IHDR"][:10])
+    assert (depth, color_type) == (8, 3)
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8).reshape(height, width + 1)
+    assert np.all(rows[:, 0] == 0)
+    return rows[:, 1:], chunks[b"PLTE"], chunks[b"tRNS"]
+
+
+def read_level(directory, zoom):
+    # All tiles of a zoom level as one image in world pixels, returns the image and its first pixel (x, y)
+    size = constants.raster_tile_size
+    tiles = {}
+    for x in os.listdir(os.path.join(directory, str(zoom))):
+        for name in os.listdir(os.path.join(directory, str(zoom), x)):
+            with open(os.path.join(directory, str(zoom), x, name), "rb") as fp:
+                image, colors, alphas = decode_png(fp.read())
+            assert (colors, alphas) == raster_tile_utils.palette()
+            assert image.shape == (size, size)
+            tiles[(int(x), int(name[:-4]))] = image
+    first = np.min(list(tiles), axis=0)
+    last = np.max(list(tiles), axis=0)
+    level = np.zeros(((last[1] - first[1] + 1) * size, (last[0] - first[0] + 1) * size), dtype=np.uint8)
+    for (x, y), image in tiles.items():
+        level[(y - first[1]) * size:(y - first[1] + 1) * size, (x - first[0]) * size:(x - first[0] + 1) * size] = image
+    return level, first * size
+
+
+def pixel_class(raster, origin, steps, zoom, x, y):
+    # Class of the point closest to the middle of world pixel (x, y)
+    size = constants.raster_tile_size * 2 ** zoom
+    lon = (x + 0.5) / size * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * (y + 0.5) / size))))
+    row = int(np.round((lat - origin[0]) / steps[0]))
+    column = int(np.round((lon - origin[1]) / steps[1]))
+    if row < 0 or row >= raster.shape[0] or column < 0 or column >= raster.shape[1]:
+        return 0
+    return polygonize_utils.quantize(raster[row, column])
+
+
+def test_tiles_show_the_probabilities(tmp_path):
+    rng = np.random.default_rng(20)
+    # The area does not start at the edge of a tile and at zoom 8 and 7 its first tile is odd, so those levels are
+    # extended by raster_tile_utils.align
+    origin, steps = np.array([50.03, 7.61]), np.array([0.0009, 0.0014])
+    raster = rng.uniform(0, 1, (300, 400)).astype(np.float32)
+    raster[rng.random(raster.shape) < 0.3] = 0
+    raster[100:150, 200:260] = 0
+    directory = str(tmp_path / "Steinpilz")
+    raster_tile_utils.write_raster_pyramid(raster, origin, steps, "Steinpilz", workers=1, directory=directory)
+    assert sorted(os.listdir(directory)) == sorted(str(zoom) for zoom in range(constants.raster_min_zoom,
+                                                                                constants.raster_max_zoom + 1))
+
+    zoom = constants.raster_max_zoom
+    level, first = read_level(directory, zoom)
+    for y, x in zip(rng.integers(0, level.shape[0], 3000), rng.integers(0, level.shape[1], 3000)):
+        assert level[y, x] == pixel_class(raster, origin, steps, zoom, first[0] + x, first[1] + y)
+    assert np.any(level == 0) and np.any(level == constants.probability_classes)
+
+    while zoom > constants.raster_min_zoom:
+        zoom -= 1
+        lower, lower_first = read_level(directory, zoom)
+        # The pixels of the level above in the pixels of this level, pixels without a tile are 0
+        start = lower_first * 2
+        upper = np.zeros((lower.shape[0] * 2, lower.shape[1] * 2), dtype=np.int64)
+        offset = first - start
+        assert np.all(offset >= 0)
+        upper[offset[1]:offset[1] + level.shape[0], offset[0]:offset[0] + level.shape[1]] = level
+        summed = upper.reshape(lower.shape[0], 2, lower.shape[1], 2).sum(axis=(1, 3))
+        assert np.array_equal(lower, np.ceil(summed / 4))
+        # No pixel of the level above is outside of the tiles of this level
+        assert upper.sum() == level.sum()
+        level, first = lower, lower_first
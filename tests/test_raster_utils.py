@@ -0,0 +1,48 @@
+import numpy as np
+
+import constants
+import polygon_utils
+import raster_utils
+
+'''
+The rasterization has to mark exactly the grid points that polygon_utils.points_in_shapes finds in the shapes.
+'''
+
+
+def overhanging_shapes(rng, origin, size):
+    # Random shapes with a hole around points of the whole grid, most of them reach over at least one side of it
+    shapes = []
+    for _ in range(40):
+        center = origin + rng.uniform(-0.3, 1.3, 2) * size
+        angles = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(3, 12)))
+        radii = rng.uniform(0.1, 0.6, len(angles))
+        outer = center + np.column_stack((np.cos(angles), np.sin(angles))) * radii[:, None] * size
+        hole = center + rng.uniform(-0.05, 0.05, (4, 2)) * size
+        shapes.append([outer, hole])
+    # L-shaped shape with an arm below row 0 of the grid
+    shapes.append([origin + np.array([[-0.5, 0.2], [-0.2, 0.2], [-0.2, 0.5], [0.3, 0.5], [0.3, 0.8], [-0.5, 0.8]])
+                   * size])
+    return shapes
+
+
+def test_rasterize_shapes_matches_points_in_shapes():
+    rng = np.random.default_rng(3)
+    origin = np.array([49.36, 8.21])
+    steps = np.array([0.0011, 0.0017])
+    raster_shape = (37, 23)
+    size = steps * raster_shape
+
+    for _ in range(5):
+        shapes = polygon_utils.flatten_shapes(overhanging_shapes(rng, origin, size))
+        coords, ring_offsets, shape_offsets = shapes
+        bboxes = polygon_utils.flat_bboxes(coords, ring_offsets, shape_offsets)
+        shape_amount = len(shape_offsets) - 1
+
+        raster = raster_utils.rasterize_shapes(shapes, bboxes, np.arange(shape_amount), origin, steps, raster_shape)
+
+        i, j = np.meshgrid(np.arange(raster_shape[0]), np.arange(raster_shape[1]), indexing="ij")
+        points = origin + np.column_stack((i.ravel(), j.ravel())) * steps
+        expected = polygon_utils.points_in_shapes(points, np.array([0, shape_amount]), np.arange(shape_amount),
+                                                  coords, ring_offsets, shape_offsets, bboxes, parallel=False)
+        assert np.any(expected != constants.no_match)
+        assert np.array_equal(raster.ravel(), expected)
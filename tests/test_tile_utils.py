@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import constants
+import tile_utils
+
+mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+
+'''
+The vector tiles are encoded by hand, so they are decoded again with the reference decoder mapbox_vector_tile.
+'''
+
+
+def test_encoded_tile_decodes_to_the_clipped_polygons():
+    x, y = 3, 5
+    outer = [[100, 100], [3000, 100], [3000, 2000], [100, 2000]]
+    hole = [[500, 500], [500, 800], [900, 800], [900, 500]]
+    # Reaches into the neighbouring tiles, so it is cut at the buffer around the tile
+    large = [[-1000, 3000], [5000, 3000], [5000, 5000], [-1000, 5000]]
+    level = {"pixels": np.array(outer + hole + large, dtype=np.float64) + np.array([x, y]) * constants.tile_extent,
+             "ring_offsets": np.array([0, 4, 8, 12]), "polygon_offsets": np.array([0, 2, 3]),
+             "values": np.array([0.25, 0.5])}
+
+    tile = tile_utils.encode_tile(level, x, y, [0, 1], "Steinpilz")
+    layer = mapbox_vector_tile.decode(tile, default_options={"y_coord_down": True})["Steinpilz"]
+
+    assert layer["extent"] == constants.tile_extent
+    assert [feature["properties"]["probability"] for feature in layer["features"]] == [0.25, 0.5]
+    assert layer["features"][0]["geometry"] == {"type": "Polygon",
+                                                "coordinates": [outer + [outer[0]], hole + [hole[0]]]}
+    low, high = -constants.tile_buffer, constants.tile_extent + constants.tile_buffer
+    assert layer["features"][1]["geometry"] == {"type": "Polygon", "coordinates": [
+        [[low, high], [low, 3000], [high, 3000], [high, high], [low, high]]]}
+
+
+def test_polygons_outside_of_the_tile_are_left_out():
+    level = {"pixels": np.array([[10, 10], [20, 10], [20, 20], [10, 20]], dtype=np.float64),
+             "ring_offsets": np.array([0, 4]), "polygon_offsets": np.array([0, 1]), "values": np.array([1.0])}
+    assert tile_utils.encode_tile(level, 2, 2, [0], "Steinpilz") is None
+
+
+def test_polygon_over_many_tiles_is_cut_into_each_tile():
+    shapely = pytest.importorskip("shapely")
+    extent, buffer = constants.tile_extent, constants.tile_buffer
+    # Polygon with a hole over 4 x 3 tiles, the tiles of a column share the cut along the first axis
+    outer = np.array([[1000, 500], [15000, 2000], [14000, 11500], [500, 11000]], dtype=np.float64)
+    hole = np.array([[5000, 4000], [5000, 7000], [9000, 7000], [9000, 4000]], dtype=np.float64)
+    level = {"pixels": np.vstack((outer, hole)), "ring_offsets": np.array([0, 4, 8]),
+             "polygon_offsets": np.array([0, 2]), "values": np.array([0.5])}
+    polygon = shapely.Polygon(outer, [hole])
+
+    for x in range(4):
+        columns = {}
+        for y in range(3):
+            tile = tile_utils.encode_tile(level, x, y, [0], "Steinpilz", columns)
+            box = shapely.box(x * extent - buffer, y * extent - buffer, (x + 1) * extent + buffer,
+                              (y + 1) * extent + buffer)
+            expected = shapely.affinity.translate(polygon.intersection(box), -x * extent, -y * extent)
+            layer = mapbox_vector_tile.decode(tile, default_options={"y_coord_down": True})["Steinpilz"]
+            decoded = shapely.geometry.shape(layer["features"][0]["geometry"])
+            # The corners are rounded to whole tile units
+            assert abs(decoded.area - expected.area) < 0.01 * expected.area
+            assert decoded.symmetric_difference(expected).area < 0.01 * expected.area
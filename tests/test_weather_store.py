@@ -0,0 +1,74 @@
+import datetime
+
+import numpy as np
+
+import constants
+import utils
+import weather_store
+
+'''
+Incremental fetching of the weather: days are stored once they are fetched and only fetched again until they are
+final.
+'''
+
+
+class RecordingBackend:
+    # Backend in the format of environment_utils.DwdBackend that remembers which days were fetched
+
+    def __init__(self, temperature):
+        self.temperature = temperature
+        self.fetched = {}
+
+    def fetch(self, station_id, days):
+        self.fetched.setdefault(station_id, []).extend(days)
+        return [{"temperature_max_200": self.temperature, "humidity": 80, "precipitation_height": 1.5} for _ in days]
+
+
+def test_days_are_final_after_weather_final_days(tmp_path):
+    con = weather_store.connect(str(tmp_path / "weather.db"))
+    day = datetime.datetime(2023, 9, 1, 12)
+    record = {"temperature": 20.0, "rain": 0.5, "humidity": 70.0}
+
+    # Fetched on the next day, DWD may still correct it
+    weather_store.insert(con, {1: [record]}, [day], fetch_day=day + datetime.timedelta(days=1))
+    assert weather_store.missing_days(con, [1, 2], [day]) == {1: [day], 2: [day]}
+
+    # Fetched again once it can no longer be corrected
+    weather_store.insert(con, {1: [record]}, [day],
+                         fetch_day=day + datetime.timedelta(days=constants.weather_final_days))
+    assert weather_store.missing_days(con, [1, 2], [day]) == {2: [day]}
+    con.close()
+
+
+def test_only_days_that_are_not_final_are_fetched_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(weather_store, "store_file", str(tmp_path / "weather.db"))
+    today = datetime.datetime.today()
+    days = utils.weather_days(today)
+    recent = [day for day in days if (today - day).days < constants.weather_final_days]
+    assert 0 < len(recent) < len(days)
+
+    first = RecordingBackend(20.0)
+    weather = utils.add_weather([5, 3, 5], first, today)
+    assert first.fetched == {3: days, 5: days}
+    assert np.all(weather.variable("temperature") == 20.0)
+
+    # The next run only fetches the days that may still have been corrected, and keeps their new values
+    second = RecordingBackend(25.0)
+    weather = utils.add_weather([3, 5], second, today)
+    assert second.fetched == {3: recent, 5: recent}
+    corrected = np.array([day in recent for day in days])
+    assert np.all(weather.variable("temperature")[:, corrected] == 25.0)
+    assert np.all(weather.variable("temperature")[:, ~corrected] == 20.0)
+
+
+def test_empty_requests(tmp_path):
+    con = weather_store.connect(str(tmp_path / "weather.db"))
+    day = datetime.datetime(2023, 9, 1, 12)
+    weather_store.insert(con, {1: [{"temperature": 20.0, "rain": 0.5, "humidity": 70.0}]}, [day])
+
+    assert weather_store.missing_days(con, [1], []) == {}
+    assert weather_store.missing_days(con, [], [day]) == {}
+    weather = weather_store.load(con, [], [day])
+    assert weather.values.shape == (0, 1, len(weather_store.weather_variables))
+    assert weather_store.load(con, [1], []).values.shape == (1, 0, len(weather_store.weather_variables))
+    con.close()
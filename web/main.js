@@ -3,62 +3,87 @@ import View from './node_modules/ol/View.js';
 
 import TileLayer from './node_modules/ol/layer/Tile.js';
 import OSM from './node_modules/ol/source/OSM';
-import GeoJSON from './node_modules/ol/format/GeoJSON';
-import VectorLayer from './node_modules/ol/layer/Vector';
-import VectorSource from './node_modules/ol/source/Vector';
+import XYZ from './node_modules/ol/source/XYZ';
+import MVT from './node_modules/ol/format/MVT';
+import VectorTileLayer from './node_modules/ol/layer/VectorTile';
+import VectorTileSource from './node_modules/ol/source/VectorTile';
 import {Fill, Style} from './node_modules/ol/style';
 
 
-const source = new VectorSource({
-  title: 'added Layer',
-  url: './data.txt',
-  format: new GeoJSON(),
-});
+// Image tiles of the zoomed out views and vector tiles of the closer views written by io_utils.write_map
+// Their zoom levels are listed in tiles/tiles.json, the sources are created once the species is known
+const layer_images = new TileLayer();
 
-const layer = new VectorLayer({
-  source: source,
+const layer = new VectorTileLayer({
   style: function (feature) {
     return new Style({
       fill: new Fill({
-        color: feature.getProperties().color,
+        color: 'rgba(0, 255, 0, ' + Math.min(0.5 * feature.get('probability'), 0.5) + ')',
       }),
     });
   },
 });
 
 
-const source_grainy = new VectorSource({
-  title: 'added Layer',
-  url: './data_grainy.txt',
-  format: new GeoJSON(),
-});
- 
-const layer_grainy = new VectorLayer({
-  source: source_grainy,
-  style: function (feature) {
-    return new Style({
-      fill: new Fill({
-        color: feature.getProperties().color,
-      }),
-    });
-  },
-});
-
-layer.setMinZoom(10.5);
-
-layer_grainy.setMaxZoom(10.5);
-
-
 const map = new Map({
   target: 'map',
   layers: [
     new TileLayer({
       source: new OSM()
     }),
-    layer,layer_grainy,
+    layer, layer_images,
   ],
   view: new View({
     center: [1118760.88, 6636047.68],
     zoom: 7
   })
-});
\ No newline at end of file
+});
+
+// Every species has its own tiles, the species are listed in tiles/species.json
+let levels = {};
+
+function showSpecies(name) {
+  const tiles = './tiles/' + encodeURIComponent(name) + '/{z}/{x}/{y}';
+  if (levels.images) {
+    layer_images.setSource(new XYZ({
+      url: tiles + '.png',
+      minZoom: levels.images.min_zoom,
+      maxZoom: levels.images.max_zoom,
+    }));
+  }
+  // Only the tiles of the visible area are loaded, closer zoom levels than max_zoom reuse the tiles of max_zoom
+  if (levels.vectors) {
+    layer.setSource(new VectorTileSource({
+      format: new MVT(),
+      url: tiles + '.pbf',
+      minZoom: levels.vectors.min_zoom,
+      maxZoom: levels.vectors.max_zoom,
+    }));
+  }
+}
+
+const select = document.getElementById('species');
+select.addEventListener('change', function () {
+  showSpecies(select.value);
+});
+
+Promise.all([fetch('./tiles/species.json'), fetch('./tiles/tiles.json')])
+  .then((responses) => Promise.all(responses.map((response) => response.json())))
+  .then(([species, tiles]) => {
+    levels = tiles;
+    // The image tiles are shown until the vector tiles start
+    if (levels.images && levels.vectors) {
+      layer.setMinZoom(levels.vectors.min_zoom - 0.5);
+      layer_images.setMaxZoom(levels.vectors.min_zoom - 0.5);
+    }
+    for (const name of species) {
+      const option = document.createElement('option');
+      option.value = name;
+      option.text = name;
+      select.appendChild(option);
+    }
+    if (species.includes('Steinpilz')) {
+      select.value = 'Steinpilz';
+    }
+    showSpecies(select.value);
+  });